@@ -0,0 +1,120 @@
+"""
+Benchmark for cosilico_py.preprocessing.core.tiling.compute_grid_centroids_multi.
+
+Compares the bincount engine (optionally in pyramid mode) against the original np.unique/np.add.at path on synthetic transcripts.
+With --workers, the bincount engine is additionally run at each worker count and speedup versus one worker is reported.
+
+    python benchmarks/grid_centroids.py --sizes 10M,100M,500M --output grid_centroids.json
+    python benchmarks/grid_centroids.py --sizes 100M --engines bincount --workers 1,2,4,8,16,32,64
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from cosilico_py.preprocessing.core.tiling import compute_grid_centroids_multi
+
+
+def parse_size(s):
+    units = {'K': 1_000, 'M': 1_000_000, 'B': 1_000_000_000}
+    s = s.strip().upper()
+    if s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+def synthetic_transcripts(n, n_features=500, extent=50_000, seed=0):
+    """
+    Xenium-like transcripts with uniformly scattered locations and a skewed feature distribution.
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1. / np.arange(1, n_features + 1)
+    feature_index = rng.choice(n_features, size=n, p=weights / weights.sum()).astype(np.int16)
+    return pd.DataFrame({
+        'feature_index': pd.Categorical(feature_index),
+        'x_location': rng.uniform(0, extent, n).astype(np.float32),
+        'y_location': rng.uniform(0, extent, n).astype(np.float32),
+        'qv': rng.uniform(20, 40, n).astype(np.float32),
+    })
+
+def run(df, engine, bin_sizes, chunk_size, use_disk, target_columns, n_workers=1):
+    pyramid = engine == 'pyramid'
+    start = time.perf_counter()
+    results = compute_grid_centroids_multi(
+        df, bin_sizes, chunk_size=chunk_size, use_disk=use_disk,
+        target_columns=target_columns, engine='bincount' if pyramid else engine, pyramid=pyramid,
+        n_workers=n_workers
+    )
+    return time.perf_counter() - start, results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10M,100M,500M', help='Comma separated number of rows to benchmark.')
+    parser.add_argument('--bin-sizes', default='256,512,768', help='Comma separated bin sizes.')
+    parser.add_argument('--engines', default='unique,bincount', help='Comma separated engines to compare. "pyramid" runs the bincount engine with pyramid=True.')
+    parser.add_argument('--workers', default=None, help='Comma separated worker counts to run the bincount engine with.')
+    parser.add_argument('--chunk-size', type=int, default=10_000_000)
+    parser.add_argument('--use-disk', action='store_true')
+    parser.add_argument('--with-targets', action='store_true', help='Also compute means of a qv column.')
+    parser.add_argument('--output', default=None, help='Optional path to write JSON results.')
+    args = parser.parse_args()
+
+    bin_sizes = [int(x) for x in args.bin_sizes.split(',')]
+    engines = args.engines.split(',')
+    target_columns = ['qv'] if args.with_targets else None
+
+    records = []
+    for size in args.sizes.split(','):
+        n = parse_size(size)
+        df = synthetic_transcripts(n)
+        columns = ['feature_index', 'x_location', 'y_location'] + (target_columns or [])
+
+        engine_results = {}
+        for engine in engines:
+            elapsed, results = run(df[columns], engine, bin_sizes, args.chunk_size, args.use_disk, target_columns)
+            engine_results[engine] = results
+            records.append({
+                'rows': n,
+                'engine': engine,
+                'n_workers': 1,
+                'bin_sizes': bin_sizes,
+                'chunk_size': args.chunk_size,
+                'seconds': elapsed,
+                'rows_per_second': n / elapsed,
+            })
+            print(f'{n:>13,} rows  {engine:>9}  {elapsed:9.2f}s')
+
+        # outputs only match exactly when everything fits in one chunk, the unique engine averages chunk means
+        if n <= args.chunk_size and len(engine_results) > 1:
+            base, *others = engine_results.values()
+            for other in others:
+                for bin_size in bin_sizes:
+                    pd.testing.assert_frame_equal(base[bin_size], other[bin_size], check_exact=False)
+
+        if args.workers is not None:
+            baseline = None
+            for n_workers in [int(x) for x in args.workers.split(',')]:
+                elapsed, _ = run(df[columns], 'bincount', bin_sizes, args.chunk_size, args.use_disk, target_columns, n_workers=n_workers)
+                baseline = elapsed if baseline is None else baseline
+                records.append({
+                    'rows': n,
+                    'engine': 'bincount',
+                    'n_workers': n_workers,
+                    'bin_sizes': bin_sizes,
+                    'chunk_size': args.chunk_size,
+                    'seconds': elapsed,
+                    'rows_per_second': n / elapsed,
+                    'speedup': baseline / elapsed,
+                })
+                print(f'{n:>13,} rows  {n_workers:>3} workers  {elapsed:9.2f}s  {baseline / elapsed:5.2f}x')
+
+        del df, engine_results
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(records, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Deterministic generator of synthetic Xenium-like outs directories.
+
+Writes transcripts.parquet, cell_boundaries.parquet, cell_feature_matrix.h5, experiment.xenium and a small
+morphology_focus.ome.tif that together can be loaded by
+cosilico_py.preprocessing.platforms.experiment_from_x10_xenium_cellranger.
+
+    python benchmarks/synthetic_xenium.py outs/ --transcripts 10M --cells 100k
+"""
+from pathlib import Path
+import argparse
+import json
+
+import h5py
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tifffile
+
+
+SCALES = {
+    'small': {'n_transcripts': 1_000_000, 'n_cells': 10_000},
+    'medium': {'n_transcripts': 50_000_000, 'n_cells': 200_000},
+    'large': {'n_transcripts': 500_000_000, 'n_cells': 2_000_000},
+}
+
+def parse_count(s):
+    units = {'K': 1_000, 'M': 1_000_000, 'B': 1_000_000_000}
+    s = str(s).strip().upper()
+    if s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+def get_layout(n_cells, cell_area=100.):
+    """
+    Square tissue extent in microns that fits n_cells cells of cell_area square microns.
+    """
+    return float(np.ceil(np.sqrt(n_cells * cell_area)))
+
+def get_cell_ids(n_cells):
+    return np.asarray([f'{i:08x}-1' for i in range(n_cells)], dtype=object)
+
+def get_feature_names(n_features, n_controls):
+    genes = [f'GENE{i:04d}' for i in range(n_features)]
+    controls = [f'NegControlProbe_{i:04d}' for i in range(n_controls)]
+    return genes, controls
+
+def write_experiment_file(path, n_features):
+    meta = {
+        'run_name': 'synthetic',
+        'region_name': 'region',
+        'run_start_time': '2025-01-01T00:00:00+00:00',
+        'panel_name': f'Synthetic {n_features} gene panel',
+        'pixel_size': 0.2125,
+        'analysis_sw_version': 'synthetic',
+    }
+    with open(path, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+def write_ome_tiff(path, extent, max_image_size=4096, seed=0):
+    """
+    Small uint16 morphology image. Pixels are made coarser than Xenium's 0.2125um so the image stays small
+    while covering the whole tissue extent.
+    """
+    size = int(min(max_image_size, np.ceil(extent / 0.2125)))
+    physical_size = extent / size
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 4096, size=(size, size), dtype=np.uint16)
+    tifffile.imwrite(
+        path,
+        image,
+        ome=True,
+        photometric='minisblack',
+        metadata={
+            'axes': 'YX',
+            'PhysicalSizeX': physical_size,
+            'PhysicalSizeXUnit': 'µm',
+            'PhysicalSizeY': physical_size,
+            'PhysicalSizeYUnit': 'µm',
+        },
+    )
+    return size, physical_size
+
+def get_cell_centers(n_cells, extent, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0, extent, size=(n_cells, 2)).astype(np.float32)
+
+def write_cell_boundaries(path, centers, n_vertices=13, radius=5., batch_size=1_000_000, seed=0):
+    """
+    Jittered, closed polygons around each cell center. Xenium writes 13 vertices per cell with the first repeated last.
+    """
+    rng = np.random.default_rng(seed)
+    cell_ids = get_cell_ids(len(centers))
+    angles = np.linspace(0, 2 * np.pi, n_vertices - 1, endpoint=False)
+    schema = pa.schema([('cell_id', pa.string()), ('vertex_x', pa.float32()), ('vertex_y', pa.float32())])
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, len(centers), batch_size):
+            c = centers[start:start + batch_size]
+            r = radius * rng.uniform(0.6, 1.4, size=(len(c), n_vertices - 1))
+            xs = c[:, :1] + r * np.cos(angles)
+            ys = c[:, 1:] + r * np.sin(angles)
+            xs = np.concatenate([xs, xs[:, :1]], axis=1).astype(np.float32)
+            ys = np.concatenate([ys, ys[:, :1]], axis=1).astype(np.float32)
+            ids = np.repeat(cell_ids[start:start + batch_size], n_vertices)
+            writer.write_table(pa.table({'cell_id': ids, 'vertex_x': xs.ravel(), 'vertex_y': ys.ravel()}, schema=schema))
+
+def write_transcripts(path, centers, n_transcripts, genes, controls, extent, control_fraction=0.01,
+                      background_fraction=0.1, spread=4., batch_size=10_000_000, seed=0):
+    """
+    Transcripts scattered around cell centers plus uniform background, with a skewed gene distribution.
+    """
+    rng = np.random.default_rng(seed)
+    names = genes + controls
+    weights = 1. / np.arange(1, len(genes) + 1)
+    gene_p = weights / weights.sum()
+    categories = ['predesigned_gene'] * len(genes) + ['negative_control_probe'] * len(controls)
+
+    schema = pa.schema([
+        ('transcript_id', pa.uint64()),
+        ('cell_id', pa.string()),
+        ('overlaps_nucleus', pa.uint8()),
+        ('feature_name', pa.dictionary(pa.int16(), pa.string())),
+        ('x_location', pa.float32()),
+        ('y_location', pa.float32()),
+        ('z_location', pa.float32()),
+        ('qv', pa.float32()),
+        ('is_gene', pa.bool_()),
+        ('codeword_category', pa.dictionary(pa.int8(), pa.string())),
+    ])
+    name_dictionary = pa.array(names, type=pa.string())
+    category_dictionary = pa.array(['predesigned_gene', 'negative_control_probe'], type=pa.string())
+    category_codes = np.asarray([0 if c == 'predesigned_gene' else 1 for c in categories], dtype=np.int8)
+    cell_id_dictionary = pa.array(np.append(get_cell_ids(len(centers)), 'UNASSIGNED'), type=pa.string())
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, n_transcripts, batch_size):
+            n = min(batch_size, n_transcripts - start)
+
+            feature_codes = rng.choice(len(genes), size=n, p=gene_p).astype(np.int16)
+            is_control = rng.random(n) < control_fraction
+            if controls:
+                feature_codes[is_control] = len(genes) + rng.integers(0, len(controls), size=is_control.sum())
+
+            cell_idx = rng.integers(0, len(centers), size=n)
+            is_background = rng.random(n) < background_fraction
+            xy = centers[cell_idx] + rng.normal(0, spread, size=(n, 2)).astype(np.float32)
+            xy[is_background] = rng.uniform(0, extent, size=(is_background.sum(), 2))
+            xy = np.clip(xy, 0, extent - 1e-3).astype(np.float32)
+
+            cell_idx[is_background] = len(centers)
+            table = pa.table({
+                'transcript_id': np.arange(start, start + n, dtype=np.uint64) + 281_474_976_710_656,
+                'cell_id': cell_id_dictionary.take(pa.array(cell_idx)),
+                'overlaps_nucleus': rng.integers(0, 2, size=n, dtype=np.uint8),
+                'feature_name': pa.DictionaryArray.from_arrays(feature_codes, name_dictionary),
+                'x_location': xy[:, 0],
+                'y_location': xy[:, 1],
+                'z_location': rng.uniform(0, 20, size=n).astype(np.float32),
+                'qv': rng.uniform(10, 40, size=n).astype(np.float32),
+                'is_gene': category_codes[feature_codes] == 0,
+                'codeword_category': pa.DictionaryArray.from_arrays(category_codes[feature_codes], category_dictionary),
+            }, schema=schema)
+            writer.write_table(table)
+
+def write_cell_feature_matrix(path, n_cells, genes, controls, mean_genes_per_cell=50, batch_size=10_000, seed=0):
+    """
+    10x formatted h5 count matrix, stored as CSC with one column per cell.
+    """
+    rng = np.random.default_rng(seed)
+    names = genes + controls
+    n_features = len(names)
+    cell_ids = get_cell_ids(n_cells)
+
+    with h5py.File(path, 'w') as f:
+        grp = f.create_group('matrix')
+        grp.create_dataset('barcodes', data=np.asarray(cell_ids, dtype='S'))
+        grp.create_dataset('shape', data=np.asarray([n_features, n_cells], dtype=np.int32))
+        features = grp.create_group('features')
+        features.create_dataset('id', data=np.asarray(names, dtype='S'))
+        features.create_dataset('name', data=np.asarray(names, dtype='S'))
+        features.create_dataset('feature_type', data=np.asarray(
+            ['Gene Expression'] * len(genes) + ['Negative Control Probe'] * len(controls), dtype='S'))
+        features.create_dataset('genome', data=np.asarray(['synthetic'] * n_features, dtype='S'))
+
+        data = grp.create_dataset('data', shape=(0,), maxshape=(None,), dtype=np.int32, chunks=(1 << 20,))
+        indices = grp.create_dataset('indices', shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(1 << 20,))
+        indptr = np.zeros(n_cells + 1, dtype=np.int64)
+
+        nnz = 0
+        for start in range(0, n_cells, batch_size):
+            n = min(batch_size, n_cells - start)
+            per_cell = np.minimum(rng.poisson(mean_genes_per_cell, size=n), n_features)
+            # sample genes without replacement per cell via random keys
+            ranks = np.argsort(rng.random((n, n_features)), axis=1)
+            mask = np.arange(n_features) < per_cell[:, None]
+            selected = np.where(mask, ranks, n_features)
+            selected.sort(axis=1)
+            batch_indices = selected[mask]
+            batch_data = rng.geometric(0.3, size=len(batch_indices)).astype(np.int32)
+
+            data.resize((nnz + len(batch_data),))
+            indices.resize((nnz + len(batch_indices),))
+            data[nnz:] = batch_data
+            indices[nnz:] = batch_indices
+            indptr[start + 1:start + n + 1] = nnz + np.cumsum(per_cell)
+            nnz += len(batch_data)
+
+        grp.create_dataset('indptr', data=indptr)
+
+def generate_xenium_outs(
+        directory,
+        n_transcripts=1_000_000,
+        n_cells=10_000,
+        n_features=300,
+        n_controls=20,
+        max_image_size=4096,
+        seed=0,
+    ):
+    """
+    Writes a synthetic Xenium outs directory. Returns a dict describing what was generated.
+    """
+    directory = Path(directory).expanduser().absolute()
+    directory.mkdir(parents=True, exist_ok=True)
+
+    extent = get_layout(n_cells)
+    genes, controls = get_feature_names(n_features, n_controls)
+    centers = get_cell_centers(n_cells, extent, seed=seed)
+
+    write_experiment_file(directory / 'experiment.xenium', n_features)
+    image_size, physical_size = write_ome_tiff(directory / 'morphology_focus.ome.tif', extent, max_image_size=max_image_size, seed=seed)
+    write_cell_boundaries(directory / 'cell_boundaries.parquet', centers, seed=seed + 1)
+    write_transcripts(directory / 'transcripts.parquet', centers, n_transcripts, genes, controls, extent, seed=seed + 2)
+    write_cell_feature_matrix(directory / 'cell_feature_matrix.h5', n_cells, genes, controls, seed=seed + 3)
+
+    return {
+        'directory': str(directory),
+        'n_transcripts': n_transcripts,
+        'n_cells': n_cells,
+        'n_features': n_features,
+        'n_controls': n_controls,
+        'extent_um': extent,
+        'image_size': image_size,
+        'physical_size_um': physical_size,
+        'seed': seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='Directory to write the synthetic outs to.')
+    parser.add_argument('--scale', choices=list(SCALES.keys()), default=None, help='Preset scale. Overridden by --transcripts/--cells.')
+    parser.add_argument('--transcripts', default=None, help='Number of transcripts, e.g. 10M.')
+    parser.add_argument('--cells', default=None, help='Number of cells, e.g. 100k.')
+    parser.add_argument('--features', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale or 'small'])
+    if args.transcripts is not None:
+        scale['n_transcripts'] = parse_count(args.transcripts)
+    if args.cells is not None:
+        scale['n_cells'] = parse_count(args.cells)
+
+    info = generate_xenium_outs(args.directory, n_features=args.features, seed=args.seed, **scale)
+    print(json.dumps(info, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Benchmark of the Xenium preprocessing pipeline on synthetic data.
+
+Generates synthetic Xenium outs (see synthetic_xenium.py) at each requested scale, runs the stages of
+cosilico_py.preprocessing.platforms.experiment_from_x10_xenium_cellranger with the same parameters the
+pipeline uses, and records wall time, CPU time, peak RSS, bytes written and output size for every stage
+and for the writers in layer.py and image.py that run inside it.
+
+    python benchmarks/xenium_pipeline.py --scales 1M:10k,10M:100k --output xenium_pipeline.json
+    python benchmarks/xenium_pipeline.py --scales 500M:2M --workdir /scratch/bench --keep
+"""
+from pathlib import Path
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic_xenium import generate_xenium_outs, parse_count
+
+from cosilico_py.preprocessing.core.image import get_resolutions, write_image_zarr_from_ome
+from cosilico_py.preprocessing.core.layer import (
+    combine_barcoded_data,
+    write_grouped_layer_zarr_from_df,
+    write_grouped_metadata_zarrs_from_df,
+    write_ungrouped_layer_zarr_from_df,
+    write_sparse_continuous_ungrouped_layer_metadata
+)
+from cosilico_py.preprocessing.core.profiling import StageProfiler, get_output_bytes
+from cosilico_py.preprocessing.core.zarr import open_zarr_zip
+from cosilico_py.preprocessing.platform_helpers.x10 import read_10x_h5
+from cosilico_py.preprocessing.platforms.x10_xenium import load_cell_df, load_transcript_df
+
+
+def get_cell_maps(zooms):
+    """
+    Per zoom polygon settings matching the defaults in the cosilico config: full detail at the finest zoom, downsampled above.
+    """
+    max_vert_map = {res: 32 if i == 0 else 4 for i, res in enumerate(zooms)}
+    downsample_map = {res: -1 if i == 0 else 100_000 for i, res in enumerate(zooms)}
+    object_type_map = {res: 'polygon' for res in zooms}
+    return max_vert_map, downsample_map, object_type_map
+
+def print_stage(record):
+    print(f'  {record["stage"]:<22} {record["wall_seconds"]:9.2f}s  {record["peak_rss_bytes"] / 1e9:7.2f} GB rss  {record.get("output_bytes", 0) / 1e6:10.1f} MB out')
+
+def run_pipeline(directory, output_directory, profiler):
+    """
+    Mirrors experiment_from_x10_xenium_cellranger, split into individually measured stages.
+    """
+    with profiler.stage('image') as record:
+        image = write_image_zarr_from_ome(
+            'benchmark', directory / 'morphology_focus.ome.tif', 'Xenium Morphology', output_directory,
+            tile_size=512, res_magnitude=4
+        )
+        record['output_bytes'] = get_output_bytes(image)
+    print_stage(record)
+    pixels = image.metadata.images[0].pixels
+    max_dim_size = max(pixels.size_x, pixels.size_y)
+    mpp = pixels.physical_size_x
+
+    with profiler.stage('load_transcripts') as record:
+        source = load_transcript_df(directory / 'transcripts.parquet', mpp=mpp)
+    print_stage(record)
+
+    tile_size = 4096
+    if tile_size > max_dim_size:
+        tile_size = 1 << (max_dim_size.bit_length() - 1)
+    res_magnitude = 4
+    zooms = get_resolutions(tile_size, max_dim_size, scaler=res_magnitude)
+    group_sizes = [int(1024 / (res_magnitude * 2)**i) for i in range(len(zooms))]
+    bin_size_map = {res:i * res_magnitude * 64 for i, res in enumerate(zooms) if i}
+
+    with profiler.stage('transcript_layer') as record:
+        transcript_layer = write_grouped_layer_zarr_from_df(
+            'benchmark', source, 'transcript_id', zooms, bin_size_map, group_sizes, output_directory,
+            (pixels.size_x, pixels.size_y), name='Transcripts', chunk_size=10_000_000, use_disk=True, pyramid=True,
+        )
+        record['output_bytes'] = get_output_bytes(transcript_layer)
+    print_stage(record)
+
+    with profiler.stage('transcript_metadata') as record:
+        store, root = open_zarr_zip(transcript_layer.local_path)
+        attrs = root.attrs.asdict()
+        zoom_to_order = {res:root[f'/metadata/ids/{res}'][:] for res in attrs['resolutions']}
+        fnames = root['/metadata/features/feature_names'][:]
+        store.close()
+
+        value_params = {'qv': {'name': 'QV', 'vmin': 0, 'vmax': 40}}
+        metas = write_grouped_metadata_zarrs_from_df(
+            transcript_layer.id, source, 'transcript_id', output_directory, bin_size_map, fnames, attrs,
+            zoom_to_order, value_params, 'feature_name', chunk_size=10_000_000, use_disk=True, pyramid=True,
+        )
+        record['output_bytes'] = get_output_bytes(metas)
+    print_stage(record)
+    del source
+
+    with profiler.stage('load_cells') as record:
+        df = load_cell_df(directory / 'cell_boundaries.parquet', mpp=mpp)
+    print_stage(record)
+
+    zooms = get_resolutions(4096, max_dim_size, scaler=2)
+    max_vert_map, downsample_map, object_type_map = get_cell_maps(zooms)
+
+    with profiler.stage('cell_layer') as record:
+        cell_layer = write_ungrouped_layer_zarr_from_df(
+            'benchmark', 'Cells', df, 'cell_id', zooms, output_directory, max_vert_map, downsample_map, object_type_map,
+        )
+        record['output_bytes'] = get_output_bytes(cell_layer)
+    print_stage(record)
+    del df
+
+    with profiler.stage('load_counts') as record:
+        adata = read_10x_h5(directory / 'cell_feature_matrix.h5')
+        counts = combine_barcoded_data(None, adata, chunk_size=1_000_000).sort_index()
+    print_stage(record)
+
+    with profiler.stage('cell_metadata') as record:
+        fnames = np.asarray(counts['feature_name'].cat.categories.to_list(), dtype=object)
+        meta = write_sparse_continuous_ungrouped_layer_metadata(
+            cell_layer.id, fnames, 'Transcript Counts', counts, 'count', cell_layer.local_path, output_directory,
+        )
+        record['output_bytes'] = get_output_bytes(meta)
+    print_stage(record)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1M:10k', help='Comma separated transcripts:cells pairs, e.g. 1M:10k,100M:500k,500M:2M.')
+    parser.add_argument('--features', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help='Directory for synthetic inputs and outputs. Default is a temporary directory.')
+    parser.add_argument('--keep', action='store_true', help='Keep generated inputs and outputs.')
+    parser.add_argument('--output', default=None, help='Optional path to write JSON results.')
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='cosilico_bench_')).expanduser().absolute()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    try:
+        for scale in args.scales.split(','):
+            n_transcripts, n_cells = (parse_count(x) for x in scale.split(':'))
+            scale_dir = workdir / f'{n_transcripts}_{n_cells}'
+            outs, output_directory = scale_dir / 'outs', scale_dir / 'cache'
+            output_directory.mkdir(parents=True, exist_ok=True)
+            print(f'{n_transcripts:,} transcripts, {n_cells:,} cells')
+
+            profiler = StageProfiler()
+            with profiler:
+                with profiler.stage('generate') as record:
+                    info = generate_xenium_outs(outs, n_transcripts=n_transcripts, n_cells=n_cells, n_features=args.features, seed=args.seed)
+                    record['output_bytes'] = get_output_bytes(outs)
+                print_stage(record)
+                run_pipeline(outs, output_directory, profiler)
+
+            report = profiler.report()
+            results.append({
+                'n_transcripts': n_transcripts,
+                'n_cells': n_cells,
+                'synthetic': info,
+                'stages': report['stages'],
+                'total_wall_seconds': sum(s['wall_seconds'] for s in report['stages'] if s['depth'] == 0 and s['stage'] != 'generate'),
+            })
+
+            if not args.keep:
+                shutil.rmtree(scale_dir)
+    finally:
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
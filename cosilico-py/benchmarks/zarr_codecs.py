@@ -0,0 +1,135 @@
+"""
+Benchmark of the zarr codec policies in cosilico_py.preprocessing.core.zarr.CODEC_POLICIES.
+
+Generates synthetic Xenium outs (see synthetic_xenium.py), writes the morphology image, transcript layer and
+cell layer once per policy, and reports the size of each .zarr.zip and how long it takes to decode every
+chunk in it. Decode time covers only the compressor and filters of each array, chunk bytes are read from
+the zip beforehand, so it approximates the per tile decode work done by the viewer.
+
+    python benchmarks/zarr_codecs.py --transcripts 1M --cells 10k
+    python benchmarks/zarr_codecs.py --policies default,zstd --output codecs.json
+"""
+from pathlib import Path
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic_xenium import generate_xenium_outs, parse_count
+from xenium_pipeline import get_cell_maps
+
+from cosilico_py.preprocessing.core.image import get_resolutions, write_image_zarr_from_ome
+from cosilico_py.preprocessing.core.layer import write_grouped_layer_zarr_from_df, write_ungrouped_layer_zarr_from_df
+from cosilico_py.preprocessing.core.zarr import CODEC_POLICIES, open_zarr_zip
+from cosilico_py.preprocessing.platforms.x10_xenium import load_cell_df, load_transcript_df
+
+
+def get_arrays(group):
+    arrays = list(group.arrays())
+    for _, child in group.groups():
+        arrays += get_arrays(child)
+    return arrays
+
+def get_decode_stats(zarr_path, repeats=3):
+    """
+    Number of chunks, decoded bytes and best of repeats seconds to decode every chunk of every array in zarr_path.
+    """
+    store, root = open_zarr_zip(zarr_path)
+    chunks = []
+    for _, arr in get_arrays(root):
+        prefix = f'{arr.path}/' if arr.path else ''
+        for key in store.listdir(arr.path):
+            if not key.startswith('.'):
+                chunks.append((arr, store[prefix + key]))
+    store.close()
+
+    best, n_bytes = None, 0
+    for _ in range(repeats):
+        n_bytes = 0
+        start = time.perf_counter()
+        for arr, cdata in chunks:
+            chunk = arr.compressor.decode(cdata) if arr.compressor is not None else cdata
+            for f in reversed(arr.filters or []):
+                chunk = f.decode(chunk)
+            n_bytes += np.asarray(chunk).nbytes
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'n_chunks': len(chunks), 'decoded_bytes': n_bytes, 'decode_seconds': best}
+
+def write_outputs(directory, output_directory, codecs):
+    """
+    Writes the image, transcript layer and cell layer with the same parameters as the Xenium pipeline. Returns name to path.
+    """
+    image = write_image_zarr_from_ome(
+        'benchmark', directory / 'morphology_focus.ome.tif', 'Xenium Morphology', output_directory,
+        tile_size=512, res_magnitude=4, codecs=codecs
+    )
+    pixels = image.metadata.images[0].pixels
+    max_dim_size = max(pixels.size_x, pixels.size_y)
+    mpp = pixels.physical_size_x
+
+    source = load_transcript_df(directory / 'transcripts.parquet', mpp=mpp)
+    tile_size = 4096
+    if tile_size > max_dim_size:
+        tile_size = 1 << (max_dim_size.bit_length() - 1)
+    zooms = get_resolutions(tile_size, max_dim_size, scaler=4)
+    group_sizes = [int(1024 / 8**i) for i in range(len(zooms))]
+    bin_size_map = {res:i * 4 * 64 for i, res in enumerate(zooms) if i}
+    transcripts = write_grouped_layer_zarr_from_df(
+        'benchmark', source, 'transcript_id', zooms, bin_size_map, group_sizes, output_directory,
+        (pixels.size_x, pixels.size_y), name='Transcripts', pyramid=True, codecs=codecs
+    )
+
+    df = load_cell_df(directory / 'cell_boundaries.parquet', mpp=mpp)
+    zooms = get_resolutions(4096, max_dim_size, scaler=2)
+    cells = write_ungrouped_layer_zarr_from_df(
+        'benchmark', 'Cells', df, 'cell_id', zooms, output_directory, *get_cell_maps(zooms), codecs=codecs
+    )
+    return {'image': image.local_path, 'transcripts': transcripts.local_path, 'cells': cells.local_path}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transcripts', default='1M')
+    parser.add_argument('--cells', default='10k')
+    parser.add_argument('--policies', default=','.join(CODEC_POLICIES), help='Comma separated names from CODEC_POLICIES.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help='Directory for synthetic inputs and outputs. Default is a temporary directory.')
+    parser.add_argument('--output', default=None, help='Optional path to write JSON results.')
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='cosilico_bench_')).expanduser().absolute()
+    outs = workdir / 'outs'
+    if not (outs / 'experiment.xenium').exists():
+        generate_xenium_outs(outs, n_transcripts=parse_count(args.transcripts), n_cells=parse_count(args.cells), seed=args.seed)
+
+    results = []
+    try:
+        for policy in args.policies.split(','):
+            output_directory = workdir / policy
+            output_directory.mkdir(parents=True, exist_ok=True)
+            start = time.perf_counter()
+            paths = write_outputs(outs, output_directory, policy)
+            write_seconds = time.perf_counter() - start
+
+            print(f'{policy} (written in {write_seconds:.2f}s)')
+            for name, path in paths.items():
+                stats = {'policy': policy, 'output': name, 'bytes': Path(path).stat().st_size, **get_decode_stats(path)}
+                results.append(stats)
+                print(f'  {name:<12} {stats["bytes"] / 1e6:9.2f} MB  {stats["n_chunks"]:7d} chunks  {stats["decode_seconds"] * 1e3:9.1f} ms decode  {stats["decoded_bytes"] / stats["decode_seconds"] / 1e9:6.2f} GB/s')
+            shutil.rmtree(output_directory)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
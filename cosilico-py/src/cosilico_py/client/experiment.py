@@ -6,7 +6,6 @@ import dask.dataframe as dd
 import numpy as np
 import pandas as pd
 import scipy
-import zarr
 from supabase import Client
 from pydantic import Field
 # from scipy.sparse import coo_matrix, csr_matrix
@@ -15,6 +14,7 @@ import cosilico_py.client.utils as utils
 from cosilico_py.config import get_config
 import cosilico_py.models as models
 import cosilico_py.preprocessing.core.layer as layer_utils
+from cosilico_py.preprocessing.core.zarr import open_zarr_zip
 from cosilico_py.storage import upload_object
 
 
@@ -132,24 +132,53 @@ def first_occurrence_indices(xs):
             idxs.append(i)
     return idxs
 
+def get_layer_ids(root, level):
+    """
+    Object IDs of a layer at a zoom level, decoded through metadata/id_table at zooms that hold dictionary codes.
+    """
+    ids = root[f'metadata/ids/{level}'][:]
+    encoding = root.attrs.get('id_encodings', {}).get(str(level), root.attrs.get('id_encoding', 'string'))
+    if encoding == 'dictionary':
+        ids = root['metadata/id_table'][:][ids]
+    return ids
+
+def grouped_tile_to_df(fg, layout, ids, feature_names, attrs=None, level=None, grid=None):
+    """
+    Reads a single (grid, group) tile of a grouped layer. Returns the tile dataframe and the tile's row indices into metadata/ids.
+    attrs, level and grid are needed to dequantize layers written with coordinate_encoding "uint16".
+    """
+    attrs = {} if attrs is None else attrs
+    if layout == 'packed':
+        records = fg[:]
+        location_arr = np.stack((records['x_location'], records['y_location']), axis=1)
+        location_arr = layer_utils.dequantize_tile_coordinates(location_arr, attrs, level, grid)
+        df = pd.DataFrame(data=location_arr, columns=['x_location', 'y_location'])
+        df['id'] = ids[records['id_idx']]
+        df['feature_name'] = feature_names[records['feature_index']]
+        return df, records['id_idx'].astype(np.int64)
+
+    fidx_arr = fg['feature_index'][:]
+    id_idxs = fg['id_idxs'][:].astype(np.int64)
+    location_arr = layer_utils.dequantize_tile_coordinates(fg['location'][:], attrs, level, grid)
+    df = pd.DataFrame(data=location_arr, columns=['x_location', 'y_location'])
+    df['id'] = ids[id_idxs]
+    df['feature_name'] = feature_names[fidx_arr]
+    return df, id_idxs
+
 def extract_grouped_layer(layer, root, lm_to_root, return_type='pandas', include_all=True):
     level = min([int(x) for x in list(root['zooms'].group_keys())])
     feature_names = root['metadata/features/feature_names'][:]
+    attrs = root.attrs.asdict()
+    layout = attrs.get('layout', 'columns')
 
-    index_map = {val: i for i, val in enumerate(root[f'metadata/ids/{level}'][:])}
+    ids = get_layer_ids(root, level)
     ddfs = []
     for tile_loc, g in root[f'zooms/{level}'].groups():
-        row, col = tile_loc.split('_')
-        for key, fg in g.groups():
-            fidx_arr = da.from_zarr(fg['feature_index']).compute()
-            id_arr = da.from_zarr(fg['id']).compute()
-            location_arr = da.from_zarr(fg['location']).compute()
-            df = pd.DataFrame(data=location_arr, columns=['x_location', 'y_location'])
-            df['id'] = id_arr
-            df['feature_name'] = feature_names[fidx_arr]
-            
+        tiles = g.arrays() if layout == 'packed' else g.groups()
+        for key, fg in tiles:
+            df, idxs_order = grouped_tile_to_df(fg, layout, ids, feature_names, attrs=attrs, level=level, grid=tile_loc)
+
             if include_all:
-                idxs_order = np.array([index_map[val] for val in df['id']])
                 for name, lm_root in lm_to_root.items():
                     df[name] = lm_root[f'object/{level}'][idxs_order]
             
@@ -176,15 +205,18 @@ def ungrouped_dataframe_from_root(lm, lm_root, level):
 def extract_ungrouped_layer(layer, root, lm, lm_to_root, name_to_lm, return_type='pandas', include_all=True):
     level = min([int(x) for x in list(root['zooms'].group_keys())])
     id_order = root[f'metadata/ids/{level}'][:]
+    attrs = root.attrs.asdict()
     # index_map = {val: i for i, val in enumerate(root[f'metadata/ids/{level}'][:])}
     adata, source = None, None
     if lm.is_sparse:
         adatas = []
         for tile_loc, g in root[f'zooms/{level}'].groups():
             row, col = tile_loc.split('_')
-            id_arr = da.from_zarr(g['id']).compute()
-            location_arr = da.from_zarr(g['vertices']).compute()
-            if len(location_arr.shape) == 3:
+            id_arr = g['id'][:]
+            location_arr = layer_utils.dequantize_tile_coordinates(g['vertices'][:], attrs, level, tile_loc)
+            if attrs.get('polygon_layout', 'padded') == 'ragged':
+                location_arr = layer_utils.get_polygon_centroids(location_arr, g['vertex_offsets'][:].astype(np.int64))
+            elif len(location_arr.shape) == 3:
                 location_arr = location_arr.mean(1)
             df = pd.DataFrame(data=location_arr, columns=['x_location', 'y_location'])
             df['id'] = id_arr
@@ -268,8 +300,7 @@ class Experiment(object):
             values_df: Annotated[pd.DataFrame, 'Data to add.'],
             layer: Annotated[models.Layer, 'Layer to add metadata to.'],
         ):
-        store = zarr.storage.ZipStore(layer.local_path, mode='r')
-        root = zarr.group(store=store)
+        store, root = open_zarr_zip(layer.local_path)
         level = min([int(x) for x in list(root['zooms'].group_keys())])
         ids = root[f'metadata/ids/{level}'][:]
 
@@ -300,8 +331,7 @@ class Experiment(object):
             values: Annotated[pd.Series, 'Data to add.'],
             layer: Annotated[models.Layer, 'Layer to add metadata to.'],
         ):
-        store = zarr.storage.ZipStore(layer.local_path, mode='r')
-        root = zarr.group(store=store)
+        store, root = open_zarr_zip(layer.local_path)
         level = min([int(x) for x in list(root['zooms'].group_keys())])
         ids = root[f'metadata/ids/{level}'][:]
 
@@ -336,16 +366,14 @@ class Experiment(object):
             include_all: Annotated[bool, 'Whether to include all possible layer metadata.'] = True,
             return_type: Annotated[str, 'Return type for layer data. Can be ["pandas", "dask"]. Only applies to grouped layers, which can be returned as a pandas DataFrame or dask DataFrame. Non-grouped layers will always return as AnnData objects.'] = 'pandas',
         ) -> pd.DataFrame | anndata.AnnData:
-        store = zarr.storage.ZipStore(layer.local_path, mode='r')
-        root = zarr.group(store=store)
+        store, root = open_zarr_zip(layer.local_path)
 
         lms = self.get_layer_metadata(layer)
         lm_to_root = {}
         lm_to_store = {}
         name_to_lm = {}
         for lm in lms:
-            lm_store = zarr.storage.ZipStore(lm.local_path, mode='r')
-            lm_root = zarr.group(store=lm_store)
+            lm_store, lm_root = open_zarr_zip(lm.local_path)
             lm_to_root[lm.name] = lm_root
             lm_to_store[lm.name] = lm_store
             name_to_lm[lm.name] = lm
@@ -368,8 +396,7 @@ class Experiment(object):
             image: Annotated[models.Image, 'Image from which to return rasterized pixel data.'],
             return_type: Annotated[str, 'Return type of image. Can be dask (dask array) or numpy (numpy ndarray).'] = 'dask'
         ) -> np.ndarray | da.Array:
-        store = zarr.storage.ZipStore(image.local_path, mode='r')
-        root = zarr.group(store=store)
+        store, root = open_zarr_zip(image.local_path)
         level = min([int(x) for x in list(root['zooms'].group_keys())])
 
         arr = da.from_zarr(root[f'zooms/{level}/tiles'])
@@ -251,6 +251,7 @@ class ExperimentUploadBundle(BaseModel):
     images: list[Image]
     layers: list[Layer]
     layer_metadata: list[LayerMetadata]
+    profile: Annotated[dict | None, Field(description='Per-stage timing and memory report recorded during preprocessing.')] = None
 
 class ExperimentInput(BaseModel):
     name: Annotated[str, Field(description='Name of the experiment. If not provided will attempt to populate from input files.')] = None
@@ -13,8 +13,11 @@ import zarr
 
 from cosilico_py.preprocessing.core.conversion import da_to_uint8
 from cosilico_py.preprocessing.core.ome import validate_ome, ome_serializer
+from cosilico_py.preprocessing.core.profiling import profile_stage
+from cosilico_py.preprocessing.core.zarr import get_codec_kwargs, write_zarr_zip
 from cosilico_py.models import Image
 
+PYRAMID_MODES = ['cascade', 'direct']
 
 def get_resolutions(
         tile_size: Annotated[int, 'Size of the image tiles.'],
@@ -60,23 +63,29 @@ def pad_to_target_block_shape(
 
     return da.pad(arr, pad_widths, mode="constant", constant_values=0)
 
+@profile_stage()
 def write_zoom_level(
         image: Annotated[da.Array, 'Image to be written. Is X, Y, Z, C, T.'],
         tile_size: Annotated[da.Array, 'Size of written image tiles.'],
         res_size: Annotated[float, 'Size of the image for a given resolution.'],
-        res_group: Annotated[zarr.Group, 'Zarr group that will be written to.']
-    ) -> None:
+        res_group: Annotated[zarr.Group, 'Zarr group that will be written to.'],
+        n_workers: Annotated[int, 'Number of threads to encode and write tiles with. Values greater than 1 require a store that is safe for concurrent writes, e.g. cosilico_py.preprocessing.core.zarr.StagedZipStore. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the tiles. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        level: Annotated[int, 'Index of this resolution, used to look up per level codec settings.'] = 0,
+        image_res_size: Annotated[Union[float, None], 'Resolution size image is already at, e.g. a previously written level. None means image is full resolution (res size tile_size). Default is None.'] = None,
+    ) -> Annotated[zarr.Array, 'The written tiles dataset.']:
     assert np.sum(image.chunksize[2:]) == len(image.chunksize[2:])
     assert image.shape[0] % tile_size == 0
     assert image.shape[1] % tile_size == 0
     assert image.dtype in [np.uint8, np.uint16]
 
     dt = image.dtype
+    image_res_size = tile_size if image_res_size is None else image_res_size
 
     _, _, Z, C, T = image.shape
 
-    if tile_size < res_size:
-        scale_factor = tile_size / res_size
+    if image_res_size < res_size:
+        scale_factor = image_res_size / res_size
         downsampled = da.map_blocks(
             lambda block: zoom(
                 block, (scale_factor, scale_factor, 1, 1, 1), order=0
@@ -100,24 +109,46 @@ def write_zoom_level(
     dataset_shape = (num_tiles_x, num_tiles_y, T, C, Z, tile_size, tile_size)
     dataset_chunks = (1, 1, 1, 1, 1, tile_size, tile_size)
     tiles_dataset = res_group.create_dataset(
-        "tiles", shape=dataset_shape, dtype=dt, chunks=dataset_chunks, overwrite=True
+        "tiles", shape=dataset_shape, dtype=dt, chunks=dataset_chunks, overwrite=True,
+        **get_codec_kwargs(codecs, 'image', level=level)
     )
 
     tiled_dask = downsampled.reshape(
         (num_tiles_x, tile_size, num_tiles_y, tile_size, *downsampled.shape[2:])
     )
     tiled_dask = tiled_dask.transpose(0, 2, 4, 5, 6, 3, 1)
-    tiled_dask.to_zarr(tiles_dataset)
+    if n_workers > 1:
+        da.store(tiled_dask, tiles_dataset, lock=False, scheduler='threads', num_workers=n_workers)
+    else:
+        tiled_dask.to_zarr(tiles_dataset)
+
+    return tiles_dataset
+
+def read_zoom_level(
+        tiles_dataset: Annotated[zarr.Array, 'Tiles dataset written by write_zoom_level.'],
+    ) -> Annotated[da.Array, 'The level as a padded X, Y, Z, C, T image chunked by tile.']:
+    """
+    Reads a written zoom level back as an image, the inverse of the tiling in write_zoom_level.
+    """
+    num_tiles_x, num_tiles_y, _, _, _, tile_size, _ = tiles_dataset.shape
+    tiles = da.from_zarr(tiles_dataset)
+    image = tiles.transpose(0, 6, 1, 5, 2, 3, 4)
+    return image.reshape((num_tiles_x * tile_size, num_tiles_y * tile_size, *image.shape[4:]))
 
 
+@profile_stage()
 def write_image_zarr(
         image: Annotated[Union[da.Array, np.ndarray], 'Image to write. Must be Dask or numpy array. Must be XYZCT.'],
         ome_model: Annotated[OME, 'OME metadata to be saved with the image.'],
         zarr_path: Annotated[os.PathLike, 'Path to write the .zarr.zip file.'],
         tile_size: Annotated[int, 'Tile size to use during writing. This is the tile size that will used to read in data with the viewer. Default is 512.'] = 512,
         res_magnitude: Annotated[int, 'When selecting resolutions automatically, this is the scaler used.'] = 4,
-        bbox: Annotated[Union[Iterable[int], None], 'Bounding box to crop to. Format is [top, bottom, left, right]. Default is None.'] = None
+        bbox: Annotated[Union[Iterable[int], None], 'Bounding box to crop to. Format is [top, bottom, left, right]. Default is None.'] = None,
+        n_workers: Annotated[int, 'Number of threads to encode and write tiles with. If greater than 1, tiles are written to a staging directory and packed into the .zarr.zip afterwards. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the tiles, can set compression per resolution. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        pyramid: Annotated[str, 'How resolutions are generated. "cascade" downsamples each resolution from the one written before it, read back from the store, so image is only read once. "direct" downsamples every resolution from image. Levels past the second can differ by nearest neighbour picks between the two. Default is "cascade".'] = 'cascade',
     ) -> None:
+    assert pyramid in PYRAMID_MODES, f'pyramid must be one of {PYRAMID_MODES}, got {pyramid}.'
     if isinstance(image, np.ndarray):
         image = da.from_array(image, chunks=(1, 2048, 2048))
     assert isinstance(image, da.Array), f'Image must be a Dask Array (da.Array), got {type(image)}'
@@ -135,30 +166,33 @@ def write_image_zarr(
     image = pad_to_target_block_shape(image, (tile_size, tile_size))
     image = image.rechunk((tile_size, tile_size, 1, 1, 1))
 
-    store = zarr.storage.ZipStore(zarr_path, mode='w')
-    root = zarr.group(store=store, overwrite=True)
-    zoom_group = root.create_group("zooms")
-
-    for res_size in resolution_sizes:
-        res_group = zoom_group.create_group(f"{res_size}")
-        write_zoom_level(image, tile_size, res_size, res_group)
-
-    if bbox is not None:
-        ome_model.images[0].pixels.size_x = c2 - c1
-        ome_model.images[0].pixels.size_y = r2 - r1
-    d_str = json.dumps(to_dict(ome_model), default=ome_serializer, indent=2)
-    meta = {
-        'ome': json.loads(d_str),
-        'version': 'v1',
-        'name': 'Xenium Multiplex',
-        'resolutions': resolution_sizes,
-        'tile_size': tile_size,
-        'upp': ome_model.images[0].pixels.physical_size_x,
-        'unit': ome_model.images[0].pixels.physical_size_x_unit.value,
-    }
-    root.attrs.update(meta)
-
-    store.close()
+    with write_zarr_zip(zarr_path, n_workers=n_workers) as store:
+        root = zarr.group(store=store, overwrite=True)
+        zoom_group = root.create_group("zooms")
+
+        source, source_res_size = image, None
+        for i, res_size in enumerate(resolution_sizes):
+            res_group = zoom_group.create_group(f"{res_size}")
+            tiles_dataset = write_zoom_level(
+                source, tile_size, res_size, res_group, n_workers=n_workers, codecs=codecs, level=i, image_res_size=source_res_size
+            )
+            if pyramid == 'cascade':
+                source, source_res_size = read_zoom_level(tiles_dataset), res_size
+
+        if bbox is not None:
+            ome_model.images[0].pixels.size_x = c2 - c1
+            ome_model.images[0].pixels.size_y = r2 - r1
+        d_str = json.dumps(to_dict(ome_model), default=ome_serializer, indent=2)
+        meta = {
+            'ome': json.loads(d_str),
+            'version': 'v1',
+            'name': 'Xenium Multiplex',
+            'resolutions': resolution_sizes,
+            'tile_size': tile_size,
+            'upp': ome_model.images[0].pixels.physical_size_x,
+            'unit': ome_model.images[0].pixels.physical_size_x_unit.value,
+        }
+        root.attrs.update(meta)
 
 def write_image_zarr_from_ome(
         experiment_id: Annotated[str, 'ID of parent experimenet'],
@@ -169,6 +203,9 @@ def write_image_zarr_from_ome(
         res_magnitude: Annotated[int, 'When selecting resolutions automatically, this is the scaler used.'] = 4,
         bbox: Annotated[Union[Iterable[int], None], 'Bounding box to crop to. Format is [top, bottom, left, right]. Default is None.'] = None,
         to_uint8: Annotated[bool, 'Default is False. If True, will convert the saved image to UINT8. This can save space for images that are UINT16.'] = False,
+        n_workers: Annotated[int, 'Number of threads to write tiles with. See cosilico_py.preprocessing.core.image.write_image_zarr. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the tiles. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        pyramid: Annotated[str, 'How resolutions are generated, "cascade" or "direct". See cosilico_py.preprocessing.core.image.write_image_zarr. Default is "cascade".'] = 'cascade',
     ) -> None:
     assert os.path.exists(ome_tiff_path), f'ome_tiff_path {ome_tiff_path} does not exist.'
 
@@ -206,6 +243,9 @@ def write_image_zarr_from_ome(
         image_model.local_path,
         tile_size=tile_size,
         res_magnitude=res_magnitude,
-        bbox=bbox
+        bbox=bbox,
+        n_workers=n_workers,
+        codecs=codecs,
+        pyramid=pyramid,
     )
     return image_model
@@ -1,5 +1,4 @@
 from collections.abc import Iterable
-from collections import defaultdict
 from pathlib import Path
 from typing import Annotated, Union
 import os
@@ -11,11 +10,36 @@ import pandas as pd
 import zarr
 
 from cosilico_py.preprocessing.core.tiling import (
-    generate_tiled_data_grouped, compute_grid_centroids_multi
+    generate_tiled_data_grouped, compute_grid_centroids_multi, get_chunk_size_stats, get_tile_offsets, get_polygon_tiles,
+    sample_tiles_stratified
+)
+from cosilico_py.preprocessing.core.profiling import profile_stage
+from cosilico_py.preprocessing.core.zarr import (
+    consolidate_zarr_zip, open_zarr_zip, get_codec_kwargs, write_zarr_zip, ParallelArrayWriter
 )
 from cosilico_py.models import Layer, LayerMetadata
 from cosilico_py.ports.anndata import AnnData
 
+POINT_LAYOUTS = ['columns', 'packed']
+PACKED_POINT_DTYPE = np.dtype([
+    ('x_location', '<f4'),
+    ('y_location', '<f4'),
+    ('feature_index', '<u4'),
+    ('id_idx', '<u4'),
+])
+ID_ENCODINGS = ['string', 'integer', 'dictionary']
+COORDINATE_ENCODINGS = ['float32', 'uint16']
+POLYGON_LAYOUTS = ['padded', 'ragged']
+POLYGON_FILL_VALUE = -1
+# uint16 padded polygons reserve the largest value for padding, vertices are quantized into the values below it
+QUANTIZED_POLYGON_FILL_VALUE = np.iinfo(np.uint16).max
+PACKED_QUANTIZED_POINT_DTYPE = np.dtype([
+    ('x_location', '<u2'),
+    ('y_location', '<u2'),
+    ('feature_index', '<u4'),
+    ('id_idx', '<u4'),
+])
+
 def append_missing(vals_df, fnames, fill_value=0):
     """
     Populates missing values.
@@ -39,6 +63,84 @@ def get_values_meta(df, col, fnames, index_col='feature_index'):
     
     return vmins.values.flatten().astype(np.float32), vmaxs.values.flatten().astype(np.float32)
 
+def get_id_table(ids):
+    """
+    Sorted unique string IDs. Used as the global string table for dictionary encoded IDs.
+    """
+    return np.unique(np.asarray(ids).astype(str)).astype(object)
+
+def encode_ids(ids, id_encoding, id_table=None):
+    """
+    Encodes a series of object IDs. "string" keeps the existing str IDs, "integer" stores integer IDs as uint64 and "dictionary" stores the index of each ID in id_table.
+    """
+    if id_encoding == 'string':
+        return ids.astype(str)
+    if id_encoding == 'integer':
+        assert pd.api.types.is_integer_dtype(ids.dtype), f'id_encoding "integer" requires integer IDs, got {ids.dtype}. Use "dictionary" instead.'
+        return ids.to_numpy(dtype=np.uint64)
+    assert id_table is not None, 'id_table must be provided for id_encoding "dictionary".'
+    codes = pd.Index(id_table).get_indexer(ids.astype(str))
+    assert (codes >= 0).all(), 'Found IDs missing from id_table.'
+    return codes.astype(np.uint32 if len(id_table) < 2**32 else np.uint64)
+
+def get_zoom_id_encodings(zooms, id_encoding):
+    """
+    How metadata/ids is stored at each zoom of a grouped layer. The first (finest) zoom holds object IDs in id_encoding. Coarser zooms hold
+    centroid IDs, "string" names for string layers and otherwise "bin" IDs from encode_bin_ids.
+    """
+    return {str(zoom): id_encoding if i == 0 or id_encoding == 'string' else 'bin' for i, zoom in enumerate(zooms)}
+
+def encode_bin_ids(feature_index, bin_x, bin_y):
+    """
+    Integer IDs for centroids at coarse zooms. Packs feature index (22 bits) and bin coordinates (21 bits each) into a uint64.
+    """
+    feature_index, bin_x, bin_y = [np.asarray(x, dtype=np.int64) for x in (feature_index, bin_x, bin_y)]
+    assert feature_index.min(initial=0) >= 0 and feature_index.max(initial=0) < 2**22, 'feature_index out of range for integer bin IDs.'
+    assert bin_x.min(initial=0) >= 0 and bin_x.max(initial=0) < 2**21, 'bin_x out of range for integer bin IDs.'
+    assert bin_y.min(initial=0) >= 0 and bin_y.max(initial=0) < 2**21, 'bin_y out of range for integer bin IDs.'
+    return ((feature_index.astype(np.uint64) << np.uint64(42)) | (bin_x.astype(np.uint64) << np.uint64(21)) | bin_y.astype(np.uint64))
+
+def get_quantization_step(grid_size, margin=0., max_value=np.iinfo(np.uint16).max):
+    """
+    Size of one uint16 step for tiles of a zoom level. Values 0 to max_value span a tile plus margin * grid_size on each side.
+    """
+    return grid_size * (1 + 2 * margin) / max_value
+
+def get_tile_offset(grid, grid_size, margin=0.):
+    """
+    Origin of the quantized coordinates of a tile, its top left corner moved out by margin * grid_size. grid is a "{x}_{y}" or "{x}_{y}_{depth}" tile label.
+    """
+    x, y, *depth = (int(v) for v in grid.split('_'))
+    size = grid_size / 2 ** depth[0] if depth else grid_size
+    return np.asarray([x * size, y * size]) - margin * grid_size
+
+def quantize_coordinates(coords, offset, step, max_value=np.iinfo(np.uint16).max):
+    """
+    Encodes coordinates as uint16 multiples of step from offset. offset broadcasts against coords, e.g. an (x, y) pair for (..., 2) arrays.
+    """
+    q = np.rint((np.asarray(coords, dtype=np.float64) - offset) / step)
+    if q.size:
+        assert q.min() >= 0 and q.max() <= max_value, f'Coordinates fall outside of the quantized tile range (offset {offset}, step {step}), increase the margin or use coordinate_encoding "float32".'
+    return q.astype(np.uint16)
+
+def dequantize_coordinates(q, offset, step):
+    return (q.astype(np.float64) * step + offset).astype(np.float32)
+
+def dequantize_tile_coordinates(coords, attrs, zoom, grid):
+    """
+    Float32 coordinates of a tile read from a layer with the given root attrs. Coordinates of layers without quantization are returned as is.
+    Vertices equal to the quantized fill value of padded polygon layers are returned as POLYGON_FILL_VALUE.
+    """
+    coordinates = attrs.get('coordinates', {'encoding': 'float32'})
+    if coordinates['encoding'] == 'float32':
+        return coords
+    step = coordinates['steps'][str(zoom)]
+    dequantized = dequantize_coordinates(coords, get_tile_offset(grid, int(zoom), coordinates['margin']), step)
+    if 'fill_value' in coordinates:
+        dequantized[(coords == coordinates['fill_value']).all(-1)] = POLYGON_FILL_VALUE
+    return dequantized
+
+@profile_stage()
 def generate_zoom_dfs_grouped(
         source: Annotated[pd.DataFrame, 'Dataframe to generate zoom dataframes from. Should have x_location, y_location, feature_index columns.'],
         id_col: Annotated[str, 'Column to use as an ID in source, should be unique for every row in source.'],
@@ -46,7 +148,13 @@ def generate_zoom_dfs_grouped(
         zooms: Annotated[Iterable[int], 'The zoom resolutions the centroid dataframes apply to.'],
         bin_size_map: Annotated[dict[int, float], 'Bin sizes to use for each zoom.'],
         zoom_n_per_group: Annotated[Iterable[int], 'Group size to use when binning data for each zoom. Should be same length as zooms.'],
-    ) -> Annotated[dict[int, dict[str, dict[str, pd.DataFrame]]], 'Map of each zoom to a series of sub dataframes organized by zoom, grid, and group.']:
+        grouping: Annotated[str, 'How features are assigned to groups at each zoom. Can be "round_robin" or "balanced". See cosilico_py.preprocessing.core.tiling.generate_tiled_data_grouped.'] = 'round_robin',
+        target_chunk_bytes: Annotated[int, 'Target bytes per (grid, group) chunk when grouping is "balanced".'] = 1_000_000,
+        max_points_per_tile: Annotated[Union[int, None], 'If not None, grids are adaptively split as a quadtree until they hold at most this many points. See cosilico_py.preprocessing.core.tiling.get_quadtree_tiles.'] = None,
+        id_encoding: Annotated[str, 'How object IDs are encoded. "string" converts IDs to str and names coarse zoom centroids "{grid}_{feature}_{bin_x}_{bin_y}". "integer" keeps integer IDs as uint64, "dictionary" replaces IDs with their index in id_table. Both integer modes pack coarse zoom centroid IDs into uint64s. Default is "string".'] = 'string',
+        id_table: Annotated[Union[np.ndarray, None], 'Global ID string table. Required when id_encoding is "dictionary". See cosilico_py.preprocessing.core.layer.get_id_table.'] = None,
+    ) -> Annotated[tuple[dict[int, pd.DataFrame], dict[int, dict[str, np.ndarray]]], 'Map of each zoom to its dataframe sorted by (grid, group), and map of each zoom to its tile offsets. See cosilico_py.preprocessing.core.tiling.get_tile_offsets.']:
+    assert id_encoding in ID_ENCODINGS, f'id_encoding must be one of {ID_ENCODINGS}, got {id_encoding}.'
     index_col='feature_index'
 
     assert len(zooms) == len(zoom_n_per_group)
@@ -54,112 +162,174 @@ def generate_zoom_dfs_grouped(
     zoom_to_df = {}
     for i, zoom in enumerate(zooms):
         if i == 0:
-            ## need to check this to see if the .copy is necessary.
             df = generate_tiled_data_grouped(
-                source.copy(),
+                source,
                 n_per_group=zoom_n_per_group[i],
-                grid_size=zoom
+                grid_size=zoom,
+                grouping=grouping,
+                target_chunk_bytes=target_chunk_bytes,
+                max_points_per_tile=max_points_per_tile
             )
-            df['id'] = df[id_col].astype(str) if id_col is not None else np.arange(
-                0, df.shape[0], dtype=object)
+            if id_col is None:
+                df['id'] = np.arange(0, df.shape[0], dtype=object if id_encoding == 'string' else np.uint64)
+            else:
+                df['id'] = encode_ids(df[id_col], id_encoding, id_table)
         else:
             bin_size = bin_size_map[zoom]
             centroid_df = centroids_dfs[bin_size]
             df = generate_tiled_data_grouped(
                 centroid_df,
                 n_per_group=zoom_n_per_group[i],
-                grid_size=zoom
+                grid_size=zoom,
+                grouping=grouping,
+                target_chunk_bytes=target_chunk_bytes,
+                max_points_per_tile=max_points_per_tile
             )
-            gds, _ = zip(*df.index.to_list())
-            df['id'] = [
-                f'{grid}_{fidx}_{bx}_{by}'
-                for grid, (fidx, bx, by) in zip(gds, df[[index_col, 'bin_x', 'bin_y']].values)
-            ]
+            if id_encoding == 'string':
+                gds, _ = zip(*df.index.to_list())
+                df['id'] = [
+                    f'{grid}_{fidx}_{bx}_{by}'
+                    for grid, (fidx, bx, by) in zip(gds, df[[index_col, 'bin_x', 'bin_y']].values)
+                ]
+            else:
+                df['id'] = encode_bin_ids(df[index_col], df['bin_x'], df['bin_y'])
 
         zoom_to_df[zoom] = df
 
-    zoom_to_sub_dfs = {}
-    for zoom, df in zoom_to_df.items():
-        zoom_to_sub_dfs[zoom] = {}
-        for (grid, group), sub_df in df.groupby(["grid", "group"], observed=False):
-            if grid not in zoom_to_sub_dfs[zoom]:
-                zoom_to_sub_dfs[zoom][grid] = {}
+    zoom_to_tiles = {zoom: get_tile_offsets(df) for zoom, df in zoom_to_df.items()}
 
-            zoom_to_sub_dfs[zoom][grid][group] = sub_df
-
-    return zoom_to_df, zoom_to_sub_dfs
+    return zoom_to_df, zoom_to_tiles
 
+@profile_stage()
 def write_points_zarr_grouped(
         source: Annotated[pd.DataFrame, 'Dataframe to generate zoom dataframes from. Should have x_location, y_location, feature_index columns.'],
         zooms: Annotated[Iterable[int], 'The zoom resolutions to be used.'],
         bin_sizes: Annotated[Iterable[int], 'Bin sizes to use for each zoom.'],
         zoom_to_df: Annotated[dict[str, pd.DataFrame], 'Dictionary mapping bin size to information on each centroid. Generated by cosilico_py.preprocessing.core.layer.generate_zoom_dfs_grouped.'],
-        zoom_to_sub_dfs: Annotated[dict[int, dict[str, dict[str, pd.DataFrame]]], 'Map of each zoom to a series of sub dataframes organized by zoom, grid, and group. Generated by cosilico_py.preprocessing.core.layer.generate_zoom_dfs_grouped.'],
+        zoom_to_tiles: Annotated[dict[int, dict[str, np.ndarray]], 'Map of each zoom to the (grid, group) -> (start, stop) row offsets of its tiles in zoom_to_df. Generated by cosilico_py.preprocessing.core.layer.generate_zoom_dfs_grouped.'],
         zarr_path: Annotated[os.PathLike, 'Filepath to write output .zarr.zip file.'],
         size: Annotated[Iterable[int], 'Size of the image area the features are tied to. (H, W)'],
         version: Annotated[str, 'Version of Layer we are writing.'] = 'v1',
         name: Annotated[str, 'Name of the Layer.'] = 'Features',
+        layout: Annotated[str, 'How each (zoom, grid, group) tile is stored. "columns" writes location, feature_index, id and id_idxs datasets. "packed" writes a single record array with PACKED_POINT_DTYPE fields, ids are looked up from metadata/ids with id_idx. Only read by the Python client (cosilico_py.client.experiment.grouped_tile_to_df), not yet read by the viewer. Default is "columns".'] = 'columns',
+        id_encoding: Annotated[str, 'How the id column of the zoom dataframes was encoded. See cosilico_py.preprocessing.core.layer.generate_zoom_dfs_grouped. Non-string IDs are stored as integer arrays instead of VLenUTF8. Default is "string".'] = 'string',
+        id_table: Annotated[Union[np.ndarray, None], 'Global ID string table, written to metadata/id_table when id_encoding is "dictionary".'] = None,
+        n_workers: Annotated[int, 'Number of threads to encode and compress tiles with. If greater than 1, tiles are written to a staging directory and packed into the .zarr.zip afterwards. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for tile and ID datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        coordinate_encoding: Annotated[str, 'How point locations are stored. "float32" stores absolute pixel coordinates. "uint16" stores offsets from the tile origin in steps of zoom / 65535, with the steps recorded in the coordinates attr. Not yet read by the viewer. Default is "float32".'] = 'float32',
     ) -> None:
+    assert layout in POINT_LAYOUTS, f'layout must be one of {POINT_LAYOUTS}, got {layout}.'
+    assert id_encoding in ID_ENCODINGS, f'id_encoding must be one of {ID_ENCODINGS}, got {id_encoding}.'
+    assert coordinate_encoding in COORDINATE_ENCODINGS, f'coordinate_encoding must be one of {COORDINATE_ENCODINGS}, got {coordinate_encoding}.'
+    quantized = coordinate_encoding == 'uint16'
 
     id_col='id'
-    store = zarr.storage.ZipStore(zarr_path, mode='w')
-    root = zarr.group(store=store, overwrite=True)
-
-    root.attrs.update({
-        'version': version,
-        'name': name,
-        'resolutions': zooms,
-        'bin_sizes': bin_sizes,
-        'size': list(size),
-        'type': {zoom: 'point' for zoom in zooms}
-    })
+    with write_zarr_zip(zarr_path, n_workers=n_workers) as store, ParallelArrayWriter(n_workers) as writer:
+        root = zarr.group(store=store, overwrite=True)
+
+        attrs = {
+            'version': version,
+            'name': name,
+            'resolutions': zooms,
+            'bin_sizes': bin_sizes,
+            'size': list(size),
+            'type': {zoom: 'point' for zoom in zooms},
+            'layout': layout,
+            'id_encoding': id_encoding,
+            'id_encodings': get_zoom_id_encodings(zooms, id_encoding),
+            'chunk_stats': {
+                zoom: get_chunk_size_stats(tiles['stop'] - tiles['start'])
+                for zoom, tiles in zoom_to_tiles.items()
+            },
+        }
+        tile_trees = {zoom: df.attrs['tile_tree'] for zoom, df in zoom_to_df.items() if 'tile_tree' in df.attrs}
+        if tile_trees:
+            attrs['tile_tree'] = tile_trees
+        if quantized:
+            attrs['coordinates'] = {
+                'encoding': coordinate_encoding,
+                'margin': 0.,
+                'steps': {str(zoom): get_quantization_step(zoom) for zoom in zoom_to_tiles},
+            }
+        root.attrs.update(attrs)
     
-    metadata_root = root.create_group("metadata")
-    feature_meta_group = metadata_root.create_group("features")
-
-    names = source['feature_name'].cat.categories.to_numpy(dtype=object)
-    fnames = feature_meta_group.create_dataset("feature_names", shape=(len(names),), chunks=(len(names),), dtype=object, object_codec=numcodecs.VLenUTF8())
-    fnames[:] = names
-
-    fg_group = feature_meta_group.create_group('feature_groups')
-    ids_group = metadata_root.create_group("ids")
-
-    zoom_root = root.create_group("zooms")
-    for zoom, sub_dfs in zoom_to_sub_dfs.items():
-        zoom_group = zoom_root.create_group(str(zoom))
+        metadata_root = root.create_group("metadata")
+        feature_meta_group = metadata_root.create_group("features")
+
+        names = source['feature_name'].cat.categories.to_numpy(dtype=object)
+        fnames = feature_meta_group.create_dataset("feature_names", shape=(len(names),), chunks=(len(names),), dtype=object, object_codec=numcodecs.VLenUTF8())
+        fnames[:] = names
+
+        fg_group = feature_meta_group.create_group('feature_groups')
+        ids_group = metadata_root.create_group("ids")
+        if id_encoding == 'dictionary':
+            assert id_table is not None, 'id_table must be provided for id_encoding "dictionary".'
+            table = metadata_root.create_dataset("id_table", shape=(len(id_table),), dtype=object, object_codec=numcodecs.VLenUTF8())
+            table[:] = np.asarray(id_table, dtype=object)
+
+        zoom_root = root.create_group("zooms")
+        for zoom, tiles in zoom_to_tiles.items():
+            zoom_group = zoom_root.create_group(str(zoom))
+            df = zoom_to_df[zoom]
         
-        group_to_features = zoom_to_df[zoom].groupby("group", observed=False)["feature_index"].agg(set).to_dict()
-        group_to_feature_names = {k:[source['feature_name'].cat.categories[v] for v in vs] for k, vs in group_to_features.items()}
-        feature_to_group = {feat:g for g, feats in group_to_feature_names.items() for feat in feats}
-        fgroups = fg_group.create_dataset(str(zoom), shape=(len(names),), chunks=(len(names),), dtype=np.int32)
-        fgroups[:] = np.asarray([feature_to_group.get(x, -1) for x in names], dtype=np.int32)
-
-        block_ids = []
-    
-        for grid, d in sub_dfs.items():
-            grid_group = zoom_group.create_group(grid)
-            for group_idx, f in d.items():
-                block_idxs = np.arange(len(block_ids), len(block_ids) + f.shape[0])
-                block_ids += f[id_col].to_list()
-
-                channel_group = grid_group.create_group(str(group_idx))
-
-                location = channel_group.create_dataset("location", shape=(f.shape[0], 2), chunks=(f.shape[0], 1), dtype='float32')
-                location[:] = f[['x_location', 'y_location']].values
-
-                fidxs = channel_group.create_dataset("feature_index", shape=(f.shape[0],), chunks=(f.shape[0],), dtype='uint32')
-                fidxs[:] = f[['feature_index']].values.flatten()
-
-                transcript_id = channel_group.create_dataset("id", shape=(f.shape[0],), chunks=(f.shape[0],), dtype=object, object_codec=numcodecs.VLenUTF8())
-                transcript_id[:] = f[[id_col]].astype(object).values.flatten()
-
-                transcript_idx = channel_group.create_dataset("id_idxs", shape=(f.shape[0],), chunks=(f.shape[0],), dtype='uint32')
-                transcript_idx[:] = block_idxs
-
-        ids = ids_group.create_dataset(str(zoom), shape=(len(block_ids),), dtype=object, object_codec=numcodecs.VLenUTF8())
-        ids[:] = np.asarray(block_ids, dtype=object)
-
-    store.close()
+            group_to_features = df.groupby("group", observed=False)["feature_index"].agg(set).to_dict()
+            group_to_feature_names = {k:[source['feature_name'].cat.categories[v] for v in vs] for k, vs in group_to_features.items()}
+            feature_to_group = {feat:g for g, feats in group_to_feature_names.items() for feat in feats}
+            fgroups = fg_group.create_dataset(str(zoom), shape=(len(names),), chunks=(len(names),), dtype=np.int32)
+            fgroups[:] = np.asarray([feature_to_group.get(x, -1) for x in names], dtype=np.int32)
+
+            # tiles are contiguous row ranges of df, so every tile is written from slices of these columns
+            xs = df['x_location'].to_numpy()
+            ys = df['y_location'].to_numpy()
+            fidxs = np.asarray(df['feature_index'], dtype=np.uint32)
+            block_ids = df[id_col].to_numpy(dtype=object) if id_encoding == 'string' else df[id_col].to_numpy()
+
+            step = get_quantization_step(zoom)
+            point_dtype = PACKED_QUANTIZED_POINT_DTYPE if quantized else PACKED_POINT_DTYPE
+
+            grid_group = None
+            for grid, group_idx, start, stop in zip(tiles['grid'], tiles['group'], tiles['start'], tiles['stop']):
+                if grid_group is None or grid_group.basename != grid:
+                    grid_group = zoom_group.create_group(grid)
+                    offset = get_tile_offset(grid, zoom)
+                n = stop - start
+                block_idxs = np.arange(start, stop)
+                location = np.stack((xs[start:stop], ys[start:stop]), axis=1)
+                if quantized:
+                    location = quantize_coordinates(location, offset, step)
+
+                if layout == 'packed':
+                    records = np.empty(n, dtype=point_dtype)
+                    records['x_location'] = location[:, 0]
+                    records['y_location'] = location[:, 1]
+                    records['feature_index'] = fidxs[start:stop]
+                    records['id_idx'] = block_idxs
+                    packed = grid_group.create_dataset(str(group_idx), shape=records.shape, chunks=records.shape, dtype=point_dtype, **get_codec_kwargs(codecs, 'points'))
+                    writer.write(packed, records)
+                else:
+                    channel_group = grid_group.create_group(str(group_idx))
+
+                    location_arr = channel_group.create_dataset("location", shape=(n, 2), chunks=(n, 1), dtype='uint16' if quantized else 'float32', **get_codec_kwargs(codecs, 'location'))
+                    writer.write(location_arr, location)
+
+                    feature_index = channel_group.create_dataset("feature_index", shape=(n,), chunks=(n,), dtype='uint32', **get_codec_kwargs(codecs, 'feature_index'))
+                    writer.write(feature_index, fidxs[start:stop])
+
+                    if id_encoding == 'string':
+                        transcript_id = channel_group.create_dataset("id", shape=(n,), chunks=(n,), dtype=object, object_codec=numcodecs.VLenUTF8(), **get_codec_kwargs(codecs, 'strings'))
+                    else:
+                        transcript_id = channel_group.create_dataset("id", shape=(n,), chunks=(n,), dtype=block_ids.dtype, **get_codec_kwargs(codecs, 'id'))
+                    writer.write(transcript_id, block_ids[start:stop])
+
+                    transcript_idx = channel_group.create_dataset("id_idxs", shape=(n,), chunks=(n,), dtype='uint32', **get_codec_kwargs(codecs, 'id_idxs'))
+                    writer.write(transcript_idx, block_idxs)
+
+            if id_encoding == 'string':
+                ids = ids_group.create_dataset(str(zoom), shape=(len(block_ids),), dtype=object, object_codec=numcodecs.VLenUTF8(), **get_codec_kwargs(codecs, 'strings'))
+                ids[:] = np.asarray(block_ids, dtype=object)
+            else:
+                ids = ids_group.create_dataset(str(zoom), shape=(len(block_ids),), dtype=block_ids.dtype, **get_codec_kwargs(codecs, 'id'))
+                ids[:] = block_ids
 
 
 def write_grouped_layer_zarr_from_df(
@@ -175,6 +345,15 @@ def write_grouped_layer_zarr_from_df(
         name: Annotated[str, 'Name of the Layer.'] = 'Features',
         chunk_size: Annotated[int, 'Chunk size to use when batch processing.'] = 10_000_000,
         use_disk: Annotated[bool, 'Whether to write batch files to disk to decrease memory usage. Default is False'] = True,
+        pyramid: Annotated[bool, 'Whether to derive coarser centroid bin sizes from finer ones. See cosilico_py.preprocessing.core.tiling.compute_grid_centroids_multi. Default is False.'] = False,
+        n_workers: Annotated[int, 'Number of worker processes to compute centroids with, also used as the number of threads writing tiles. Default is 1.'] = 1,
+        grouping: Annotated[str, 'How features are assigned to groups at each zoom. Can be "round_robin" or "balanced". See cosilico_py.preprocessing.core.tiling.generate_tiled_data_grouped.'] = 'round_robin',
+        target_chunk_bytes: Annotated[int, 'Target bytes per (grid, group) chunk when grouping is "balanced".'] = 1_000_000,
+        max_points_per_tile: Annotated[Union[int, None], 'If not None, grids are adaptively split as a quadtree until they hold at most this many points, and the tile tree is recorded in the layer attrs. Split tiles are labelled "{x}_{y}_{depth}" and are only read by the Python client, not yet by the viewer. Default is None.'] = None,
+        layout: Annotated[str, 'How each tile is stored. Can be "columns" or "packed". See cosilico_py.preprocessing.core.layer.write_points_zarr_grouped. Default is "columns".'] = 'columns',
+        id_encoding: Annotated[str, 'How object IDs are stored. Can be "string", "integer" or "dictionary". See cosilico_py.preprocessing.core.layer.generate_zoom_dfs_grouped. Default is "string".'] = 'string',
+        codecs: Annotated[Union[str, dict], 'Codec policy for tile and ID datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        coordinate_encoding: Annotated[str, 'How point locations are stored. Can be "float32" or "uint16". See cosilico_py.preprocessing.core.layer.write_points_zarr_grouped. Default is "float32".'] = 'float32',
     ) -> Annotated[Layer, 'The resulting Layer object.']:
     output_directory = Path(output_directory).expanduser().absolute()
     assert output_directory.is_dir(), f'{output_directory} is not a directory.'
@@ -182,10 +361,15 @@ def write_grouped_layer_zarr_from_df(
     centroids_dfs = compute_grid_centroids_multi(
         source[['feature_index', 'x_location', 'y_location']],
         bin_sizes=list(bin_size_map.values()), chunk_size=chunk_size,
-        use_disk=use_disk
+        use_disk=use_disk, pyramid=pyramid, n_workers=n_workers
     )
 
-    zoom_to_df, zoom_to_sub_dfs = generate_zoom_dfs_grouped(source, id_col, centroids_dfs, zooms, bin_size_map, group_sizes)
+    id_table = get_id_table(source[id_col]) if id_encoding == 'dictionary' else None
+    zoom_to_df, zoom_to_tiles = generate_zoom_dfs_grouped(
+        source, id_col, centroids_dfs, zooms, bin_size_map, group_sizes,
+        grouping=grouping, target_chunk_bytes=target_chunk_bytes, max_points_per_tile=max_points_per_tile,
+        id_encoding=id_encoding, id_table=id_table
+    )
 
     layer = Layer(
         name=name,
@@ -194,7 +378,7 @@ def write_grouped_layer_zarr_from_df(
     )
     layer.local_path = (output_directory / f'{layer.id}.zarr.zip').absolute()
 
-    write_points_zarr_grouped(source, zooms, [bin_size_map.get(k) for k in zooms], zoom_to_df, zoom_to_sub_dfs, layer.local_path, size, version=version, name=name)
+    write_points_zarr_grouped(source, zooms, [bin_size_map.get(k) for k in zooms], zoom_to_df, zoom_to_tiles, layer.local_path, size, version=version, name=name, layout=layout, id_encoding=id_encoding, id_table=id_table, n_workers=n_workers, codecs=codecs, coordinate_encoding=coordinate_encoding)
 
     return layer
 
@@ -202,6 +386,7 @@ def write_grouped_layer_zarr_from_df(
 
 
 # grouped layer metadata zar
+@profile_stage()
 def generate_layer_metadata_zoom_to_df(
         source: Annotated[pd.DataFrame, 'Dataframe to generate zoom dataframes from. Should have x_location, y_location, feature_index columns. Additionally, there should be a variable_name column that determines the group, and value_cols for continuous variables we want means for.'],
         id_col: Annotated[str, 'Column to use as an ID in source, should be unique for every row in source.'],
@@ -212,6 +397,8 @@ def generate_layer_metadata_zoom_to_df(
         value_cols: Annotated[Iterable[str], 'Continuous variables in the source dataframe that should be aggregated.'] = None,
         chunk_size: Annotated[int, 'Chunk size to use when batch processing.'] = 10_000_000,
         use_disk: Annotated[bool, 'Whether to write batch files to disk to decrease memory usage. Default is False'] = True,
+        pyramid: Annotated[bool, 'Whether to derive coarser centroid bin sizes from finer ones. See cosilico_py.preprocessing.core.tiling.compute_grid_centroids_multi. Default is False.'] = False,
+        n_workers: Annotated[int, 'Number of worker processes to compute centroids with. Default is 1.'] = 1,
     ):
     if value_cols is None:
         value_cols = []
@@ -226,20 +413,28 @@ def generate_layer_metadata_zoom_to_df(
         bin_sizes=bin_sizes,
         chunk_size=chunk_size,
         use_disk=use_disk,
-        target_columns=value_cols
+        target_columns=value_cols,
+        pyramid=pyramid,
+        n_workers=n_workers
     )
 
+    id_encoding = parent_attrs.get('id_encoding', 'string')
+    tile_trees = list(parent_attrs.get('tile_tree', {}).values())
     zoom_to_df, _ = generate_zoom_dfs_grouped(
         source,
         id_col,
         centroids_dfs,
         parent_attrs['resolutions'],
         bin_size_map,
-        [len(feat_to_index)] * len(parent_attrs['resolutions'])
+        [len(feat_to_index)] * len(parent_attrs['resolutions']),
+        max_points_per_tile=tile_trees[0]['max_points'] if tile_trees else None,
+        id_encoding=id_encoding,
+        id_table=get_id_table(source[id_col]) if id_encoding == 'dictionary' else None,
     )
 
     return zoom_to_df
 
+@profile_stage()
 def write_grouped_metadata_zarr(
         zoom_to_df: Annotated[dict[str, pd.DataFrame], 'Dictionary mapping bin size to information on each centroid. Generated by cosilico_py.preprocessing.core.layer.generate_layer_metadata_zoom_to_df.'],
         zarr_path: Annotated[os.PathLike, 'Filepath to write output .zarr.zip file.'],
@@ -251,6 +446,7 @@ def write_grouped_metadata_zarr(
         version: Annotated[str, 'Version of Layer we are writing.'] = 'v1',
         absolute_vmin: Annotated[Union[float, None], 'Absolute vmin for a continuous field.'] = None,
         absolute_vmax: Annotated[Union[float, None], 'Absolute vmax for a continuous field.'] = None,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ):
     assert feat_type in ['categorical', 'continuous'], f'feat_type must be "categorical" or "continuous", got {feat_type}'
 
@@ -271,7 +467,7 @@ def write_grouped_metadata_zarr(
         if value_col not in df.columns:
             df[value_col] = 1
         
-        xs = object_root.create_dataset(str(zoom), shape=(df.shape[0],), chunks=50_000, dtype='uint32' if feat_type == 'categorical' else 'float32')    
+        xs = object_root.create_dataset(str(zoom), shape=(df.shape[0],), chunks=50_000, dtype='uint32' if feat_type == 'categorical' else 'float32', **get_codec_kwargs(codecs, 'values'))
         xs[:] = df[value_col].values
         
         if feat_type == 'continuous':
@@ -313,6 +509,7 @@ def write_grouped_metadata_zarr(
         'vmin': abs_vmin
     })
 
+    consolidate_zarr_zip(store)
     store.close()
 
 def write_grouped_metadata_zarrs_from_df(
@@ -329,6 +526,9 @@ def write_grouped_metadata_zarrs_from_df(
         chunk_size: Annotated[int, 'Chunk size to use when batch processing.'] = 10_000_000,
         use_disk: Annotated[bool, 'Whether to write batch files to disk to decrease memory usage. Default is False'] = True,
         version: Annotated[str, 'Version of Layer we are writing.'] = 'v1',
+        pyramid: Annotated[bool, 'Whether to derive coarser centroid bin sizes from finer ones. See cosilico_py.preprocessing.core.tiling.compute_grid_centroids_multi. Default is False.'] = False,
+        n_workers: Annotated[int, 'Number of worker processes to compute centroids with. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ) -> Annotated[dict[str, LayerMetadata], 'The resulting LayerMetadata objects for the written zarrs.']:
     output_directory = Path(output_directory).expanduser().absolute()
     assert output_directory.is_dir(), f'{output_directory} is not a directory.'
@@ -340,12 +540,13 @@ def write_grouped_metadata_zarrs_from_df(
     feat_meta = source[[id_col, 'x_location', 'y_location', variable_name] + value_cols].copy()
 
     zoom_to_df = generate_layer_metadata_zoom_to_df(
-        feat_meta, id_col, parent_attrs, bin_size_map, fnames, variable_name, value_cols=value_cols, chunk_size=chunk_size, use_disk=use_disk
+        feat_meta, id_col, parent_attrs, bin_size_map, fnames, variable_name, value_cols=value_cols, chunk_size=chunk_size, use_disk=use_disk, pyramid=pyramid, n_workers=n_workers
     )
 
     for zoom, df in zoom_to_df.items():
         df = df.set_index('id')
-        df.index = df.index.astype(str)
+        if parent_attrs.get('id_encoding', 'string') == 'string':
+            df.index = df.index.astype(str)
         df = df.loc[zoom_to_order[zoom]]
         zoom_to_df[zoom] = df
 
@@ -359,7 +560,7 @@ def write_grouped_metadata_zarrs_from_df(
     )
     meta.local_path = (output_directory / f'{meta.id}.zarr.zip').absolute()
     
-    write_grouped_metadata_zarr(zoom_to_df, meta.local_path, 'Count', feat_type, fnames, parent_attrs, 'count', version=version, absolute_vmin=0)
+    write_grouped_metadata_zarr(zoom_to_df, meta.local_path, 'Count', feat_type, fnames, parent_attrs, 'count', version=version, absolute_vmin=0, codecs=codecs)
     to_metadatas['Count'] = meta
 
     # do value cols
@@ -374,7 +575,7 @@ def write_grouped_metadata_zarrs_from_df(
             fields=[name],
         )
         meta.local_path = (output_directory / f'{meta.id}.zarr.zip').absolute()
-        write_grouped_metadata_zarr(zoom_to_df, meta.local_path, name, feat_type, fnames, parent_attrs, value_col, version=version, absolute_vmin=vmin, absolute_vmax=vmax)
+        write_grouped_metadata_zarr(zoom_to_df, meta.local_path, name, feat_type, fnames, parent_attrs, value_col, version=version, absolute_vmin=vmin, absolute_vmax=vmax, codecs=codecs)
         to_metadatas[value_col] = meta
     
     return to_metadatas
@@ -384,140 +585,289 @@ def write_grouped_metadata_zarrs_from_df(
 
 
 # point and polygon dense layers
-def extract_polygons_fast(
+def get_downsample_indices(counts, max_verts=None):
+    """
+    Picks the vertices kept when polygons with the given vertex counts are downsampled to max_verts.
+    Returns the new vertex offsets, and the polygon and original position within that polygon of every kept vertex.
+    """
+    lengths = counts if max_verts is None else np.minimum(counts, max_verts)
+    vertex_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    vertex_offsets[1:] = np.cumsum(lengths)
+
+    polygon = np.repeat(np.arange(len(counts)), lengths)
+    k = np.arange(vertex_offsets[-1]) - vertex_offsets[polygon]
+    if max_verts is not None:
+        # same vertices as np.linspace(0, count - 1, max_verts, dtype=int) for each downsampled polygon
+        down = counts[polygon] > max_verts
+        down_counts = counts[polygon[down]]
+        if max_verts > 1:
+            idx = (k[down] * ((down_counts - 1) / (max_verts - 1))).astype(np.int64)
+            last = k[down] == max_verts - 1
+            idx[last] = down_counts[last] - 1
+        else:
+            idx = np.zeros(len(down_counts), dtype=np.int64)
+        k[down] = idx
+
+    return vertex_offsets, polygon, k
+
+def extract_polygons_ragged(
         df: Annotated[pd.DataFrame, 'Dataframe containing polygon info for features. Must have id_col, vertex_x, and vertex_y columns.'],
         id_col: Annotated[str, 'Column to use a the ID for a polygon'],
         x_col: Annotated[str, 'Column to use a the x vertex location in a polygon'] = 'vertex_x',
         y_col: Annotated[str, 'Column to use a the xyvertex location in a polygon'] = 'vertex_y',
         max_verts: Annotated[int, 'Will downsample polygon verts to this number if not None.'] = None
-    ) -> Annotated[Iterable, 'Returns polygons and their ids']:
+    ) -> Annotated[tuple[np.ndarray, np.ndarray, np.ndarray], 'Vertices (n_vertices, 2), vertex offsets (n_polygons + 1,) and sorted polygon ids. Polygon i is vertices[vertex_offsets[i]:vertex_offsets[i + 1]].']:
     """
-    Extract polygons from a dataframe.
-    If max_verts is provided, downsample polygons with more vertices.
-    If all polygons are shorter than max_verts, the output shape matches the true max.
+    Extract polygons from a dataframe as a flat vertex buffer plus offsets.
+    Rows are grouped by id_col with a stable sort, so vertex order within a polygon is kept.
+    If max_verts is provided, polygons with more vertices are downsampled to max_verts evenly spaced vertices.
     """
-    # Sort df by id_col for fast contiguous grouping
-    df_sorted = df.copy()
-    ids = df_sorted[id_col].to_numpy()
-    x = df_sorted[x_col].to_numpy()
-    y = df_sorted[y_col].to_numpy()
+    codes, unique_ids = pd.factorize(df[id_col].to_numpy(), sort=True)
+    order = None if (np.diff(codes) >= 0).all() else np.argsort(codes, kind='stable')
+    x = df[x_col].to_numpy()
+    y = df[y_col].to_numpy()
 
-    # Identify group boundaries
-    unique_ids, start_idx, counts = np.unique(ids, return_index=True, return_counts=True)
+    counts = np.bincount(codes, minlength=len(unique_ids))
+    starts = np.cumsum(counts) - counts
+    vertex_offsets, polygon, k = get_downsample_indices(counts, max_verts)
 
-    n_cells = len(unique_ids)
-    # Determine actual maximum length to use
-    actual_max = counts.max()
-    if max_verts is not None:
-        final_len = min(max_verts, actual_max)
-    else:
-        final_len = actual_max
+    rows = starts[polygon] + k
+    if order is not None:
+        rows = order[rows]
+    vertices = np.column_stack((x[rows], y[rows])).astype(np.float32)
 
-    polygons = np.full((n_cells, final_len, 2), -1, dtype=np.float32)
+    return vertices, vertex_offsets, unique_ids
 
-    for i, (start, count) in enumerate(zip(start_idx, counts)):
-        coords = np.column_stack((x[start:start + count], y[start:start + count]))
+def take_polygons(vertices, vertex_offsets, idxs):
+    """
+    Selects polygons idxs from a flat vertex buffer. Returns the vertices and offsets of the selection.
+    """
+    lengths = np.diff(vertex_offsets)[idxs]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    polygon = np.repeat(np.arange(len(lengths)), lengths)
+    rows = vertex_offsets[idxs][polygon] + np.arange(offsets[-1]) - offsets[polygon]
+    return vertices[rows], offsets
+
+def downsample_polygons(vertices, vertex_offsets, max_verts):
+    """
+    Downsamples polygons in a flat vertex buffer with more than max_verts vertices to max_verts evenly spaced vertices.
+    """
+    offsets, polygon, k = get_downsample_indices(np.diff(vertex_offsets), max_verts)
+    return vertices[vertex_offsets[polygon] + k], offsets
 
-        if max_verts is not None and count > max_verts:
-            idx = np.linspace(0, count - 1, max_verts, dtype=int)
-            coords = coords[idx]
-        polygons[i, :len(coords), :] = coords
+def simplify_polygons(vertices, vertex_offsets, tolerance, min_verts=4):
+    """
+    Simplifies polygons in a flat vertex buffer, removing vertices that lie within tolerance of the line through their neighbours.
+    Works like Visvalingam-Whyatt with perpendicular distance as the significance measure. Each pass removes every
+    vertex under tolerance that is less significant than its neighbours, and passes repeat until nothing changes.
+    The first and last vertex of every polygon are always kept, so closed rings stay closed, and no polygon drops below min_verts.
+    """
+    xy = vertices.astype(np.float64)
+    lengths = np.diff(vertex_offsets)
+    polygon = np.repeat(np.arange(len(lengths)), lengths)
+    keep = np.arange(len(xy))
+    while True:
+        pts = xy[keep]
+        poly = polygon[keep]
+        first = np.ones(len(keep), dtype=bool)
+        first[1:] = poly[1:] != poly[:-1]
+        last = np.ones(len(keep), dtype=bool)
+        last[:-1] = first[1:]
+        interior = ~(first | last)
+
+        prev = pts[np.maximum(np.arange(len(pts)) - 1, 0)]
+        nxt = pts[np.minimum(np.arange(len(pts)) + 1, len(pts) - 1)]
+        base = nxt - prev
+        rel = pts - prev
+        base_len = np.hypot(base[:, 0], base[:, 1])
+        cross = np.abs(base[:, 0] * rel[:, 1] - base[:, 1] * rel[:, 0])
+        dist = np.where(base_len > 0, cross / np.where(base_len > 0, base_len, 1), np.hypot(rel[:, 0], rel[:, 1]))
+
+        candidate = interior & (dist < tolerance)
+        if not candidate.any():
+            break
+        # only remove local minima so neighbouring vertices are never removed in the same pass
+        remove = candidate.copy()
+        remove[1:] &= ~candidate[:-1] | (dist[1:] < dist[:-1])
+        remove[:-1] &= ~candidate[1:] | (dist[:-1] <= dist[1:])
+
+        counts = np.bincount(poly, minlength=len(lengths))
+        allowed = np.maximum(counts - min_verts, 0)
+        removed_before = np.cumsum(remove) - remove
+        poly_start = np.flatnonzero(first)
+        rank = removed_before - removed_before[poly_start][np.cumsum(first) - 1]
+        remove &= rank < allowed[poly]
+        if not remove.any():
+            break
+        keep = keep[~remove]
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(polygon[keep], minlength=len(lengths)))
+    return vertices[keep], offsets
+
+def pad_polygons(vertices, vertex_offsets, n_verts, fill_value=POLYGON_FILL_VALUE):
+    """
+    Converts a flat vertex buffer to an (n_polygons, n_verts, 2) array of the vertices' dtype, padding shorter polygons with fill_value.
+    """
+    lengths = np.diff(vertex_offsets)
+    polygon = np.repeat(np.arange(len(lengths)), lengths)
+    polygons = np.full((len(lengths), n_verts, 2), fill_value, dtype=vertices.dtype)
+    polygons[polygon, np.arange(len(vertices)) - vertex_offsets[polygon]] = vertices
+    return polygons
+
+def get_polygon_centroids(vertices, vertex_offsets):
+    """
+    Mean vertex of every polygon in a flat vertex buffer.
+    """
+    lengths = np.diff(vertex_offsets)
+    if not len(lengths):
+        return np.zeros((0, 2), dtype=vertices.dtype)
+    sums = np.add.reduceat(vertices.astype(np.float64), vertex_offsets[:-1], axis=0)
+    return (sums / lengths[:, None]).astype(vertices.dtype)
 
+def extract_polygons_fast(
+        df: Annotated[pd.DataFrame, 'Dataframe containing polygon info for features. Must have id_col, vertex_x, and vertex_y columns.'],
+        id_col: Annotated[str, 'Column to use a the ID for a polygon'],
+        x_col: Annotated[str, 'Column to use a the x vertex location in a polygon'] = 'vertex_x',
+        y_col: Annotated[str, 'Column to use a the xyvertex location in a polygon'] = 'vertex_y',
+        max_verts: Annotated[int, 'Will downsample polygon verts to this number if not None.'] = None
+    ) -> Annotated[Iterable, 'Returns polygons and their ids']:
+    """
+    Extract polygons from a dataframe.
+    If max_verts is provided, downsample polygons with more vertices.
+    If all polygons are shorter than max_verts, the output shape matches the true max.
+    """
+    vertices, vertex_offsets, unique_ids = extract_polygons_ragged(df, id_col, x_col=x_col, y_col=y_col, max_verts=max_verts)
+    polygons = pad_polygons(vertices, vertex_offsets, np.diff(vertex_offsets).max())
     return polygons, unique_ids
 
+@profile_stage()
 def get_zoom_to_subs(
         df: Annotated[pd.DataFrame, 'Dataframe containing polygon info for features. Must have id_col, vertex_x, and vertex_y columns.'],
         id_col: Annotated[str, 'ID column to use in df.'],
         zooms: Annotated[Iterable[int], 'Zoom level to gather polygons at.'],
         max_vert_map: Annotated[dict[int, int], 'Maps zoom level to max_verts for polygons at that zoom level.'],
         downsample_map: Annotated[dict[int, int], 'Maps zoom level to n polygons to downsample at that zoom level.'],
-    ) -> Annotated[dict[int, pd.DataFrame], 'Gathered polygons for each grid in dataframe form.']:
+        simplify_map: Annotated[Union[dict[int, float], None], 'Maps zoom level to a simplification tolerance in screen pixels. Polygons at that zoom are simplified before max_verts is applied. Zoom levels that are missing or <= 0 are not simplified. Default is None.'] = None,
+        tile_size: Annotated[int, 'Tile size the zooms were generated with, see cosilico_py.preprocessing.core.image.get_resolutions. A zoom level res is shown at res / tile_size units per screen pixel. Default is 512.'] = 512,
+        tile_budget_map: Annotated[Union[dict[int, int], None], 'Maps zoom level to the maximum number of polygons in each grid at that zoom level. Polygons are sampled per grid in a spatially stratified way and downsample_map is ignored for that zoom level. Zoom levels that are missing or <= 0 have no budget. Default is None.'] = None,
+    ) -> Annotated[dict[int, dict[str, dict]], 'Polygons gathered for each grid at each zoom, as a flat vertex buffer with offsets. n_verts is the vertex count padded layouts use.']:
     zoom_to_subs = {}
     for res in zooms:
         max_verts = max_vert_map[res]
         downsample = downsample_map[res]
-
-        X, ids = extract_polygons_fast(df, id_col, max_verts=max_verts)
-        if downsample > 0 and downsample < X.shape[0] - 1:
-            idxs = np.linspace(0, X.shape[0] - 1, downsample, dtype=int)
-            X, ids = X[idxs], ids[idxs]
-
-        # Compute grid bins for all vertices of all polygons
-        all_x_bins = (X[:, :, 0] // res).astype(int)
-        all_y_bins = (X[:, :, 1] // res).astype(int)
-        all_grids = np.core.defchararray.add(
-            all_x_bins.astype(str), 
-            "_" + all_y_bins.astype(str)
-        )
-
-        zoom_grid_map = defaultdict(lambda: {"X": [], "ids": []})
-
-        for i, cell_id in enumerate(ids):
-            grids = np.unique(all_grids[i])
-            for grid in grids:
-                # print('grid', grid)
-                zoom_grid_map[grid]["X"].append(X[i])
-                zoom_grid_map[grid]["ids"].append(cell_id)
-
+        tolerance = (simplify_map or {}).get(res, 0)
+        budget = (tile_budget_map or {}).get(res, 0)
+
+        if tolerance > 0:
+            vertices, vertex_offsets, ids = extract_polygons_ragged(df, id_col)
+            vertices, vertex_offsets = simplify_polygons(vertices, vertex_offsets, tolerance * res / tile_size)
+            if max_verts is not None:
+                vertices, vertex_offsets = downsample_polygons(vertices, vertex_offsets, max_verts)
+        else:
+            vertices, vertex_offsets, ids = extract_polygons_ragged(df, id_col, max_verts=max_verts)
+        n_verts = int(np.diff(vertex_offsets).max(initial=0))
+        if budget <= 0 and downsample > 0 and downsample < len(ids) - 1:
+            idxs = np.linspace(0, len(ids) - 1, downsample, dtype=int)
+            vertices, vertex_offsets = take_polygons(vertices, vertex_offsets, idxs)
+            ids = ids[idxs]
+
+        tiles = get_polygon_tiles(vertices, vertex_offsets, res)
+        if budget > 0:
+            # fixed priorities, so a polygon kept in a grid is likely kept wherever it appears and at finer zooms
+            priority = np.random.default_rng(0).permutation(len(ids))
+            tiles = sample_tiles_stratified(tiles, get_polygon_centroids(vertices, vertex_offsets), res, budget, priority)
         grid_to_info = {}
-        for grid, data in zoom_grid_map.items():
+        for grid, start, stop in zip(tiles['labels'], tiles['start'], tiles['stop']):
+            idxs = tiles['polygons'][start:stop]
+            tile_vertices, tile_offsets = take_polygons(vertices, vertex_offsets, idxs)
             grid_to_info[grid] = {
-                "X": np.stack(data["X"]),
-                "ids": data["ids"]
+                "vertices": tile_vertices,
+                "vertex_offsets": tile_offsets,
+                "n_verts": n_verts,
+                "ids": ids[idxs].tolist()
             }
-        
-         # get rid of negative bins as result of padding
-        grid_to_info = {k:v for k, v in grid_to_info.items() if '-' not in k}
 
         zoom_to_subs[res] = grid_to_info
 
     return zoom_to_subs
 
 
+@profile_stage()
 def write_ungrouped_layer_zarr(
         zoom_to_subs: Annotated[dict[int, pd.DataFrame], 'Gathered polygons for each grid in dataframe form. From cosilico_py.preprocessing.core.layer.get_zoom_to_subs.'],
         zarr_path: Annotated[os.PathLike, 'Filepath to write output .zarr.zip file.'],
         name: Annotated[str, 'Name of Layer.'],
         object_type_map: Annotated[dict[int, str], 'Maps object type (point or polygon), to zoom level.'],
+        n_workers: Annotated[int, 'Number of threads to encode and compress tiles with. If greater than 1, tiles are written to a staging directory and packed into the .zarr.zip afterwards. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for tile and ID datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        coordinate_encoding: Annotated[str, 'How polygon vertices are stored. "float32" stores absolute pixel coordinates. "uint16" stores offsets from the tile origin moved out by quantization_margin, with the steps recorded in the coordinates attr. Not yet read by the viewer. Default is "float32".'] = 'float32',
+        quantization_margin: Annotated[float, 'Fraction of the tile size that quantized vertices may extend past each tile edge, polygons are kept whole in every tile they touch. Default is 0.5.'] = 0.5,
+        polygon_layout: Annotated[str, 'How polygons are stored. "padded" writes vertices as (n_polygons, n_verts, 2) padded with -1, or with 65535 when coordinate_encoding is "uint16" (recorded as fill_value in the coordinates attr). "ragged" writes vertices as (n_vertices, 2) plus vertex_offsets, polygon i is vertices[vertex_offsets[i]:vertex_offsets[i + 1]]. Not yet read by the viewer. Default is "padded".'] = 'padded',
     ):
-    store = zarr.storage.ZipStore(zarr_path, mode='w')
-    root = zarr.group(store=store, overwrite=True)
-
-    resolutions = sorted(zoom_to_subs.keys())
-
-    root.attrs.update({
-        'version': 'v1',
-        'name': name,
-        'resolutions': resolutions,
-        'object_types': [object_type_map[x] for x in resolutions],
-    })
+    assert coordinate_encoding in COORDINATE_ENCODINGS, f'coordinate_encoding must be one of {COORDINATE_ENCODINGS}, got {coordinate_encoding}.'
+    assert polygon_layout in POLYGON_LAYOUTS, f'polygon_layout must be one of {POLYGON_LAYOUTS}, got {polygon_layout}.'
+    quantized = coordinate_encoding == 'uint16'
+
+    with write_zarr_zip(zarr_path, n_workers=n_workers) as store, ParallelArrayWriter(n_workers) as writer:
+        root = zarr.group(store=store, overwrite=True)
+
+        resolutions = sorted(zoom_to_subs.keys())
+
+        attrs = {
+            'version': 'v1',
+            'name': name,
+            'resolutions': resolutions,
+            'object_types': [object_type_map[x] for x in resolutions],
+        }
+        if polygon_layout != 'padded':
+            attrs['polygon_layout'] = polygon_layout
+        # padded layouts keep the largest uint16 value free for padding
+        max_value = QUANTIZED_POLYGON_FILL_VALUE - 1 if polygon_layout == 'padded' else np.iinfo(np.uint16).max
+        if quantized:
+            attrs['coordinates'] = {
+                'encoding': coordinate_encoding,
+                'margin': quantization_margin,
+                'steps': {str(zoom): get_quantization_step(zoom, quantization_margin, max_value) for zoom in resolutions},
+            }
+            if polygon_layout == 'padded':
+                attrs['coordinates']['fill_value'] = int(QUANTIZED_POLYGON_FILL_VALUE)
+        root.attrs.update(attrs)
     
-    metadata_root = root.create_group("metadata")
-    ids_group = metadata_root.create_group("ids")
-
-    zoom_root = root.create_group("zooms")
-    for zoom, grid_to_info in zoom_to_subs.items():
-        zoom_group = zoom_root.create_group(str(zoom))
-
-        block_ids = []        
-        for grid, info in grid_to_info.items():
-            grid_group = zoom_group.create_group(grid)
-            block_idxs = np.arange(len(block_ids), len(block_ids) + len(info['ids']))
-            block_ids += info['ids']
-
-            xs = grid_group.create_dataset("id", shape=(len(info['ids']),), chunks=(len(info['ids']),), dtype=object, object_codec=numcodecs.VLenUTF8())
-            xs[:] = np.asarray(info['ids'], object)
-
-            xs = grid_group.create_dataset("id_idxs", shape=(len(info['ids']),), chunks=(len(info['ids']),), dtype='uint32')
-            xs[:] = block_idxs
-
-            xs = grid_group.create_dataset("vertices", shape=info['X'].shape, chunks=info['X'].shape, dtype='float32')
-            xs[:] = info['X']
-
-        ids = ids_group.create_dataset(str(zoom), shape=(len(block_ids),), chunks=(len(block_ids),), dtype=object, object_codec=numcodecs.VLenUTF8())
-        ids[:] = np.asarray(block_ids, dtype=object)
-
-    store.close()
+        metadata_root = root.create_group("metadata")
+        ids_group = metadata_root.create_group("ids")
+
+        zoom_root = root.create_group("zooms")
+        for zoom, grid_to_info in zoom_to_subs.items():
+            zoom_group = zoom_root.create_group(str(zoom))
+
+            block_ids = []        
+            for grid, info in grid_to_info.items():
+                grid_group = zoom_group.create_group(grid)
+                block_idxs = np.arange(len(block_ids), len(block_ids) + len(info['ids']))
+                block_ids += info['ids']
+
+                xs = grid_group.create_dataset("id", shape=(len(info['ids']),), chunks=(len(info['ids']),), dtype=object, object_codec=numcodecs.VLenUTF8(), **get_codec_kwargs(codecs, 'strings'))
+                writer.write(xs, np.asarray(info['ids'], object))
+
+                xs = grid_group.create_dataset("id_idxs", shape=(len(info['ids']),), chunks=(len(info['ids']),), dtype='uint32', **get_codec_kwargs(codecs, 'id_idxs'))
+                writer.write(xs, block_idxs)
+
+                X = info['vertices']
+                if quantized:
+                    step = get_quantization_step(zoom, quantization_margin, max_value)
+                    X = quantize_coordinates(X, get_tile_offset(grid, zoom, quantization_margin), step, max_value)
+                if polygon_layout == 'ragged':
+                    offsets = grid_group.create_dataset("vertex_offsets", shape=info['vertex_offsets'].shape, chunks=info['vertex_offsets'].shape, dtype='uint32', **get_codec_kwargs(codecs, 'vertex_offsets'))
+                    writer.write(offsets, info['vertex_offsets'])
+                else:
+                    X = pad_polygons(X, info['vertex_offsets'], info['n_verts'], fill_value=QUANTIZED_POLYGON_FILL_VALUE if quantized else POLYGON_FILL_VALUE)
+                xs = grid_group.create_dataset("vertices", shape=X.shape, chunks=X.shape, dtype='uint16' if quantized else 'float32', **get_codec_kwargs(codecs, 'vertices'))
+                writer.write(xs, X)
+
+            ids = ids_group.create_dataset(str(zoom), shape=(len(block_ids),), chunks=(len(block_ids),), dtype=object, object_codec=numcodecs.VLenUTF8(), **get_codec_kwargs(codecs, 'strings'))
+            ids[:] = np.asarray(block_ids, dtype=object)
 
 def write_ungrouped_layer_zarr_from_df(
         experiment_id: Annotated[str, 'ID of the parent experiment.'],
@@ -529,11 +879,18 @@ def write_ungrouped_layer_zarr_from_df(
         max_vert_map: Annotated[dict[int, int], 'Maps zoom level to max_verts for polygons at that zoom level.'],
         downsample_map: Annotated[dict[int, int], 'Maps zoom level to n polygons to downsample at that zoom level.'],
         object_type_map: Annotated[dict[int, str], 'Maps object type (point or polygon), to zoom level.'],
+        n_workers: Annotated[int, 'Number of threads to write tiles with. See cosilico_py.preprocessing.core.layer.write_ungrouped_layer_zarr. Default is 1.'] = 1,
+        codecs: Annotated[Union[str, dict], 'Codec policy for tile and ID datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
+        coordinate_encoding: Annotated[str, 'How polygon vertices are stored. Can be "float32" or "uint16". See cosilico_py.preprocessing.core.layer.write_ungrouped_layer_zarr. Default is "float32".'] = 'float32',
+        polygon_layout: Annotated[str, 'How polygons are stored. Can be "padded" or "ragged". See cosilico_py.preprocessing.core.layer.write_ungrouped_layer_zarr. Default is "padded".'] = 'padded',
+        simplify_map: Annotated[Union[dict[int, float], None], 'Maps zoom level to a polygon simplification tolerance in screen pixels. See cosilico_py.preprocessing.core.layer.get_zoom_to_subs. Default is None.'] = None,
+        tile_budget_map: Annotated[Union[dict[int, int], None], 'Maps zoom level to the maximum number of polygons in each grid. Replaces downsample_map for those zoom levels. See cosilico_py.preprocessing.core.layer.get_zoom_to_subs. Default is None.'] = None,
+        tile_size: Annotated[int, 'Tile size the zooms were generated with, used to convert simplify_map tolerances from screen pixels. See cosilico_py.preprocessing.core.layer.get_zoom_to_subs. Default is 512.'] = 512,
     ) -> Annotated[Layer, 'The resulting Layer object.']:
     output_directory = Path(output_directory).expanduser().absolute()
     assert output_directory.is_dir(), f'{output_directory} is not a directory.'
 
-    zoom_to_subs = get_zoom_to_subs(source, id_col, zooms, max_vert_map, downsample_map)
+    zoom_to_subs = get_zoom_to_subs(source, id_col, zooms, max_vert_map, downsample_map, simplify_map=simplify_map, tile_budget_map=tile_budget_map, tile_size=tile_size)
 
     layer = Layer(
         name=name,
@@ -542,7 +899,7 @@ def write_ungrouped_layer_zarr_from_df(
     )
     layer.local_path = (output_directory / f'{layer.id}.zarr.zip').absolute()
 
-    write_ungrouped_layer_zarr(zoom_to_subs, layer.local_path, name, object_type_map)
+    write_ungrouped_layer_zarr(zoom_to_subs, layer.local_path, name, object_type_map, n_workers=n_workers, codecs=codecs, coordinate_encoding=coordinate_encoding, polygon_layout=polygon_layout)
 
     return layer
 
@@ -550,66 +907,80 @@ def write_ungrouped_layer_zarr_from_df(
 
 
 # non-grouped metadata
+def iter_row_blocks(X, chunk_size):
+    """
+    Yields (start, block) CSR blocks of chunk_size rows from X. X can be dense, any scipy sparse matrix, or a lazy matrix with its own
+    iter_row_blocks such as cosilico_py.preprocessing.platform_helpers.x10.X10H5Matrix, which reads blocks from disk as they are needed.
+    """
+    if hasattr(X, 'iter_row_blocks'):
+        yield from X.iter_row_blocks(chunk_size)
+        return
+
+    X = X.tocsr() if issparse(X) else coo_matrix(X).tocsr()
+    for start in range(0, X.shape[0], chunk_size):
+        yield start, X[start:min(start + chunk_size, X.shape[0])]
+
+@profile_stage()
 def combine_barcoded_data(
         spatial_df: Annotated[pd.DataFrame, "DataFrame containing 'barcode', 'x_location', 'y_location'."],
-        adata: Annotated[AnnData, 'Anndata ported container.'],
+        adata: Annotated[AnnData, 'Anndata ported container. X can be lazy, see cosilico_py.preprocessing.platform_helpers.x10.read_10x_h5.'],
         chunk_size: Annotated[int, 'How many rows to process at a time'] = 100_000
     ) -> Annotated[pd.DataFrame, "DataFrame with 'barcode', 'feature_name', 'x_location', 'y_location', 'count'."]:
     """
     Combines spatial locations with count information.
-    """
-    # Convert AnnData matrix to sparse CSC format if needed (efficient column slicing)
-    if not issparse(adata.X):
-        adata.X = coo_matrix(adata.X)  # Convert dense matrix to sparse COO format
-    
-    X = adata.X.tocsc()  # Convert to CSC for fast feature-wise slicing
-
-    # Convert barcodes and feature names to arrays
-    barcodes = np.array(adata.obs.index, dtype=str)  # Ensure barcode index is a NumPy string array
-    features = np.array(adata.var.index, dtype=str)  # Ensure feature index is a NumPy string array
-
-    # Preallocate results list
-    results = []
-
-    # Process data in chunks
-    for start in range(0, X.shape[0], chunk_size):
-        end = min(start + chunk_size, X.shape[0])
 
-        # Extract a chunk of the barcode indices
-        barcode_chunk = barcodes[start:end]
-
-        # Convert to COO to extract nonzero values efficiently
-        X_chunk = X[start:end].tocoo()
+    The matrix is walked in CSR row blocks (see iter_row_blocks) and only integer codes are kept per nonzero. The barcode index is a
+    CategoricalIndex and feature_name a Categorical, both with sorted categories, so no strings are created per nonzero.
+    """
+    # shared dictionary, barcode codes rank the same as the sorted strings
+    barcode_codes, barcodes = pd.factorize(np.asarray(adata.obs.index, dtype=object), sort=True)
 
-        # Extract nonzero indices and values
-        barcode_indices = X_chunk.row
-        feature_indices = X_chunk.col
-        transcript_counts = X_chunk.data  # Nonzero counts
+    if spatial_df is not None:
+        assert spatial_df.index.is_unique, 'spatial_df index must be unique.'
+        spatial_rows = spatial_df.index.get_indexer(barcodes)
 
-        # Convert indices to actual barcode and feature names
-        barcode_values = barcode_chunk[barcode_indices]  # Fast slicing
-        feature_values = features[feature_indices]  # Fast slicing
+    cells, feats, counts = [], [], []
+    for start, X_chunk in iter_row_blocks(adata.X, chunk_size):
+        X_chunk = X_chunk.tocoo()
+        cell = barcode_codes[start + X_chunk.row]
+        feat = X_chunk.col.astype(np.int32)
+        count = X_chunk.data.astype(np.uint16)
 
-        # Create DataFrame for transcript counts (memory-efficient dtypes)
-        counts_df = pd.DataFrame({
-            "barcode": barcode_values,
-            "feature_name": feature_values,
-            "count": transcript_counts.astype(np.uint16)  # Reduce memory footprint
-        }).set_index('barcode')
-        
         if spatial_df is not None:
-            # Merge spatial data with counts using an efficient join
-            merged_df = counts_df.merge(spatial_df, right_index=True, left_index=True, how="inner")
+            keep = spatial_rows[cell] >= 0
+            cell, feat, count = cell[keep], feat[keep], count[keep]
+
+        cells.append(cell)
+        feats.append(feat)
+        counts.append(count)
+
+    cell = np.concatenate(cells) if cells else np.zeros(0, dtype=np.int64)
+    feat = np.concatenate(feats) if feats else np.zeros(0, dtype=np.int32)
+
+    # feature dictionary of the features that have counts, codes rank the same as the sorted names
+    features = np.array(adata.var.index, dtype=str)
+    used = np.bincount(feat, minlength=len(features)) > 0
+    used_codes, feature_names = pd.factorize(features[used], sort=True)
+    feature_codes = np.full(len(features), -1, dtype=np.int32)
+    feature_codes[used] = used_codes
+    feat = feature_codes[feat]
+
+    feature_name = pd.Categorical.from_codes(feat, categories=feature_names)
+    final_df = pd.DataFrame(
+        {
+            'feature_name': feature_name,
+            'count': np.concatenate(counts) if counts else np.zeros(0, dtype=np.uint16),
+        },
+        index=pd.CategoricalIndex(pd.Categorical.from_codes(cell, categories=barcodes), name='barcode'),
+    )
 
-            # Store result in list (avoids large intermediate DataFrames)
-            results.append(merged_df)
-        else:
-            results.append(counts_df)
+    if spatial_df is not None:
+        rows = spatial_rows[cell]
+        for col in spatial_df.columns:
+            final_df[col] = spatial_df[col].array.take(rows)
 
-    # Concatenate final results and reset index
-    final_df = pd.concat(results)
-    final_df['feature_name'] = final_df['feature_name'].astype(str).astype("category")
-    final_df['feature_index'] = pd.Categorical(final_df["feature_name"].cat.codes)
+    codes = feature_name.codes
+    final_df['feature_index'] = pd.Categorical.from_codes(codes, categories=np.arange(len(feature_names), dtype=codes.dtype))
 
     return final_df
 
@@ -617,21 +988,48 @@ def get_zoom_to_sparse_dfs(
         source: Annotated[pd.DataFrame, 'Source dataframe.'],
         root: Annotated[zarr.Group, 'Zarr group from parent']
     ) -> dict:
+    """
+    Gathers the rows of source belonging to the ids in every grid of the parent layer. Rows keep their order in source.
+
+    Source index values are coded to integers once and rows are grouped by code, so each grid's rows are gathered
+    from per id offset ranges instead of scanning source for every grid.
+    """
     zoom_group = root['/zooms']
     zoom_to_dfs = {}
 
-    source_index = source.index
+    codes, uniques = pd.factorize(source.index)
+    # rows with a missing index value (code -1) belong to no id and are left out of the offsets
+    valid = np.flatnonzero(codes >= 0)
+    order = valid[np.argsort(codes[valid], kind='stable')]
+    counts = np.bincount(codes[valid], minlength=len(uniques))
+    starts = np.cumsum(counts) - counts
 
     for zoom, group in zoom_group.groups():
         zoom_to_dfs[zoom] = {}
 
+        grids, grid_codes = [], []
         for grid, grid_group in group.groups():
-            ids = grid_group['id']
-            mask = source_index.isin(ids)
-            f = source.loc[mask]
-            zoom_to_dfs[zoom][grid] = f
+            ids = uniques.get_indexer(pd.Index(grid_group['id'][:]).unique())
+            grids.append(grid)
+            grid_codes.append(ids[ids >= 0])
+
+        # rows for every (grid, id) pair, expanded from the offset ranges and put back in source order within each grid
+        code = np.concatenate(grid_codes) if grid_codes else np.zeros(0, dtype=np.int64)
+        grid_idx = np.repeat(np.arange(len(grids)), [len(x) for x in grid_codes])
+        lengths = counts[code]
+        pair = np.repeat(np.arange(len(code)), lengths)
+        pair_offsets = np.cumsum(lengths) - lengths
+        rows = order[starts[code][pair] + np.arange(len(pair)) - pair_offsets[pair]]
+        row_grids = grid_idx[pair]
+        sort = np.lexsort((rows, row_grids))
+        gathered = source.iloc[rows[sort]]
+
+        stops = np.cumsum(np.bincount(row_grids, minlength=len(grids)))
+        for grid, start, stop in zip(grids, stops - np.diff(np.concatenate([[0], stops])), stops):
+            zoom_to_dfs[zoom][grid] = gathered.iloc[start:stop]
     return zoom_to_dfs
 
+@profile_stage()
 def write_sparse_continuous_metadata_zarr(
         zoom_to_dfs: Annotated[dict, 'Result of get_zoom_to_sparse_dfs.'],
         fnames: Annotated[Iterable[str], 'Field names for Fields in variable group.'],
@@ -640,7 +1038,8 @@ def write_sparse_continuous_metadata_zarr(
         name: Annotated[str, 'Name of variable.'],
         vmins: Annotated[Iterable, 'vmin for fields in fnames, should be same length as fnames'],
         vmaxs: Annotated[Iterable, 'vmax for fields in fnames, should be same length as fnames'],
-        vcenters: Annotated[Iterable, 'vcenter for fields in fnames, should be same length as fnames. If none no center will be used.'] = None
+        vcenters: Annotated[Iterable, 'vcenter for fields in fnames, should be same length as fnames. If none no center will be used.'] = None,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ):
     assert len(fnames) == len(vmins), 'fnames and vmins should be the same length.'
     assert len(fnames) == len(vmaxs), 'fnames and vmaxs should be the same length.'
@@ -677,22 +1076,25 @@ def write_sparse_continuous_metadata_zarr(
         for grid, df in d.items():
             grid_group = group.create_group(grid)
         
-            xs = grid_group.create_dataset('ids', shape=df.shape[0], chunks=df.shape[0], dtype=object, object_codec=numcodecs.VLenUTF8())    
+            xs = grid_group.create_dataset('ids', shape=df.shape[0], chunks=df.shape[0], dtype=object, object_codec=numcodecs.VLenUTF8(), **get_codec_kwargs(codecs, 'strings'))
             xs[:] = np.asarray(df.index.astype(object).to_list())
             
-            xs = grid_group.create_dataset('values', shape=df.shape[0], chunks=df.shape[0], dtype='float32')    
+            xs = grid_group.create_dataset('values', shape=df.shape[0], chunks=df.shape[0], dtype='float32', **get_codec_kwargs(codecs, 'values'))
             xs[:] = df[value_col].values
             
-            xs = grid_group.create_dataset('feature_indices', shape=df.shape[0], chunks=df.shape[0], dtype='uint32')    
+            xs = grid_group.create_dataset('feature_indices', shape=df.shape[0], chunks=df.shape[0], dtype='uint32', **get_codec_kwargs(codecs, 'feature_index'))
             xs[:] = df['feature_index'].astype(int).values
     
+    consolidate_zarr_zip(store)
     store.close()
 
+@profile_stage()
 def write_categorical_metadata_zarr(
         zoom_to_values: Annotated[dict[int, Iterable], 'Maps zoom level to values for each zoom level.'],
         fnames: Annotated[Iterable[str], 'Field names for Fields in variable group.'],
         zarr_path: Annotated[os.PathLike, 'Filepath to write output .zarr.zip file.'],
         name: Annotated[str, 'Name of variable.'],
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ):
     store = zarr.storage.ZipStore(zarr_path, mode='w')
     root = zarr.group(store=store, overwrite=True)
@@ -710,11 +1112,13 @@ def write_categorical_metadata_zarr(
 
     object_group = root.create_group("object")
     for zoom, values in zoom_to_values.items():
-        xs = object_group.create_dataset(str(zoom), shape=(len(values),), chunks=50_000, dtype='uint32') 
+        xs = object_group.create_dataset(str(zoom), shape=(len(values),), chunks=50_000, dtype='uint32', **get_codec_kwargs(codecs, 'values'))
         xs[:] = values
     
+    consolidate_zarr_zip(store)
     store.close()
 
+@profile_stage()
 def write_continuous_metadata_zarr(
         zoom_to_df: Annotated[dict[int, pd.DataFrame], 'Zoom to dataframe where each column is a variable in the variable group.'],
         fnames: Annotated[Iterable[str], 'Field names for Fields in variable group. In this case fields correspond to a variable in the variable group.'],
@@ -722,7 +1126,8 @@ def write_continuous_metadata_zarr(
         name: Annotated[str, 'Name of variable group.'],
         vmins: Annotated[Iterable, 'vmin for fields in fnames, should be same length as fnames'],
         vmaxs: Annotated[Iterable, 'vmax for fields in fnames, should be same length as fnames'],
-        vcenters: Annotated[Iterable, 'vcenter for fields in fnames, should be same length as fnames. If none no center will be used.'] = None
+        vcenters: Annotated[Iterable, 'vcenter for fields in fnames, should be same length as fnames. If none no center will be used.'] = None,
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ):
     
     store = zarr.storage.ZipStore(zarr_path, mode='w')
@@ -753,9 +1158,10 @@ def write_continuous_metadata_zarr(
         
     object_root = root.create_group("object")
     for zoom, df in zoom_to_df.items():
-        xs = object_root.create_dataset(str(zoom), shape=df.shape, chunks=(10_000, df.shape[1]), dtype='float32')    
+        xs = object_root.create_dataset(str(zoom), shape=df.shape, chunks=(10_000, df.shape[1]), dtype='float32', **get_codec_kwargs(codecs, 'values'))
         xs[:] = df.values
     
+    consolidate_zarr_zip(store)
     store.close()
 
 def write_sparse_continuous_ungrouped_layer_metadata(
@@ -766,12 +1172,12 @@ def write_sparse_continuous_ungrouped_layer_metadata(
         value_col: Annotated[str, 'column to use in dataframe for value.'],
         parent_zarr_path: Annotated[str, 'Filepath to parent layer zarr.'],
         output_directory: Annotated[os.PathLike, 'Directory in which to write the .zarr.zip file.'],
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ) -> Annotated[Layer, 'The resulting Layer Metadata object.']:
     output_directory = Path(output_directory).expanduser().absolute()
     assert output_directory.is_dir(), f'{output_directory} is not a directory.'
 
-    store = zarr.storage.ZipStore(parent_zarr_path, mode='r')
-    root = zarr.group(store=store)
+    store, root = open_zarr_zip(parent_zarr_path)
     zoom_to_dfs = get_zoom_to_sparse_dfs(source, root)
     store.close()
 
@@ -789,7 +1195,7 @@ def write_sparse_continuous_ungrouped_layer_metadata(
     meta.local_path = (output_directory / f'{meta.id}.zarr.zip').absolute()
 
     write_sparse_continuous_metadata_zarr(
-        zoom_to_dfs, fnames, value_col, meta.local_path, name, vmins, vmaxs, vcenters=vcenters
+        zoom_to_dfs, fnames, value_col, meta.local_path, name, vmins, vmaxs, vcenters=vcenters, codecs=codecs
     )
 
     return meta
@@ -800,12 +1206,12 @@ def write_categorical_ungrouped_layer_metadata(
         values: Annotated[pd.Series, 'Values we are writing. IDs must match the IDs on the parent layer.'],
         parent_zarr_path: Annotated[str, 'Filepath to parent layer zarr.'],
         output_directory: Annotated[os.PathLike, 'Directory in which to write the .zarr.zip file.'],
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ) -> Annotated[Layer, 'The resulting Layer Metadata object.']:
     output_directory = Path(output_directory).expanduser().absolute()
     assert output_directory.is_dir(), f'{output_directory} is not a directory.'
 
-    store = zarr.storage.ZipStore(parent_zarr_path, mode='r')
-    root = zarr.group(store=store)
+    store, root = open_zarr_zip(parent_zarr_path)
     attrs = root.attrs
     zoom_to_order = {res:root[f'/metadata/ids/{res}'][:] for res in attrs['resolutions']}
     store.close()
@@ -828,7 +1234,7 @@ def write_categorical_ungrouped_layer_metadata(
     meta.local_path = (output_directory / f'{meta.id}.zarr.zip').absolute()
 
     write_categorical_metadata_zarr(
-        zoom_to_values, fnames, meta.local_path, name
+        zoom_to_values, fnames, meta.local_path, name, codecs=codecs
     )
 
     return meta
@@ -839,12 +1245,12 @@ def write_continuous_ungrouped_layer_metadata(
         values_df: Annotated[pd.DataFrame, 'Dataframe with continuous variables we are writing for this variable group. Must be in the same order as the IDs on the parent layer and index must be entity IDs from the parent layer.'],
         parent_zarr_path: Annotated[str, 'Filepath to parent layer zarr.'],
         output_directory: Annotated[os.PathLike, 'Directory in which to write the .zarr.zip file.'],
+        codecs: Annotated[Union[str, dict], 'Codec policy for the value datasets. See cosilico_py.preprocessing.core.zarr.CODEC_POLICIES. Default is "default".'] = 'default',
     ) -> Annotated[Layer, 'The resulting Layer Metadata object.']:
     output_directory = Path(output_directory).expanduser().absolute()
     assert output_directory.is_dir(), f'{output_directory} is not a directory.'
 
-    store = zarr.storage.ZipStore(parent_zarr_path, mode='r')
-    root = zarr.group(store=store)
+    store, root = open_zarr_zip(parent_zarr_path)
     attrs = root.attrs
     zoom_to_order = {res:root[f'/metadata/ids/{res}'][:] for res in attrs['resolutions']}
     store.close()
@@ -872,7 +1278,7 @@ def write_continuous_ungrouped_layer_metadata(
     meta.local_path = (output_directory / f'{meta.id}.zarr.zip').absolute()
 
     write_continuous_metadata_zarr(
-        zoom_to_values_df, fnames, meta.local_path, name, vmins, vmaxs
+        zoom_to_values_df, fnames, meta.local_path, name, vmins, vmaxs, codecs=codecs
     )
 
     return meta
\ No newline at end of file
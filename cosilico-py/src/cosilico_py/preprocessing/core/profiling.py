@@ -0,0 +1,183 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Annotated, Union
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+ACTIVE_PROFILERS = []
+
+def get_rss():
+    """
+    Current resident set size in bytes. Falls back to the lifetime peak where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return get_peak_rss()
+
+def get_peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def get_bytes_written():
+    """
+    Bytes written by this process so far, or None where /proc/self/io is unavailable.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def get_output_bytes(obj):
+    """
+    Size on disk of the files referenced by obj. obj can be a path, an object with a local_path (Image, Layer, LayerMetadata), or a list/dict of those.
+    """
+    if obj is None:
+        return 0
+    if isinstance(obj, dict):
+        return sum(get_output_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(get_output_bytes(v) for v in obj)
+    if hasattr(obj, 'local_path'):
+        obj = obj.local_path
+    if not isinstance(obj, (str, os.PathLike)):
+        return 0
+    path = Path(obj)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class StageProfiler(object):
+    """
+    Records wall time, CPU time, peak RSS and bytes written for nested stages.
+
+    Stages are opened with the stage context manager. While the profiler is active (used as a context manager),
+    functions decorated with profile_stage are recorded as sub-stages of whatever stage is open.
+
+        profiler = StageProfiler()
+        with profiler:
+            with profiler.stage('transcripts') as record:
+                layer = write_grouped_layer_zarr_from_df(...)
+                record['output_bytes'] = get_output_bytes(layer)
+        profiler.write('profile.json')
+    """
+    def __init__(self, interval=0.05, enabled=True):
+        self.interval = interval
+        self.enabled = enabled
+        self.records = []
+        self.open_records = []
+        self.stop_event = None
+        self.sampler = None
+
+    def sample(self, stop_event):
+        while not stop_event.wait(self.interval):
+            rss = get_rss()
+            for record in list(self.open_records):
+                record['peak_rss_bytes'] = max(record['peak_rss_bytes'], rss)
+
+    def start(self):
+        if not self.enabled or self.sampler is not None:
+            return
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, args=(self.stop_event,), daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        if self.sampler is None:
+            return
+        self.stop_event.set()
+        self.sampler.join()
+        self.sampler = None
+
+    def __enter__(self):
+        ACTIVE_PROFILERS.append(self)
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        ACTIVE_PROFILERS.remove(self)
+        return False
+
+    @contextmanager
+    def stage(self, name, **info):
+        """
+        Context manager recording a single stage. Yields the stage record, extra fields (e.g. output_bytes) can be added to it.
+        """
+        if not self.enabled:
+            yield dict(info)
+            return
+
+        rss = get_rss()
+        record = {
+            'stage': name,
+            'parent': self.open_records[-1]['stage'] if self.open_records else None,
+            'depth': len(self.open_records),
+            **info,
+            'start_rss_bytes': rss,
+            'peak_rss_bytes': rss,
+        }
+        self.records.append(record)
+        self.open_records.append(record)
+
+        written = get_bytes_written()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['peak_rss_bytes'] = max(record['peak_rss_bytes'], get_rss())
+            if written is not None:
+                record['bytes_written'] = get_bytes_written() - written
+            self.open_records.remove(record)
+
+    def report(self) -> dict:
+        top = [r for r in self.records if r['depth'] == 0]
+        return {
+            'stages': self.records,
+            'total_wall_seconds': sum(r['wall_seconds'] for r in top if 'wall_seconds' in r),
+            'total_cpu_seconds': sum(r['cpu_seconds'] for r in top if 'cpu_seconds' in r),
+            'peak_rss_bytes': get_peak_rss(),
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+
+def get_active_profiler():
+    return ACTIVE_PROFILERS[-1] if ACTIVE_PROFILERS else None
+
+def profile_stage(
+        name: Annotated[Union[str, None], 'Name of the stage. Default is the name of the decorated function.'] = None,
+    ):
+    """
+    Decorator recording calls to the wrapped function as a stage of the active StageProfiler. Does nothing when no profiler is active.
+    """
+    def decorator(fn):
+        stage_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = get_active_profiler()
+            if profiler is None or not profiler.enabled:
+                return fn(*args, **kwargs)
+            with profiler.stage(stage_name) as record:
+                result = fn(*args, **kwargs)
+                record['output_bytes'] = get_output_bytes(result)
+            return result
+        return wrapper
+    return decorator
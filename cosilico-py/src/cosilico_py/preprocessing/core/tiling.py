@@ -1,53 +1,917 @@
 from collections.abc import Iterable
-from typing import Annotated
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Annotated, Union
 import os
+import shutil
 import tempfile
 
 
 import numpy as np
 import pandas as pd
 
+def get_feature_groups(
+        feature_index: Annotated[pd.Series, 'Feature index of every row.'],
+        n_per_group: Annotated[int, 'The number of fields to include in each group.'] = 100,
+    ) -> Annotated[pd.Series, 'Categorical series mapping feature index to group.']:
+    """
+    Assigns features to groups. Features are sorted by count and dealt out to groups round robin.
+    """
+    feat_counts = feature_index.value_counts().sort_values()
+    feats, _ = feat_counts.index.to_numpy(), feat_counts.values
+
+    # Compute group assignments
+    num_feats = len(feats)
+    group_size = num_feats // n_per_group
+    groups = np.arange(num_feats) % group_size  # Vectorized operation
+
+    return pd.Series(groups, index=feats, dtype="category")
+
+def get_balanced_feature_groups(
+        feature_index: Annotated[pd.Series, 'Feature index of every row.'],
+        x_location: Annotated[np.ndarray, 'x location of every row.'],
+        y_location: Annotated[np.ndarray, 'y location of every row.'],
+        grid_size: Annotated[int, 'Size of the grid used when tiling.'],
+        target_chunk_bytes: Annotated[int, 'Target number of bytes for a (grid, group) chunk.'] = 1_000_000,
+        bytes_per_point: Annotated[int, 'Estimated bytes written per point.'] = 24,
+    ) -> Annotated[pd.Series, 'Categorical series mapping feature index to group.']:
+    """
+    Assigns features to groups so (grid, group) chunks stay under target_chunk_bytes.
+    Each feature is weighted by its count in its densest grid, and features are bin packed first fit decreasing.
+    The summed weights of a group bound every chunk of that group. Features heavier than the target get their own group.
+    """
+    feature_index = feature_index.astype('category')
+    codes = feature_index.cat.codes.to_numpy()
+
+    grid_keys, _, _ = pack_keys([(x_location // grid_size).astype(np.int64), (y_location // grid_size).astype(np.int64)])
+    keys, mins, extents = pack_keys([codes, grid_keys])
+    unique_keys, counts, _ = reduce_by_key(keys, int(np.prod(extents, dtype=object)), {})
+    feature_codes, _ = unpack_keys(unique_keys, mins, extents)
+
+    # unique keys are sorted by feature, so each feature is a contiguous run
+    starts = np.flatnonzero(np.r_[True, feature_codes[1:] != feature_codes[:-1]]) if len(feature_codes) else np.zeros(0, dtype=np.int64)
+    feats = feature_index.cat.categories.to_numpy()[feature_codes[starts]]
+    weights = np.maximum.reduceat(counts, starts) * bytes_per_point if len(starts) else np.zeros(0, dtype=np.int64)
+
+    groups = np.zeros(len(feats), dtype=np.int64)
+    remaining = np.zeros(0, dtype=np.int64)
+    for i in np.argsort(-weights, kind='stable'):
+        fits = np.flatnonzero(remaining >= weights[i])
+        if len(fits):
+            groups[i] = fits[0]
+            remaining[fits[0]] -= weights[i]
+        else:
+            groups[i] = len(remaining)
+            remaining = np.append(remaining, target_chunk_bytes - weights[i])
+
+    return pd.Series(groups, index=feats, dtype="category")
+
+def get_chunk_size_stats(
+        chunk_rows: Annotated[np.ndarray, 'Number of rows in each (grid, group) chunk.'],
+        bytes_per_point: Annotated[int, 'Estimated bytes written per point.'] = 24,
+    ) -> Annotated[dict, 'Distribution of estimated chunk sizes in bytes over non-empty chunks.']:
+    """
+    Summarizes the estimated size distribution of (grid, group) chunks. Useful for tuning grouping.
+    """
+    chunk_rows = np.asarray(chunk_rows, dtype=np.int64)
+    sizes = chunk_rows[chunk_rows > 0] * bytes_per_point
+    stats = {
+        'n_chunks': int(len(sizes)),
+        'n_empty': int((chunk_rows == 0).sum()),
+        'bytes_per_point': bytes_per_point,
+    }
+    if len(sizes):
+        stats.update({
+            'total': int(sizes.sum()),
+            'mean': float(sizes.mean()),
+            'min': int(sizes.min()),
+            'p50': float(np.percentile(sizes, 50)),
+            'p90': float(np.percentile(sizes, 90)),
+            'p99': float(np.percentile(sizes, 99)),
+            'max': int(sizes.max()),
+        })
+    return stats
+
+def get_grid_labels(
+        bin_x: Annotated[np.ndarray, 'Grid x positions.'],
+        bin_y: Annotated[np.ndarray, 'Grid y positions.'],
+        depth: Annotated[Union[np.ndarray, None], 'Quadtree depth of each grid. None means every grid is at depth 0.'] = None,
+    ) -> Annotated[np.ndarray, 'Grid labels formatted as "{x}_{y}" at depth 0 and "{x}_{y}_{depth}" below.']:
+    """
+    Formats grid labels. Should only be called on unique grid positions.
+    """
+    if depth is None:
+        return np.asarray([f"{int(x)}_{int(y)}" for x, y in zip(bin_x, bin_y)], dtype=object)
+    return np.asarray([
+        f"{int(x)}_{int(y)}" if not d else f"{int(x)}_{int(y)}_{int(d)}"
+        for x, y, d in zip(bin_x, bin_y, depth)
+    ], dtype=object)
+
+def get_quadtree_tiles(
+        x_location: Annotated[np.ndarray, 'x location of every row.'],
+        y_location: Annotated[np.ndarray, 'y location of every row.'],
+        grid_size: Annotated[int, 'Size of the top level grid.'],
+        max_points: Annotated[int, 'Tiles with more points than this are split into four children.'],
+        max_depth: Annotated[int, 'Maximum number of times a tile can be split.'] = 8,
+    ) -> Annotated[tuple[np.ndarray, np.ndarray, np.ndarray, list[str]], 'Leaf tile x, y and depth of every row, and labels of the tiles that were split.']:
+    """
+    Density adaptive quadtree tiling. A tile at depth d has size grid_size / 2**d, and its children are
+    (2x + i, 2y + j) at depth d + 1. Tiles are split until they hold at most max_points points or max_depth is reached.
+    Split tiles are labelled "{x}_{y}_{depth}", which only the Python client reads. The viewer still requests "{x}_{y}" grids.
+    """
+    tile_x = (x_location // grid_size).astype(np.int64)
+    tile_y = (y_location // grid_size).astype(np.int64)
+    depth = np.zeros(len(tile_x), dtype=np.int64)
+    split_labels = []
+
+    active = np.arange(len(tile_x))
+    for d in range(max_depth):
+        keys, mins, extents = pack_keys([tile_x[active], tile_y[active]]) if len(active) else (None, None, None)
+        if keys is None:
+            break
+        unique_keys, counts, _ = reduce_by_key(keys, int(np.prod(extents, dtype=object)), {})
+        over = counts > max_points
+        if not over.any():
+            break
+
+        over_x, over_y = unpack_keys(unique_keys[over], mins, extents)
+        split_labels += get_grid_labels(over_x, over_y, np.full(len(over_x), d)).tolist()
+
+        active = active[np.isin(keys, unique_keys[over])]
+        size = grid_size / 2 ** (d + 1)
+        tile_x[active] = (x_location[active] // size).astype(np.int64)
+        tile_y[active] = (y_location[active] // size).astype(np.int64)
+        depth[active] = d + 1
+
+    return tile_x, tile_y, depth, split_labels
+
+def generate_tile_offsets_grouped(
+        x_location: Annotated[np.ndarray, 'x location of every row.'],
+        y_location: Annotated[np.ndarray, 'y location of every row.'],
+        group_codes: Annotated[np.ndarray, 'Non-negative integer group code of every row.'],
+        feature_codes: Annotated[np.ndarray, 'Non-negative integer feature code of every row. Rows are sorted by feature within each (grid, group).'],
+        grid_size: Annotated[int, 'Size of the grid to use when tiling.'] = 256,
+        max_points_per_tile: Annotated[Union[int, None], 'If not None, grids are adaptively split as a quadtree until they hold at most this many points. See get_quadtree_tiles.'] = None,
+        max_depth: Annotated[int, 'Maximum quadtree depth when max_points_per_tile is set.'] = 8,
+    ) -> Annotated[dict[str, np.ndarray], 'Tiling with the following entries. order: stable permutation sorting rows by (grid, group, feature). grid_labels: sorted "{x}_{y}" labels of the occupied grids. grid_codes: index into grid_labels for every row. offsets: dict with grid, group, start, stop arrays, one entry per non-empty (grid, group), giving the slice of the sorted rows that falls in it. tile_tree: labels of split grids and the split parameters if max_points_per_tile is set, otherwise None.']:
+    """
+    Vectorized grouped tiling with packed integer grid keys.
+    Grids are ordered by their string label to match categorical ordering, but labels are only formatted for occupied grids.
+    """
+    if max_points_per_tile is None:
+        key_columns = [(x_location // grid_size).astype(np.int64), (y_location // grid_size).astype(np.int64)]
+        tile_tree = None
+    else:
+        tile_x, tile_y, depth, split_labels = get_quadtree_tiles(
+            x_location, y_location, grid_size, max_points_per_tile, max_depth=max_depth
+        )
+        key_columns = [tile_x, tile_y, depth]
+        tile_tree = {'max_points': int(max_points_per_tile), 'max_depth': int(max_depth), 'split': split_labels}
+    grid_keys, mins, extents = pack_keys(key_columns)
+    key_range = int(np.prod(extents, dtype=object))
+
+    if key_range <= 2 * len(grid_keys) + 1024:
+        # dense grid key space, rank through a lookup table
+        unique_keys = np.flatnonzero(np.bincount(grid_keys, minlength=key_range))
+        grid_codes = np.zeros(key_range, dtype=np.int64)
+        grid_codes[unique_keys] = np.arange(len(unique_keys))
+        grid_codes = grid_codes[grid_keys]
+    else:
+        unique_keys, grid_codes = np.unique(grid_keys, return_inverse=True)
+
+    grid_labels = get_grid_labels(*unpack_keys(unique_keys, mins, extents))
+
+    # re-rank grids by label so ordering matches a categorical of labels
+    label_order = np.argsort(grid_labels, kind='stable')
+    label_rank = np.empty_like(label_order)
+    label_rank[label_order] = np.arange(len(label_order))
+    grid_labels = grid_labels[label_order]
+    grid_codes = label_rank[grid_codes]
+
+    sort_keys, _, sort_extents = pack_keys([grid_codes, group_codes, feature_codes])
+    order = np.argsort(sort_keys, kind='stable')
+
+    # rows per (grid, group), laid out in sorted order
+    n_groups = int(group_codes.max()) + 1 if len(group_codes) else 1
+    cell_keys = grid_codes * n_groups + group_codes
+    cell_counts = np.bincount(cell_keys, minlength=len(grid_labels) * n_groups)
+    stops = np.cumsum(cell_counts)
+    starts = stops - cell_counts
+    occupied = np.flatnonzero(cell_counts)
+
+    offsets = {
+        'grid': occupied // n_groups,
+        'group': occupied % n_groups,
+        'start': starts[occupied],
+        'stop': stops[occupied],
+    }
+
+    return {
+        'order': order,
+        'grid_labels': grid_labels,
+        'grid_codes': grid_codes,
+        'offsets': offsets,
+        'tile_tree': tile_tree,
+    }
+
 def generate_tiled_data_grouped(
         df: Annotated[pd.DataFrame, 'Dataframe to be tiled. Must contain the following columns: feature_index, x_location, y_location. feature_index represents the variable to be grouped on. It should be an integer encoding representing the fields of the target variable. x_location and y_location specify location of the entity described by each row in the dataframe. '],
         n_per_group: Annotated[int, 'The number of fields to include in each group.'] = 100,
         grid_size: Annotated[int, 'Size of the grid to use when tiling.'] = 256,
-    ) -> Annotated[pd.DataFrame, 'Input dataframe with grid and group columns added.']:
+        grouping: Annotated[str, 'How features are assigned to groups. "round_robin" deals count sorted features out to groups. "balanced" bin packs features so each (grid, group) chunk stays under target_chunk_bytes, n_per_group is ignored. Default is "round_robin".'] = 'round_robin',
+        target_chunk_bytes: Annotated[int, 'Target bytes per (grid, group) chunk when grouping is "balanced".'] = 1_000_000,
+        bytes_per_point: Annotated[int, 'Estimated bytes written per point when grouping is "balanced".'] = 24,
+        max_points_per_tile: Annotated[Union[int, None], 'If not None, grids holding more points than this are adaptively split as a quadtree. The split tiles are recorded in df.attrs["tile_tree"]. Not yet read by the viewer.'] = None,
+    ) -> Annotated[pd.DataFrame, 'Rows of df sorted by (grid, group, feature) and indexed by a (grid, group) MultiIndex. df itself is not modified.']:
     """
     Will generate grouped, tiled data for a given Dataframe.
     """
     for col in ['feature_index', 'x_location', 'y_location']:
         assert col in df.columns, f'Required column {col} was not found in df.'
+    assert grouping in ['round_robin', 'balanced'], f'grouping must be "round_robin" or "balanced", got {grouping}'
 
     index_col = 'feature_index'
-    feat_counts = df[index_col].value_counts().sort_values()
-    feats, _ = feat_counts.index.to_numpy(), feat_counts.values
-
-    # Compute group assignments
-    num_feats = len(feats)
-    group_size = num_feats // n_per_group
-    groups = np.arange(num_feats) % group_size  # Vectorized operation
 
     # Map features to groups
-    feat_to_group = pd.Series(groups, index=feats, dtype="category")
-    df["group"] = df[index_col].map(feat_to_group)
+    if grouping == 'balanced':
+        feat_to_group = get_balanced_feature_groups(
+            df[index_col], df["x_location"].to_numpy(), df["y_location"].to_numpy(), grid_size,
+            target_chunk_bytes=target_chunk_bytes, bytes_per_point=bytes_per_point
+        )
+    else:
+        feat_to_group = get_feature_groups(df[index_col], n_per_group=n_per_group)
+    group = pd.Categorical(df[index_col].map(feat_to_group))
+    feature = pd.Categorical(df[index_col])
 
-    # Compute grid location
-    x_bins, _ = divmod(df["x_location"].to_numpy(), grid_size)
-    y_bins, _ = divmod(df["y_location"].to_numpy(), grid_size)
-    df["grid"] = pd.Categorical([f"{int(x)}_{int(y)}" for x, y in zip(x_bins, y_bins)])
+    tiling = generate_tile_offsets_grouped(
+        df["x_location"].to_numpy(),
+        df["y_location"].to_numpy(),
+        group.codes,
+        feature.codes,
+        grid_size=grid_size,
+        max_points_per_tile=max_points_per_tile,
+    )
+    order = tiling['order']
 
-    # Convert categorical columns
-    df["group"] = df["group"].astype("category")
-    df[index_col] = df[index_col].astype("category")
+    # Sort & index by (grid, group), the only copy of df made
+    df = df.take(order)
+    df[index_col] = feature.take(order)
+    grid = pd.Categorical.from_codes(tiling['grid_codes'][order], categories=tiling['grid_labels'])
+    df.index = pd.MultiIndex.from_arrays([grid, group.take(order)], names=["grid", "group"])
+    if tiling['tile_tree'] is not None:
+        df.attrs['tile_tree'] = tiling['tile_tree']
 
-    # Use `MultiIndex` & sort
-    df.set_index(["grid", "group", index_col], inplace=True)
-    df.sort_index(inplace=True)
+    return df
 
-    # Reset index
-    df.reset_index(index_col, inplace=True)
+def get_tile_offsets(
+        df: Annotated[pd.DataFrame, 'Output of generate_tiled_data_grouped.'],
+    ) -> Annotated[dict[str, np.ndarray], 'grid, group, start and stop arrays with one entry per non-empty (grid, group) pair, in the order df is sorted in. Rows start:stop of df fall in that tile.']:
+    """
+    Offsets of every non-empty (grid, group) tile in a tiled dataframe. Combinations of grid and group with no rows are left out,
+    a grid does not have to hold every group.
+    """
+    grids, groups = df.index.levels
+    grid_codes, group_codes = df.index.codes
+    n_groups = len(groups)
+    counts = np.bincount(
+        np.asarray(grid_codes, dtype=np.int64) * n_groups + np.asarray(group_codes, dtype=np.int64),
+        minlength=len(grids) * n_groups
+    )
+    stops = np.cumsum(counts)
+    occupied = np.flatnonzero(counts)
+    return {
+        'grid': grids.to_numpy(dtype=object)[occupied // n_groups],
+        'group': groups.to_numpy()[occupied % n_groups],
+        'start': (stops - counts)[occupied],
+        'stop': stops[occupied],
+    }
 
-    return df
+def get_polygon_tiles(
+        vertices: Annotated[np.ndarray, 'Flat polygon vertex buffer with shape (n_vertices, 2).'],
+        vertex_offsets: Annotated[np.ndarray, 'Polygon i is vertices[vertex_offsets[i]:vertex_offsets[i + 1]]. Every polygon must have at least one vertex.'],
+        grid_size: Annotated[int, 'Size of each grid tile.'],
+    ) -> Annotated[dict[str, np.ndarray], 'labels: "{x}_{y}" label of every tile. polygons: polygon indices sorted by tile. start, stop: slice of polygons belonging to each tile.']:
+    """
+    Assigns every polygon to each grid tile that contains at least one of its vertices. Vertices in negative tiles are ignored.
+
+    Polygons whose vertices all fall in one tile are assigned from their bounding box, only polygons spanning tiles are resolved per vertex.
+    Tiles are ordered by the first polygon they contain, then by label, and polygons keep their order within a tile.
+    """
+    n_polygons = len(vertex_offsets) - 1
+    polygon = np.repeat(np.arange(n_polygons), np.diff(vertex_offsets))
+    bin_x = (vertices[:, 0] // grid_size).astype(np.int64)
+    bin_y = (vertices[:, 1] // grid_size).astype(np.int64)
+    valid = (bin_x >= 0) & (bin_y >= 0)
+    if not valid.any():
+        empty = np.zeros(0, dtype=np.int64)
+        return {'labels': np.asarray([], dtype=object), 'polygons': empty, 'start': empty, 'stop': empty}
+
+    big = np.iinfo(np.int64).max
+    starts = vertex_offsets[:-1]
+    min_x, max_x = np.minimum.reduceat(np.where(valid, bin_x, big), starts), np.maximum.reduceat(np.where(valid, bin_x, -1), starts)
+    min_y, max_y = np.minimum.reduceat(np.where(valid, bin_y, big), starts), np.maximum.reduceat(np.where(valid, bin_y, -1), starts)
+    has_valid = max_x >= 0
+    single = has_valid & (min_x == max_x) & (min_y == max_y)
+    span_vertices = valid & (has_valid & ~single)[polygon]
+
+    polygons = np.concatenate([np.flatnonzero(single), polygon[span_vertices]])
+    tile_x = np.concatenate([min_x[single], bin_x[span_vertices]])
+    tile_y = np.concatenate([min_y[single], bin_y[span_vertices]])
+
+    # unique (polygon, tile) pairs, sorted by polygon
+    keys, mins, extents = pack_keys([tile_x, tile_y])
+    n_keys = int(np.prod(extents, dtype=object))
+    assert n_polygons * n_keys < np.iinfo(np.int64).max, 'Too many polygons and tiles to pack into int64.'
+    polygons, keys = np.divmod(np.unique(polygons * n_keys + keys), n_keys)
+
+    unique_keys, tile_codes = np.unique(keys, return_inverse=True)
+    labels = get_grid_labels(*unpack_keys(unique_keys, mins, extents))
+    _, first_idx = np.unique(tile_codes, return_index=True)
+    label_rank = np.empty(len(labels), dtype=np.int64)
+    label_rank[np.argsort(labels, kind='stable')] = np.arange(len(labels))
+    tile_order = np.lexsort((label_rank, polygons[first_idx]))
+    tile_rank = np.empty_like(tile_order)
+    tile_rank[tile_order] = np.arange(len(tile_order))
+    tile_codes = tile_rank[tile_codes]
+
+    order = np.argsort(tile_codes, kind='stable')
+    stops = np.cumsum(np.bincount(tile_codes, minlength=len(labels)))
+    return {
+        'labels': labels[tile_order],
+        'polygons': polygons[order],
+        'start': np.concatenate([[0], stops[:-1]]),
+        'stop': stops,
+    }
+
+def sample_tiles_stratified(
+        tiles: Annotated[dict[str, np.ndarray], 'Tiles to sample from. From cosilico_py.preprocessing.core.tiling.get_polygon_tiles.'],
+        points: Annotated[np.ndarray, 'Representative (x, y) location of every object, e.g. polygon centroids. Has shape (n_objects, 2).'],
+        grid_size: Annotated[int, 'Size of each grid tile.'],
+        budget: Annotated[int, 'Maximum number of objects kept in each tile.'],
+        priority: Annotated[np.ndarray, 'Priority of every object, lower is kept first. Should be a permutation so ties are impossible.'],
+    ) -> Annotated[dict[str, np.ndarray], 'Tiles in the same form as the input with at most budget objects each.']:
+    """
+    Caps every tile at budget objects, sampled so they stay spread across the tile.
+
+    Each tile is split into ceil(sqrt(budget)) x ceil(sqrt(budget)) strata by object location, clipped to the tile for objects that span tiles.
+    Objects are taken round robin over the strata in priority order, so sparse regions keep their objects and dense regions are thinned.
+    Objects keep their order within a tile and tiles keep their order.
+    """
+    counts = tiles['stop'] - tiles['start']
+    if not len(counts) or counts.max() <= budget:
+        return tiles
+
+    n_strata = int(np.ceil(np.sqrt(budget)))
+    origins = np.asarray([label.split('_')[:2] for label in tiles['labels']], dtype=np.int64) * grid_size
+    tile = np.repeat(np.arange(len(counts)), counts)
+    objs = tiles['polygons']
+    local = (points[objs] - origins[tile]) / grid_size
+    cells = np.clip((local * n_strata).astype(np.int64), 0, n_strata - 1)
+    stratum = cells[:, 0] * n_strata + cells[:, 1]
+
+    # rank of every object within its (tile, stratum) by priority, objects are then taken in rounds of rank
+    order = np.lexsort((priority[objs], stratum, tile))
+    group = tile[order] * n_strata ** 2 + stratum[order]
+    group_start = np.flatnonzero(np.concatenate([[True], group[1:] != group[:-1]]))
+    rank = np.empty(len(objs), dtype=np.int64)
+    rank[order] = np.arange(len(objs)) - np.repeat(group_start, np.diff(np.append(group_start, len(objs))))
+
+    order = np.lexsort((priority[objs], rank, tile))
+    position = np.empty(len(objs), dtype=np.int64)
+    position[order] = np.arange(len(objs)) - np.repeat(tiles['start'], counts)
+    keep = position < budget
+
+    stops = np.cumsum(np.minimum(counts, budget))
+    return {
+        'labels': tiles['labels'],
+        'polygons': objs[keep],
+        'start': np.concatenate([[0], stops[:-1]]),
+        'stop': stops,
+    }
+
+def pack_keys(columns):
+    """
+    Linearizes integer key columns into a single int64 key.
+    Packed keys sort in the same order as the key columns sorted lexicographically.
+    """
+    keys = np.zeros(len(columns[0]), dtype=np.int64)
+    mins, extents = [], []
+    int64 = np.iinfo(np.int64)
+    for col in columns:
+        lo, hi = (int(col.min()), int(col.max())) if len(col) else (0, 0)
+        assert int64.min <= lo and hi <= int64.max, f'Key column values must fit in int64, got range [{lo}, {hi}].'
+        # unsigned columns (e.g. uint64 feature indices) can't be added to int64 keys in place
+        col = np.asarray(col).astype(np.int64, copy=False)
+        extent = hi - lo + 1
+        keys *= extent
+        keys += col
+        keys -= lo
+        mins.append(lo)
+        extents.append(extent)
+
+    assert np.prod(extents, dtype=object) < int64.max, 'Key space is too large to pack into int64.'
+    return keys, mins, extents
+
+def unpack_keys(keys, mins, extents):
+    """
+    Inverse of pack_keys.
+    """
+    columns = []
+    for lo, extent in zip(reversed(mins), reversed(extents)):
+        keys, col = np.divmod(keys, extent)
+        columns.append(col + lo)
+    return columns[::-1]
+
+def reduce_by_key(keys, key_range, weights, counts=None):
+    """
+    Sums weights over identical keys with bincount kernels.
+    If counts is None every row counts as one. Returns sorted unique keys, counts and summed weights.
+    """
+    if key_range <= 2 * len(keys) + 1024:
+        # dense key space, bincount directly on the packed keys
+        bin_idx, num_bins = keys, key_range
+    else:
+        # sparse key space, compact keys with a 1-D sort first
+        unique_keys, bin_idx = np.unique(keys, return_inverse=True)
+        num_bins = len(unique_keys)
+
+    if counts is None:
+        summed_counts = np.bincount(bin_idx, minlength=num_bins)
+    else:
+        summed_counts = np.bincount(bin_idx, weights=counts, minlength=num_bins).astype(np.int64)
+    sums = {k: np.bincount(bin_idx, weights=w, minlength=num_bins) for k, w in weights.items()}
+
+    if bin_idx is keys:
+        unique_keys = np.flatnonzero(summed_counts)
+        summed_counts = summed_counts[unique_keys]
+        sums = {k: v[unique_keys] for k, v in sums.items()}
+
+    return unique_keys, summed_counts, sums
+
+def aggregate_bins(
+        bin_keys: Annotated[list[np.ndarray], 'Integer key columns, e.g. [feature_index, bin_x, bin_y].'],
+        key_names: Annotated[list[str], 'Names of the key columns.'],
+        values: Annotated[dict[str, np.ndarray], 'Columns to sum within each bin.'],
+        counts: Annotated[Union[np.ndarray, None], 'Per row counts. If None, each row counts as one.'] = None,
+    ) -> Annotated[dict[str, np.ndarray], 'Partial aggregate with key columns, count, and summed value columns. Sorted by key columns.']:
+    """
+    Sums values and counts rows for each unique key by linearizing the key columns into a packed integer key.
+    Partials returned by this function can be combined with combine_partials.
+    """
+    keys, mins, extents = pack_keys(bin_keys)
+    key_range = int(np.prod(extents, dtype=object))
+    unique_keys, summed_counts, sums = reduce_by_key(keys, key_range, values, counts=counts)
+
+    partial = {
+        name: col.astype(bin_keys[i].dtype, copy=False)
+        for i, (name, col) in enumerate(zip(key_names, unpack_keys(unique_keys, mins, extents)))
+    }
+    partial['count'] = summed_counts
+    partial.update(sums)
+    return partial
+
+def combine_partials(
+        partials: Annotated[Iterable[dict[str, np.ndarray]], 'Partials generated by aggregate_bins.'],
+        key_names: Annotated[list[str], 'Names of the key columns.'],
+    ) -> Annotated[dict[str, np.ndarray], 'Combined partial.']:
+    """
+    Merges partial aggregates, summing counts and values of matching keys.
+    """
+    partials = list(partials)
+    assert len(partials), 'Must provide at least one partial.'
+    columns = {k: np.concatenate([p[k] for p in partials]) for k in partials[0].keys()}
+    bin_keys = [columns.pop(k) for k in key_names]
+    counts = columns.pop('count')
+    return aggregate_bins(bin_keys, key_names, columns, counts=counts)
+
+def partial_to_centroids_df(
+        partial: Annotated[dict[str, np.ndarray], 'Partial generated by aggregate_bins or combine_partials.'],
+        group_by_index: Annotated[bool, 'Whether partial is grouped by index.'] = True,
+        target_columns: Annotated[Iterable[str], 'Additional columns to compute means over.'] = None,
+        index_col: Annotated[str, 'Name of the index column.'] = 'feature_index',
+        result_col: Annotated[str, 'Name of the count column.'] = 'count',
+    ) -> Annotated[pd.DataFrame, 'Centroid dataframe, same layout as compute_grid_centroids_multi output.']:
+    """
+    Converts summed partials into a centroid dataframe of means.
+    """
+    counts = partial['count']
+    key_cols = [index_col, 'bin_x', 'bin_y'] if group_by_index else ['bin_x', 'bin_y']
+    key_dtype = np.result_type(*[partial[c].dtype for c in key_cols])
+
+    data = {c: partial[c].astype(key_dtype, copy=False) for c in key_cols}
+    data['x_location'] = partial['x_location'] / counts
+    data['y_location'] = partial['y_location'] / counts
+    data[result_col] = counts.astype(np.int32)
+    if target_columns:
+        for col in target_columns:
+            data[col] = partial[col] / counts
+
+    return pd.DataFrame(data)
+
+def coarsen_partial(
+        partial: Annotated[dict[str, np.ndarray], 'Partial generated by aggregate_bins or combine_partials.'],
+        factor: Annotated[int, 'Integer ratio between the coarse and fine bin sizes.'],
+        key_names: Annotated[list[str], 'Names of the key columns.'],
+    ) -> Annotated[dict[str, np.ndarray], 'Partial for the coarser bin size.']:
+    """
+    Reduces a partial to a bin size that is an integer multiple of its own.
+    floor(floor(x / b) / k) == floor(x / (b * k)), so bin assignments match binning the raw points directly.
+    """
+    bin_keys = [partial[k] // factor if k in ('bin_x', 'bin_y') else partial[k] for k in key_names]
+    values = {k: v for k, v in partial.items() if k not in key_names and k != 'count'}
+    return aggregate_bins(bin_keys, key_names, values, counts=partial['count'])
+
+def get_pyramid_plan(
+        bin_sizes: Annotated[Iterable[int], 'Bin sizes to generate centroids for.'],
+    ) -> Annotated[dict[int, Union[int, None]], 'Maps each bin size to the finer bin size it is derived from. None means it is computed from the raw points.']:
+    """
+    Plans bottom-up derivation of bin sizes. Each bin size is derived from the coarsest finer bin size that evenly divides it.
+    """
+    plan = {}
+    for bin_size in sorted(set(bin_sizes)):
+        parents = [b for b in plan if bin_size % b == 0]
+        plan[bin_size] = max(parents) if parents else None
+    return plan
+
+def get_batch_column(batch, col, dtype=None):
+    """
+    Gets a column from a pandas DataFrame, pyarrow RecordBatch/Table, or dict of arrays as a numpy array.
+    """
+    if isinstance(batch, pd.DataFrame):
+        return batch[col].to_numpy(dtype=dtype)
+
+    values = batch[col]
+    if not isinstance(values, np.ndarray) and hasattr(values, 'to_numpy'):
+        values = values.to_numpy(zero_copy_only=False)
+    return np.asarray(values, dtype=dtype)
+
+def empty_partial(key_names, target_columns):
+    """
+    Partial with no bins.
+    """
+    partial = {k: np.zeros(0, dtype=np.int32) for k in key_names}
+    partial['count'] = np.zeros(0, dtype=np.int64)
+    for col in ['x_location', 'y_location'] + list(target_columns):
+        partial[col] = np.zeros(0, dtype=np.float64)
+    return partial
+
+
+class GridCentroidAccumulator(object):
+    """
+    Incrementally computes grid centroids.
+    Holds partial sums (sum_x, sum_y, count, target sums) keyed by bin for each bin size. Batches are folded in with update,
+    accumulators built from other batches or processes are folded in with merge, and finalize returns the same
+    centroid dataframes as compute_grid_centroids_multi.
+    """
+    def __init__(
+            self,
+            bin_sizes: Annotated[Iterable[int], 'Bin sizes to generate centroid dataframes for.'],
+            target_columns: Annotated[Iterable[str], 'Additional columns to compute means over.'] = None,
+            group_by_index: Annotated[bool, 'Whether to group by index. Default is True.'] = True,
+            pyramid: Annotated[bool, 'Whether to derive coarser bin sizes from finer ones at finalize. Default is False.'] = False,
+        ):
+        self.bin_sizes = list(bin_sizes)
+        self.target_columns = list(target_columns) if target_columns else []
+        self.group_by_index = group_by_index
+        self.index_col = 'feature_index'
+        self.key_names = [self.index_col, 'bin_x', 'bin_y'] if group_by_index else ['bin_x', 'bin_y']
+        self.plan = get_pyramid_plan(self.bin_sizes) if pyramid else {bin_size: None for bin_size in self.bin_sizes}
+        self.partials = {bin_size: None for bin_size in self.raw_bin_sizes}
+        self.n_rows = 0
+
+    @property
+    def raw_bin_sizes(self) -> list[int]:
+        """Bin sizes that are computed from the raw points."""
+        return [bin_size for bin_size, parent in self.plan.items() if parent is None]
+
+    def aggregate(
+            self,
+            batch: Annotated[object, 'Batch of points. Can be a pandas DataFrame, pyarrow RecordBatch or Table, or dict of numpy arrays. Must have x_location, y_location, feature_index (if grouping by index), and target_columns.'],
+        ) -> Annotated[dict[int, dict[str, np.ndarray]], 'Maps raw bin sizes to the partial of batch.']:
+        """
+        Reduces a batch to partials without updating the accumulator.
+        """
+        x_coords = get_batch_column(batch, 'x_location')
+        y_coords = get_batch_column(batch, 'y_location')
+        values = {'x_location': x_coords, 'y_location': y_coords}
+        for col in self.target_columns:
+            values[col] = get_batch_column(batch, col, dtype=np.float64)
+        feature_indices = get_batch_column(batch, self.index_col) if self.group_by_index else None
+
+        partials = {}
+        for bin_size in self.raw_bin_sizes:
+            bin_keys = [(x_coords // bin_size).astype(np.int32), (y_coords // bin_size).astype(np.int32)]
+            if self.group_by_index:
+                bin_keys.insert(0, feature_indices)
+            partials[bin_size] = aggregate_bins(bin_keys, self.key_names, values)
+        return partials
+
+    def update_partials(
+            self,
+            partials: Annotated[dict[int, dict[str, np.ndarray]], 'Maps raw bin sizes to partials, e.g. from aggregate.'],
+            n_rows: Annotated[int, 'Number of points the partials were computed from.'] = 0,
+        ) -> 'GridCentroidAccumulator':
+        """
+        Sums partials into the accumulator.
+        """
+        for bin_size, partial in partials.items():
+            self.update_partial_batch(bin_size, [partial])
+        self.n_rows += n_rows
+        return self
+
+    def update_partial_batch(
+            self,
+            bin_size: Annotated[int, 'Raw bin size the partials were computed for.'],
+            partials: Annotated[list[dict[str, np.ndarray]], 'Partials to sum in.'],
+            n_rows: Annotated[int, 'Number of points the partials were computed from.'] = 0,
+        ) -> 'GridCentroidAccumulator':
+        """
+        Sums a batch of partials for one bin size into the accumulator with a single reduction,
+        instead of re-reducing the accumulated partial once per partial.
+        """
+        assert bin_size in self.partials, f'Bin size {bin_size} is not computed from raw points by this accumulator.'
+        if not partials:
+            return self
+        current = self.partials[bin_size]
+        if current is not None:
+            partials = [current] + list(partials)
+        self.partials[bin_size] = partials[0] if len(partials) == 1 else combine_partials(partials, self.key_names)
+        self.n_rows += n_rows
+        return self
+
+    def update(
+            self,
+            batch: Annotated[object, 'Batch of points. Can be a pandas DataFrame, pyarrow RecordBatch or Table, or dict of numpy arrays.'],
+        ) -> 'GridCentroidAccumulator':
+        """
+        Folds a batch of points into the accumulator.
+        """
+        n_rows = len(get_batch_column(batch, 'x_location'))
+        if not n_rows:
+            return self
+        return self.update_partials(self.aggregate(batch), n_rows=n_rows)
+
+    def merge(
+            self,
+            other: Annotated['GridCentroidAccumulator', 'Accumulator with the same bin sizes, target columns and grouping.'],
+        ) -> 'GridCentroidAccumulator':
+        """
+        Folds the partial sums of another accumulator into this one.
+        """
+        assert self.plan == other.plan, 'Accumulators must have the same bin sizes and pyramid setting.'
+        assert self.target_columns == other.target_columns, 'Accumulators must have the same target columns.'
+        assert self.group_by_index == other.group_by_index, 'Accumulators must have the same group_by_index setting.'
+        partials = {k: v for k, v in other.partials.items() if v is not None}
+        return self.update_partials(partials, n_rows=other.n_rows)
+
+    def finalize(self) -> Annotated[dict[int, pd.DataFrame], 'Dictionary mapping bin size to its respective centroid dataframe. Same layout as compute_grid_centroids_multi.']:
+        """
+        Computes centroid dataframes from the accumulated partials. The accumulator can keep being updated afterwards.
+        """
+        partials = {
+            bin_size: partial if partial is not None else empty_partial(self.key_names, self.target_columns)
+            for bin_size, partial in self.partials.items()
+        }
+        # plan is ordered from fine to coarse, so parents are always computed first
+        for bin_size, parent in self.plan.items():
+            if parent is not None:
+                partials[bin_size] = coarsen_partial(partials[parent], bin_size // parent, self.key_names)
+
+        return {
+            bin_size: partial_to_centroids_df(
+                partials[bin_size], group_by_index=self.group_by_index, target_columns=self.target_columns
+            )
+            for bin_size in self.bin_sizes
+        }
+
+
+def share_columns(
+        df: Annotated[pd.DataFrame, 'Dataframe holding the columns to share.'],
+        columns: Annotated[Iterable[str], 'Columns to place in shared memory.'],
+    ) -> Annotated[tuple[list[shared_memory.SharedMemory], dict[str, tuple[str, str, int]]], 'Shared memory blocks and a spec mapping column to (block name, dtype, length).']:
+    """
+    Copies columns of df into shared memory so worker processes can attach to them without pickling.
+    Blocks must be closed and unlinked by the caller.
+    """
+    blocks, specs = [], {}
+    for col in columns:
+        values = df[col].to_numpy()
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+        blocks.append(shm)
+        specs[col] = (shm.name, values.dtype.str, len(values))
+    return blocks, specs
+
+def aggregate_shared_chunk(specs, start, stop, bin_size, target_columns, group_by_index):
+    """
+    Worker task for compute_grid_centroids_bincount. Aggregates rows [start, stop) of the shared columns at one bin size.
+    """
+    blocks, batch = [], {}
+    for col, (name, dtype, length) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        batch[col] = np.ndarray((length,), dtype=dtype, buffer=shm.buf)[start:stop]
+
+    accumulator = GridCentroidAccumulator([bin_size], target_columns=target_columns, group_by_index=group_by_index)
+    partial = accumulator.aggregate(batch)[bin_size]
+
+    del batch
+    for shm in blocks:
+        shm.close()
+    return bin_size, stop - start, partial
+
+def hash_partition(
+        bin_keys: Annotated[list[np.ndarray], 'Integer key columns.'],
+        n_partitions: Annotated[int, 'Number of partitions.'],
+    ) -> Annotated[np.ndarray, 'Partition of every row.']:
+    """
+    Hash partitions rows on their key columns. Identical keys always land in the same partition.
+    """
+    h = np.zeros(len(bin_keys[0]), dtype=np.uint64)
+    for col in bin_keys:
+        h ^= col.astype(np.int64).view(np.uint64)
+        h *= np.uint64(0x9E3779B97F4A7C15)
+        h ^= h >> np.uint64(29)
+    return (h % np.uint64(n_partitions)).astype(np.int64)
+
+def sort_partial(partial, key_names):
+    """
+    Sorts a partial by its key columns.
+    """
+    keys, _, _ = pack_keys([partial[k] for k in key_names])
+    order = np.argsort(keys, kind='stable')
+    return {k: v[order] for k, v in partial.items()}
+
+
+class PartitionedSpill(object):
+    """
+    Out of core store for partials.
+    Partials are hash partitioned by bin key into memory mapped .npy files, one set of files per (partition, write).
+    Each partition can then be reduced on its own, so merge memory is bounded by a single partition instead of the whole spill.
+    """
+    def __init__(
+            self,
+            key_names: Annotated[list[str], 'Names of the key columns.'],
+            n_partitions: Annotated[int, 'Number of hash partitions.'] = 16,
+            memory_budget: Annotated[int, 'Approximate number of bytes of spilled partials to load at once when reducing a partition.'] = 1_000_000_000,
+            directory: Annotated[Union[os.PathLike, None], 'Directory to spill into. A temporary directory is created if None.'] = None,
+        ):
+        self.key_names = key_names
+        self.n_partitions = max(1, int(n_partitions))
+        self.memory_budget = memory_budget
+        self.directory = tempfile.mkdtemp(dir=directory)
+        self.files = [[] for _ in range(self.n_partitions)]
+        self.n_writes = 0
+
+    def write(
+            self,
+            partial: Annotated[dict[str, np.ndarray], 'Partial to spill.'],
+        ) -> None:
+        """
+        Spills a partial, split across partitions.
+        """
+        partition = hash_partition([partial[k] for k in self.key_names], self.n_partitions)
+        order = np.argsort(partition, kind='stable')
+        bounds = np.searchsorted(partition[order], np.arange(self.n_partitions + 1))
+
+        for p in range(self.n_partitions):
+            start, stop = bounds[p], bounds[p + 1]
+            if start == stop:
+                continue
+            rows = order[start:stop]
+            paths = {}
+            for col, values in partial.items():
+                path = os.path.join(self.directory, f'part_{p}_write_{self.n_writes}_{col}.npy')
+                np.save(path, values[rows])
+                paths[col] = path
+            self.files[p].append((stop - start, paths))
+        self.n_writes += 1
+
+    def reduce_partition(
+            self,
+            p: Annotated[int, 'Partition to reduce.'],
+        ) -> Annotated[Union[dict[str, np.ndarray], None], 'Combined partial for the partition, None if it is empty.']:
+        """
+        Combines all partials spilled to a partition, loading at most memory_budget bytes of spilled rows at a time.
+        """
+        reduced = None
+        batch, batch_bytes = [], 0
+        for i, (n_rows, paths) in enumerate(self.files[p]):
+            partial = {col: np.load(path, mmap_mode='r') for col, path in paths.items()}
+            batch.append(partial)
+            batch_bytes += sum(v.nbytes for v in partial.values())
+
+            if batch_bytes >= self.memory_budget or i == len(self.files[p]) - 1:
+                if reduced is not None:
+                    batch.append(reduced)
+                reduced = combine_partials(batch, self.key_names)
+                batch, batch_bytes = [], 0
+        return reduced
+
+    def reduce(self) -> Annotated[Union[dict[str, np.ndarray], None], 'Combined partial over all partitions sorted by key, None if nothing was spilled.']:
+        """
+        Reduces every partition independently and concatenates the results.
+        """
+        reduced = [self.reduce_partition(p) for p in range(self.n_partitions)]
+        reduced = [r for r in reduced if r is not None]
+        if not reduced:
+            return None
+        # partitions hold disjoint keys, so concatenating and sorting is enough
+        partial = {k: np.concatenate([r[k] for r in reduced]) for k in reduced[0].keys()}
+        return sort_partial(partial, self.key_names)
+
+    def cleanup(self) -> None:
+        """
+        Removes the spill directory.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.files = [[] for _ in range(self.n_partitions)]
+
+
+def compute_grid_centroids_bincount(
+        df: Annotated[pd.DataFrame, 'Dataframe to compute centroids for. Each row represents an object in 2D space. Must have the following columns: feature_index, x_location, y_location.'],
+        bin_sizes: Annotated[Iterable[int], 'Bin sizes to generate centroid dataframes for.'],
+        chunk_size: Annotated[int, 'Chunk size to use when batch processing.'] = 10_000_000,
+        use_disk: Annotated[bool, 'Whether to spill batch partials to hash partitioned files on disk to bound memory usage. Default is False'] = True,
+        target_columns: Annotated[Iterable[str], 'Additional columns to compute means over.'] = None,
+        group_by_index: Annotated[bool, 'Whether to group by index. Default is True.'] = True,
+        pyramid: Annotated[bool, 'Whether to derive coarser bin sizes from finer ones instead of from the raw points. Default is False.'] = False,
+        n_workers: Annotated[int, 'Number of worker processes. If greater than 1, columns are placed in shared memory and chunk x bin size tasks run in a process pool. use_disk is ignored in that case. Default is 1.'] = 1,
+        memory_budget: Annotated[int, 'Approximate bytes of spilled partials to hold in memory at once when use_disk is True. Default is 1GB.'] = 1_000_000_000,
+    ) -> Annotated[dict[str, pd.DataFrame], 'Dictionary mapping bin size to its respective centroid dataframe. Same layout as compute_grid_centroids_multi.']:
+    """
+    Bincount engine for compute_grid_centroids_multi.
+    Each chunk is reduced to partial sums keyed by bin, partials are summed across chunks and divided once at the end.
+    """
+    accumulator = GridCentroidAccumulator(
+        bin_sizes, target_columns=target_columns, group_by_index=group_by_index, pyramid=pyramid
+    )
+
+    if n_workers > 1:
+        columns = ['x_location', 'y_location'] + list(accumulator.target_columns)
+        if group_by_index:
+            columns.append(accumulator.index_col)
+        # make sure every worker gets at least one chunk
+        chunk_size = max(1, min(chunk_size, -(-len(df) // n_workers)))
+
+        # partials are folded in batches, so the accumulated partial is not re-reduced for every finished chunk
+        batch_size = 4 * n_workers
+        pending = {bin_size: [] for bin_size in accumulator.raw_bin_sizes}
+        blocks, specs = share_columns(df, columns)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [
+                    executor.submit(
+                        aggregate_shared_chunk, specs, chunk_start, min(chunk_start + chunk_size, len(df)),
+                        bin_size, accumulator.target_columns, group_by_index
+                    )
+                    for chunk_start in range(0, len(df), chunk_size)
+                    for bin_size in accumulator.raw_bin_sizes
+                ]
+                for future in as_completed(futures):
+                    bin_size, n_rows, partial = future.result()
+                    # rows are only counted once per chunk
+                    accumulator.n_rows += n_rows if bin_size == accumulator.raw_bin_sizes[0] else 0
+                    pending[bin_size].append(partial)
+                    if len(pending[bin_size]) >= batch_size:
+                        accumulator.update_partial_batch(bin_size, pending[bin_size])
+                        pending[bin_size] = []
+                for bin_size, partials in pending.items():
+                    accumulator.update_partial_batch(bin_size, partials)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+        return accumulator.finalize()
+
+    if not use_disk:
+        for chunk_start in range(0, len(df), chunk_size):
+            accumulator.update(df.iloc[chunk_start:chunk_start + chunk_size])
+        return accumulator.finalize()
+
+    # upper bound on spilled bytes assumes every row lands in its own bin
+    row_bytes = 8 * (len(accumulator.key_names) + 3 + len(accumulator.target_columns))
+    n_partitions = -(-len(df) * row_bytes // memory_budget)
+    spills = {
+        bin_size: PartitionedSpill(accumulator.key_names, n_partitions=n_partitions, memory_budget=memory_budget)
+        for bin_size in accumulator.raw_bin_sizes
+    }
+    try:
+        for chunk_start in range(0, len(df), chunk_size):
+            for bin_size, partial in accumulator.aggregate(df.iloc[chunk_start:chunk_start + chunk_size]).items():
+                spills[bin_size].write(partial)
+
+        for bin_size, spill in spills.items():
+            partial = spill.reduce()
+            if partial is not None:
+                accumulator.update_partials({bin_size: partial})
+    finally:
+        for spill in spills.values():
+            spill.cleanup()
+    accumulator.n_rows = len(df)
+
+    return accumulator.finalize()
 
 def compute_grid_centroids_multi(
         df: Annotated[pd.DataFrame, 'Dataframe to compute centroids for. Each row represents an object in 2D space. Must have the following columns: feature_index, x_location, y_location.'],
@@ -55,16 +919,34 @@ def compute_grid_centroids_multi(
         chunk_size: Annotated[int, 'Chunk size to use when batch processing.'] = 10_000_000,
         use_disk: Annotated[bool, 'Whether to write batch files to disk to decrease memory usage. Default is False'] = True,
         target_columns: Annotated[Iterable[str], 'Additional columns to compute means over.'] = None,
-        group_by_index: Annotated[bool, 'Whether to group by index. Default is True.'] = True
+        group_by_index: Annotated[bool, 'Whether to group by index. Default is True.'] = True,
+        engine: Annotated[str, 'Aggregation engine. "bincount" packs (feature_index, bin_x, bin_y) into integer keys and reduces with bincount kernels. "unique" uses row-wise np.unique and np.add.at. Default is "bincount".'] = 'bincount',
+        pyramid: Annotated[bool, 'Only applies to the bincount engine. If True, bin sizes that are integer multiples of a finer bin size are reduced from that finer level instead of the raw points, so only the finest levels scan df. Default is False.'] = False,
+        n_workers: Annotated[int, 'Only applies to the bincount engine. Number of worker processes to aggregate chunks with. Default is 1.'] = 1,
+        memory_budget: Annotated[int, 'Only applies to the bincount engine with use_disk. Spilled partials are hash partitioned by bin so that reducing a partition holds roughly this many bytes. Default is 1GB.'] = 1_000_000_000,
     ) -> Annotated[dict[str, pd.DataFrame], 'Dictionary mapping bin size to its respective centroid dataframe. A centroid dataframe has x_location (centroid x), y_location (centroid y), bin_x (grid x position), bin_y (grid y position), and mean columns for target_columns if there were any present.']:
     """
     Compute centroids or mean of target values by binning data into fixed grid squares.
+
+    The bincount engine carries sums and counts across chunks, so centroids are exact when df spans multiple chunks.
+    The unique engine averages the per chunk means instead.
     """
+    assert engine in ['bincount', 'unique'], f'engine must be "bincount" or "unique", got {engine}'
+    assert not (pyramid and engine == 'unique'), 'pyramid is only supported by the bincount engine.'
+    assert not (n_workers > 1 and engine == 'unique'), 'n_workers is only supported by the bincount engine.'
+
     # may move these to function arguments, havent decided yet
     file_format="parquet"
     result_col='count'
     index_col='feature_index'
 
+    if engine == 'bincount':
+        return compute_grid_centroids_bincount(
+            df, bin_sizes, chunk_size=chunk_size, use_disk=use_disk,
+            target_columns=target_columns, group_by_index=group_by_index, pyramid=pyramid,
+            n_workers=n_workers, memory_budget=memory_budget
+        )
+
     temp_dirs = {bin_size: tempfile.mkdtemp() for bin_size in bin_sizes} if use_disk else {}
     chunk_files = {bin_size: [] for bin_size in bin_sizes} if use_disk else {}
     final_results = {bin_size: [] for bin_size in bin_sizes}
@@ -1,5 +1,71 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from numcodecs import Blosc, Delta
 import zarr
 
+CONSOLIDATED_KEY = '.zmetadata'
+
+def get_blosc(cname, clevel, shuffle):
+    return {'compressor': Blosc(cname=cname, clevel=clevel, shuffle=shuffle)}
+
+# Compression settings for each kind of dataset the writers create, as create_dataset kwargs.
+# Kinds are location, vertices, vertex_offsets, points (packed records), values (metadata), feature_index, id, id_idxs,
+# strings (VLenUTF8 datasets) and image, with image/{i} overriding image for the i-th resolution.
+# Kinds missing from a policy use zarr defaults (Blosc lz4, byte shuffle).
+# Everything except zstd_delta can be decoded by the viewer, Delta is not supported by zarrita.
+CODEC_POLICIES = {
+    'default': {},
+    'lz4': {
+        'location': get_blosc('lz4', 5, Blosc.SHUFFLE),
+        'vertices': get_blosc('lz4', 5, Blosc.SHUFFLE),
+        'points': get_blosc('lz4', 5, Blosc.SHUFFLE),
+        'values': get_blosc('lz4', 5, Blosc.SHUFFLE),
+        'feature_index': get_blosc('lz4', 5, Blosc.BITSHUFFLE),
+        'id': get_blosc('lz4', 5, Blosc.BITSHUFFLE),
+        'id_idxs': get_blosc('lz4', 5, Blosc.BITSHUFFLE),
+        'vertex_offsets': get_blosc('lz4', 5, Blosc.BITSHUFFLE),
+        'strings': get_blosc('lz4', 5, Blosc.NOSHUFFLE),
+        'image': get_blosc('lz4', 5, Blosc.BITSHUFFLE),
+    },
+    'zstd': {
+        'location': get_blosc('zstd', 5, Blosc.SHUFFLE),
+        'vertices': get_blosc('zstd', 5, Blosc.SHUFFLE),
+        'points': get_blosc('zstd', 5, Blosc.SHUFFLE),
+        'values': get_blosc('zstd', 5, Blosc.SHUFFLE),
+        'feature_index': get_blosc('zstd', 5, Blosc.BITSHUFFLE),
+        'id': get_blosc('zstd', 5, Blosc.BITSHUFFLE),
+        'id_idxs': get_blosc('zstd', 5, Blosc.BITSHUFFLE),
+        'vertex_offsets': get_blosc('zstd', 5, Blosc.BITSHUFFLE),
+        'strings': get_blosc('zstd', 5, Blosc.NOSHUFFLE),
+        'image': get_blosc('zstd', 5, Blosc.BITSHUFFLE),
+        'image/0': get_blosc('zstd', 3, Blosc.BITSHUFFLE),
+    },
+}
+CODEC_POLICIES['zstd_delta'] = {
+    **CODEC_POLICIES['zstd'],
+    'id_idxs': {**CODEC_POLICIES['zstd']['id_idxs'], 'filters': [Delta(dtype='<u4')]},
+    'vertex_offsets': {**CODEC_POLICIES['zstd']['vertex_offsets'], 'filters': [Delta(dtype='<u4')]},
+}
+
+def get_codec_kwargs(codecs, kind, level=None):
+    """
+    create_dataset kwargs (compressor, filters) for a dataset of the given kind. codecs is a name in CODEC_POLICIES or a policy dict
+    of the same form. level is the resolution index for image tiles.
+    """
+    if isinstance(codecs, str):
+        assert codecs in CODEC_POLICIES, f'codecs must be one of {list(CODEC_POLICIES)} or a dict, got {codecs}.'
+        codecs = CODEC_POLICIES[codecs]
+    if level is not None and f'{kind}/{level}' in codecs:
+        return dict(codecs[f'{kind}/{level}'])
+    return dict(codecs.get(kind, {}))
+
 def get_group_size(group, unit="MB"):
     """
     Get size of a zarr hierarchy group
@@ -7,4 +73,171 @@ def get_group_size(group, unit="MB"):
     size_bytes = sum(arr.nbytes for arr in group.values() if isinstance(arr, zarr.Array))
 
     unit_map = {"B": 1, "KB": 1e3, "MB": 1e6, "GB": 1e9}
-    return size_bytes / unit_map[unit]
\ No newline at end of file
+    return size_bytes / unit_map[unit]
+
+
+class IndexedConsolidatedMetadataStore(zarr.storage.ConsolidatedMetadataStore):
+    """
+    Consolidated metadata store that indexes the metadata keys by directory once, so listing a group
+    (e.g. group.groups()) is a dict lookup instead of a scan over every key in the store.
+    """
+    def __init__(self, store, metadata_key=CONSOLIDATED_KEY):
+        super().__init__(store, metadata_key=metadata_key)
+        children = defaultdict(set)
+        for key in self.meta_store:
+            parts = key.split('/')
+            for i in range(len(parts)):
+                children['/'.join(parts[:i])].add(parts[i])
+        self.children = {k: sorted(v) for k, v in children.items()}
+
+    def listdir(self, path=''):
+        return list(self.children.get(zarr.storage.normalize_storage_path(path), []))
+
+
+def consolidate_zarr_zip(store):
+    """
+    Writes consolidated metadata for a zarr.zip store opened in write mode. Should be called once, right before store.close().
+    """
+    zarr.consolidate_metadata(store, metadata_key=CONSOLIDATED_KEY)
+
+def open_zarr_zip(path: os.PathLike):
+    """
+    Opens a .zarr.zip for reading. Returns (store, root). Metadata is read from the consolidated blob when the file has one,
+    older files without it fall back to reading .zgroup/.zarray/.zattrs entries individually.
+    """
+    store = zarr.storage.ZipStore(path, mode='r')
+    if CONSOLIDATED_KEY in store:
+        meta_store = IndexedConsolidatedMetadataStore(store)
+        root = zarr.open_group(store=meta_store, chunk_store=store, mode='r')
+    else:
+        root = zarr.group(store=store)
+    return store, root
+
+
+class StagedZipStore(zarr.storage.DirectoryStore):
+    """
+    Write-only stand-in for zarr.storage.ZipStore(path, mode='w') that is safe for concurrent chunk writes.
+
+    Keys are written as files into a staging directory, and close() packs them into the final .zarr.zip
+    in one sequential pass using the same entry format as ZipStore (stored, uncompressed, 0o644).
+    """
+    def __init__(self, zarr_path, directory=None):
+        self.zarr_path = zarr_path
+        self.staging_dir = tempfile.mkdtemp(prefix='cosilico_zarr_', dir=directory)
+        super().__init__(self.staging_dir)
+
+    def close(self):
+        if self.staging_dir is None:
+            return
+        try:
+            pack_zarr_zip(self.staging_dir, self.zarr_path)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """
+        Removes the staging directory without packing it, e.g. after a failed write.
+        """
+        if self.staging_dir is None:
+            return
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        self.staging_dir = None
+
+def pack_zarr_zip(directory, zarr_path):
+    """
+    Packs a directory store into a .zarr.zip with entries laid out as zarr.storage.ZipStore writes them.
+    """
+    with zipfile.ZipFile(zarr_path, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, directory).replace(os.sep, '/')
+                keyinfo = zipfile.ZipInfo(filename=key, date_time=time.localtime(time.time())[:6])
+                keyinfo.compress_type = zipfile.ZIP_STORED
+                keyinfo.external_attr = 0o644 << 16
+                with open(path, 'rb') as f:
+                    zf.writestr(keyinfo, f.read())
+
+def get_zarr_zip_store(zarr_path, n_workers=1):
+    """
+    Store to write a .zarr.zip with. With n_workers > 1 this is a StagedZipStore so chunks can be written from a thread pool,
+    otherwise a ZipStore writing directly to zarr_path.
+    """
+    if n_workers > 1:
+        return StagedZipStore(zarr_path, directory=os.path.dirname(os.path.abspath(zarr_path)))
+    return zarr.storage.ZipStore(zarr_path, mode='w')
+
+@contextmanager
+def write_zarr_zip(zarr_path, n_workers=1):
+    """
+    Opens a store from get_zarr_zip_store to write a .zarr.zip. When the block finishes metadata is consolidated and the store closed.
+    If the block raises, a StagedZipStore's staging directory is removed instead of being packed.
+
+        with write_zarr_zip(zarr_path, n_workers=n_workers) as store:
+            root = zarr.group(store=store, overwrite=True)
+    """
+    store = get_zarr_zip_store(zarr_path, n_workers=n_workers)
+    try:
+        yield store
+        consolidate_zarr_zip(store)
+    except BaseException:
+        if isinstance(store, StagedZipStore):
+            store.discard()
+        raise
+    finally:
+        store.close()
+
+
+class ParallelArrayWriter(object):
+    """
+    Assigns values to zarr arrays (arr[:] = values) from a thread pool, so chunk encoding and compression run concurrently.
+    With n_workers <= 1 writes happen inline. At most max_pending writes are queued at a time to bound memory.
+
+        with ParallelArrayWriter(n_workers) as writer:
+            writer.write(arr, values)
+    """
+    def __init__(self, n_workers=1, max_pending=None):
+        self.n_workers = n_workers
+        self.max_pending = max_pending or 4 * n_workers
+        self.executor = ThreadPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+        self.pending = set()
+
+    def assign(self, arr, values):
+        arr[:] = values
+
+    def write(self, arr, values):
+        if self.executor is None:
+            self.assign(arr, values)
+            return
+        while len(self.pending) >= self.max_pending:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self.pending.add(self.executor.submit(self.assign, arr, values))
+
+    def close(self, cancel=False):
+        """
+        Waits for queued writes and shuts the pool down. With cancel, writes that have not started are dropped and errors from
+        running ones are not raised, for use when the caller is already failing.
+        """
+        if self.executor is None:
+            return
+        try:
+            if cancel:
+                for future in self.pending:
+                    future.cancel()
+            else:
+                for future in self.pending:
+                    future.result()
+        finally:
+            self.pending = set()
+            self.executor.shutdown(wait=True, cancel_futures=cancel)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(cancel=exc_type is not None)
+        return False
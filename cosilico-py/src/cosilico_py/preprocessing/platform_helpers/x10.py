@@ -1,42 +1,98 @@
 import h5py
+import numpy as np
 import pandas as pd
 from scipy import sparse
 
 from cosilico_py.ports.anndata import AnnData
 
-def read_10x_h5(filepath, genome=None):
+class X10H5Matrix(object):
+    """
+    Lazy (n_cells, n_features) CSR view of the count matrix in a 10x h5 file.
+
+    10x stores the matrix as CSC with one column per cell, which is CSR with one row per cell. indptr is read once
+    and data/indices are only read for the cell range being requested, so the full matrix never has to be in memory.
+    If feature_idxs is given only those features (columns) are kept, in that order.
+
+        for start, block in X.iter_row_blocks(100_000):
+            ...
+    """
+    def __init__(self, filepath, group, shape, indptr, feature_idxs=None):
+        self.filepath = filepath
+        self.group = group
+        self.indptr = indptr
+        self.feature_idxs = feature_idxs
+        self.shape = shape if feature_idxs is None else (shape[0], len(feature_idxs))
+        self.n_stored_features = shape[1]
+
+    def read_rows(self, grp, start, stop):
+        lo, hi = self.indptr[start], self.indptr[stop]
+        block = sparse.csr_matrix(
+            (grp['data'][lo:hi], grp['indices'][lo:hi], self.indptr[start:stop + 1] - lo),
+            shape=(stop - start, self.n_stored_features)
+        )
+        if self.feature_idxs is not None:
+            block = block[:, self.feature_idxs]
+        return block
+
+    def iter_row_blocks(self, chunk_size):
+        """
+        Yields (start, block) for consecutive blocks of chunk_size rows, block is a scipy CSR matrix.
+        """
+        with h5py.File(self.filepath, 'r') as f:
+            grp = f[self.group]
+            for start in range(0, self.shape[0], chunk_size):
+                yield start, self.read_rows(grp, start, min(start + chunk_size, self.shape[0]))
+
+    def __getitem__(self, key):
+        assert isinstance(key, slice) and key.step in (None, 1), f'Only row slices are supported, got {key}.'
+        start, stop, _ = key.indices(self.shape[0])
+        with h5py.File(self.filepath, 'r') as f:
+            return self.read_rows(f[self.group], start, max(start, stop))
+
+    def tocsr(self):
+        return self[:]
+
+def read_10x_h5(filepath, genome=None, gex_only=True, lazy=True):
+    """
+    Reads a 10x h5 count matrix without scanpy. Returns an AnnData with cells as obs and features as var.
+
+    With lazy=True (the default) X is an X10H5Matrix that reads cell blocks on demand, otherwise X is a scipy CSR matrix.
+    var is indexed by feature name and keeps the other feature fields (gene_ids, feature_types, genome) as columns.
+    Like scanpy.read_10x_h5, only "Gene Expression" features are kept when gex_only is True.
+    """
     with h5py.File(filepath, "r") as f:
         # Default path: matrix or genome-specific
         if "matrix" in f:
-            grp = f["matrix"]
+            group = "matrix"
         elif genome:
-            grp = f[genome]
+            group = genome
         else:
             raise ValueError("No 'matrix' group found and no genome specified.")
+        grp = f[group]
 
-        # Read sparse matrix components
-        data = grp["data"][:]
-        indices = grp["indices"][:]
-        indptr = grp["indptr"][:]
-        shape = grp["shape"][:]
-
-        # Build sparse matrix
-        matrix = sparse.csc_matrix((data, indices, indptr), shape=shape)
+        n_features, n_cells = grp["shape"][:]
+        indptr = grp["indptr"][:].astype(np.int64)
 
         # Get barcodes and gene info
         barcodes = grp["barcodes"][:].astype(str)
 
         # Newer versions (v3) have "features" instead of "genes"
         features = grp["features"]
-        gene_ids = features["id"][:].astype(str)
-        gene_names = features["name"][:].astype(str)
-
-        var = pd.DataFrame({"gene_ids": gene_ids, "gene_names": gene_names})
-        var = var.set_index('gene_names')
+        var = pd.DataFrame({"gene_ids": features["id"][:].astype(str)}, index=features["name"][:].astype(str))
+        for key, col in [("feature_type", "feature_types"), ("genome", "genome")]:
+            if key in features:
+                var[col] = features[key][:].astype(str)
         obs = pd.DataFrame(index=barcodes)
-        obs.index = barcodes
 
-        adata = AnnData(matrix.T, obs, var)
+    feature_idxs = None
+    if gex_only and "feature_types" in var:
+        keep = (var["feature_types"] == "Gene Expression").to_numpy()
+        if not keep.all():
+            feature_idxs = np.flatnonzero(keep)
+            var = var.iloc[feature_idxs]
 
-    return adata
+    X = X10H5Matrix(filepath, group, (int(n_cells), int(n_features)), indptr, feature_idxs=feature_idxs)
+    if not lazy:
+        X = X.tocsr()
 
+    return AnnData(X, obs, var)
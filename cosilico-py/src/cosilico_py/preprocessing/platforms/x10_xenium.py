@@ -10,16 +10,16 @@ from pyarrow import ArrowInvalid
 from rich import print
 import numpy as np
 import pandas as pd
-import scanpy as sc
-import zarr
 
 from cosilico_py.config import get_config
 from cosilico_py.models import Experiment, ExperimentUploadBundle
-# from cosilico_py.preprocessing.platform_helpers.x10 import read_10x_h5
+from cosilico_py.preprocessing.platform_helpers.x10 import read_10x_h5
 from cosilico_py.preprocessing.core.image import (
     get_resolutions,
     write_image_zarr_from_ome,
 )
+from cosilico_py.preprocessing.core.profiling import StageProfiler, get_output_bytes
+from cosilico_py.preprocessing.core.zarr import open_zarr_zip
 from cosilico_py.preprocessing.core.layer import (
     combine_barcoded_data,
     write_grouped_layer_zarr_from_df,
@@ -99,6 +99,7 @@ def experiment_from_x10_xenium_cellranger(
         bbox: Annotated[Union[Iterable[int], None], 'Bounding box to crop to. Format is [top, bottom, left, right]. Default is None.'] = None,
         to_uint8: Annotated[bool, 'Default is False. If True, will convert the Xenium IHC image to UINT8. This can save space for images that are UINT16.'] = False,
         verbose: Annotated[bool, 'Whether to display verbose output. Default is True.'] = True,
+        profile: Annotated[bool, 'Whether to record wall time, CPU time, peak RSS and bytes written for each stage. The report is attached to the returned bundle and written to the cache directory. Default is False.'] = False,
     ):
     directory = Path(directory).expanduser().absolute()
     assert directory.is_dir(), f'Input directory {directory} is not a directory.'
@@ -108,6 +109,22 @@ def experiment_from_x10_xenium_cellranger(
     config = get_config()
     output_directory = config['cache_dir']
 
+    profiler = StageProfiler(enabled=profile)
+    with profiler:
+        bundle = build_x10_xenium_bundle(directory, name, bbox, to_uint8, verbose, config, output_directory, profiler)
+
+    if profile:
+        bundle.profile = profiler.report()
+        profile_path = Path(output_directory).expanduser().absolute() / f'{bundle.experiment.id}.profile.json'
+        profiler.write(profile_path)
+        if verbose: print(f'Wrote preprocessing profile to [green]{profile_path}[/green]')
+
+    return bundle
+
+def build_x10_xenium_bundle(directory, name, bbox, to_uint8, verbose, config, output_directory, profiler):
+    """
+    Runs the preprocessing stages of experiment_from_x10_xenium_cellranger, recording each with profiler.
+    """
     path = directory / 'experiment.xenium'
     assert path.is_file(), f'Could not find experiment file at: {path}.'
     xenium_metadata = json.load(open(path))
@@ -130,16 +147,18 @@ def experiment_from_x10_xenium_cellranger(
         ome_tiff_path = directory / 'morphology_focus' / 'morphology_focus_0002.ome.tif'
     assert ome_tiff_path.is_file(), 'Could not find Xenium morphology image at morphology_focus.ome.tif or morphology_focus/.'
     if verbose: print(f'Loading xenium morphology image from [green]{ome_tiff_path}[/green]')
-    image = write_image_zarr_from_ome(
-        experiment.id,
-        ome_tiff_path,
-        'Xenium Morphology',
-        output_directory,
-        tile_size = 512,
-        res_magnitude = 4,
-        bbox = bbox,
-        to_uint8 = to_uint8
-    )
+    with profiler.stage('image') as record:
+        image = write_image_zarr_from_ome(
+            experiment.id,
+            ome_tiff_path,
+            'Xenium Morphology',
+            output_directory,
+            tile_size = 512,
+            res_magnitude = 4,
+            bbox = bbox,
+            to_uint8 = to_uint8
+        )
+        record['output_bytes'] = get_output_bytes(image)
     experiment.image_ids.append(image.id)
     pixels = image.metadata.images[0].pixels
     max_dim_size = max(pixels.size_x, pixels.size_y)
@@ -156,30 +175,33 @@ def experiment_from_x10_xenium_cellranger(
     transcripts_path = directory / 'transcripts.parquet'
     assert transcripts_path.is_file(), f'Could not find transcripts at {transcripts_path}.'
     if verbose: print(f'Loading xenium transcripts from [green]{transcripts_path}[/green]')
-    source = load_transcript_df(transcripts_path, mpp=mpp, bbox=bbox)
+    with profiler.stage('load_transcripts'):
+        source = load_transcript_df(transcripts_path, mpp=mpp, bbox=bbox)
 
     zooms = get_resolutions(tile_size, max_dim_size, scaler=res_magnitude)
     group_sizes = [int(initial_group_size / (res_magnitude * 2)**i) for i in range(len(zooms))]
     bin_size_map = {res:i * res_magnitude * bin_size for i, res in enumerate(zooms) if i}
 
-    transcript_layer = write_grouped_layer_zarr_from_df(
-        experiment.id,
-        source,
-        'transcript_id',
-        zooms,
-        bin_size_map,
-        group_sizes,
-        output_directory,
-        (pixels.size_x, pixels.size_y),
-        name='Transcripts',
-        chunk_size = 10_000_000,
-        use_disk = True,
-    )
+    with profiler.stage('transcript_layer') as record:
+        transcript_layer = write_grouped_layer_zarr_from_df(
+            experiment.id,
+            source,
+            'transcript_id',
+            zooms,
+            bin_size_map,
+            group_sizes,
+            output_directory,
+            (pixels.size_x, pixels.size_y),
+            name='Transcripts',
+            chunk_size = 10_000_000,
+            use_disk = True,
+            pyramid = True,
+        )
+        record['output_bytes'] = get_output_bytes(transcript_layer)
     experiment.layer_ids.append(transcript_layer.id)
 
     # transcript metadata
-    store = zarr.storage.ZipStore(transcript_layer.local_path, mode='r')
-    root = zarr.group(store=store)
+    store, root = open_zarr_zip(transcript_layer.local_path)
     attrs = root.attrs
     zoom_to_order = {res:root[f'/metadata/ids/{res}'][:] for res in attrs['resolutions']}
     fnames = root['/metadata/features/feature_names'][:]
@@ -194,27 +216,31 @@ def experiment_from_x10_xenium_cellranger(
     }
     if verbose: print(f'Loading xenium transcript metadata for [green]{list(value_params.keys())}[/green]')
 
-    transcript_metas = write_grouped_metadata_zarrs_from_df(
-        transcript_layer.id,
-        source,
-        'transcript_id',
-        output_directory,
-        bin_size_map,
-        fnames,
-        attrs,
-        zoom_to_order,
-        value_params,
-        'feature_name',
-        chunk_size = 10_000_000,
-        use_disk = True,
-    )
+    with profiler.stage('transcript_metadata') as record:
+        transcript_metas = write_grouped_metadata_zarrs_from_df(
+            transcript_layer.id,
+            source,
+            'transcript_id',
+            output_directory,
+            bin_size_map,
+            fnames,
+            attrs,
+            zoom_to_order,
+            value_params,
+            'feature_name',
+            chunk_size = 10_000_000,
+            use_disk = True,
+            pyramid = True,
+        )
+        record['output_bytes'] = get_output_bytes(transcript_metas)
 
 
     ## cell layer
     cell_poly_path = directory / 'cell_boundaries.parquet'
     assert cell_poly_path.is_file(), f'Cell boundaries not found at {cell_poly_path}'
     if verbose: print(f'Loading xenium cell boundaries from [green]{cell_poly_path}[/green]')
-    df = load_cell_df(cell_poly_path, mpp=mpp, bbox=bbox)
+    with profiler.stage('load_cells'):
+        df = load_cell_df(cell_poly_path, mpp=mpp, bbox=bbox)
 
     tile_size = 4096
     res_magnitude = 2
@@ -223,6 +249,8 @@ def experiment_from_x10_xenium_cellranger(
     max_vert_map = {int(k):v for k, v in config['preprocessing']['layer']['cells_max_vert_map'].items()}
     downsample_map = {int(k):v for k, v in config['preprocessing']['layer']['cells_downsample_map'].items()}
     object_type_map = {int(k):v for k, v in config['preprocessing']['layer']['cells_object_type_map'].items()}
+    simplify_map = {int(k):v for k, v in config['preprocessing']['layer'].get('cells_simplify_map', {}).items()}
+    tile_budget_map = {int(k):v for k, v in config['preprocessing']['layer'].get('cells_tile_budget_map', {}).items()}
     # max_vert_map = {
     #     4096: 32,
     #     8192: 4
@@ -238,36 +266,44 @@ def experiment_from_x10_xenium_cellranger(
     #     8192: 'polygon'
     # }
     
-    cell_layer = write_ungrouped_layer_zarr_from_df(
-        experiment.id,
-        'Cells',
-        df,
-        'cell_id',
-        zooms,
-        output_directory,
-        max_vert_map,
-        downsample_map,
-        object_type_map,
-    )
+    with profiler.stage('cell_layer') as record:
+        cell_layer = write_ungrouped_layer_zarr_from_df(
+            experiment.id,
+            'Cells',
+            df,
+            'cell_id',
+            zooms,
+            output_directory,
+            max_vert_map,
+            downsample_map,
+            object_type_map,
+            simplify_map=simplify_map,
+            tile_budget_map=tile_budget_map,
+            tile_size=tile_size,
+        )
+        record['output_bytes'] = get_output_bytes(cell_layer)
     experiment.layer_ids.insert(0, cell_layer.id)
 
     # cell metadata
     h5_path = directory / 'cell_feature_matrix.h5'
     assert h5_path.is_file(), f'Cell feature matrix not found at {h5_path}'
     if verbose: print(f'Loading xenium cell transcript counts [green]{h5_path}[/green]')
-    adata = sc.read_10x_h5(h5_path)
-    source = combine_barcoded_data(None, adata, chunk_size=1_000_000).sort_index()
-    fnames = np.asarray(source['feature_name'].cat.categories.to_list(), dtype=object)
-
-    cell_transcript_count_meta = write_sparse_continuous_ungrouped_layer_metadata(
-        cell_layer.id,
-        fnames,
-        'Transcript Counts',
-        source,
-        'count',
-        cell_layer.local_path,
-        output_directory,
-    )
+    with profiler.stage('load_counts'):
+        adata = read_10x_h5(h5_path)
+        source = combine_barcoded_data(None, adata, chunk_size=1_000_000).sort_index()
+        fnames = np.asarray(source['feature_name'].cat.categories.to_list(), dtype=object)
+
+    with profiler.stage('cell_metadata') as record:
+        cell_transcript_count_meta = write_sparse_continuous_ungrouped_layer_metadata(
+            cell_layer.id,
+            fnames,
+            'Transcript Counts',
+            source,
+            'count',
+            cell_layer.local_path,
+            output_directory,
+        )
+        record['output_bytes'] = get_output_bytes(cell_transcript_count_meta)
 
     bundle = ExperimentUploadBundle(
         experiment = experiment,
@@ -0,0 +1,56 @@
+import dask.array as da
+import numpy as np
+import pytest
+from ome_types.model import OME, Image, Pixels
+
+from cosilico_py.preprocessing.core.image import write_image_zarr
+from cosilico_py.preprocessing.core.zarr import open_zarr_zip
+
+
+TILE_SIZE = 64
+
+def make_ome(image):
+    pixels = Pixels(
+        dimension_order='XYZCT', type='uint16', size_x=image.shape[0], size_y=image.shape[1],
+        size_z=image.shape[2], size_c=image.shape[3], size_t=image.shape[4], physical_size_x=0.2125,
+    )
+    return OME(images=[Image(pixels=pixels)])
+
+def write_levels(image, path, **kwargs):
+    write_image_zarr(da.from_array(image, chunks=(256, 256, 1, 1, 1)), make_ome(image), path, tile_size=TILE_SIZE, res_magnitude=2, **kwargs)
+    store, root = open_zarr_zip(path)
+    try:
+        return root.attrs['resolutions'], {res: root[f'zooms/{res}/tiles'][:] for res in root.attrs['resolutions']}
+    finally:
+        store.close()
+
+def make_image(extent=(1000, 900), seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 1 << 16, (*extent, 1, 2, 1), dtype=np.uint16)
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_cascade_matches_direct_on_first_levels(tmp_path, n_workers):
+    image = make_image()
+    resolutions, direct = write_levels(image, tmp_path / 'direct.zarr.zip', pyramid='direct')
+    cascade_resolutions, cascade = write_levels(image, tmp_path / 'cascade.zarr.zip', pyramid='cascade', n_workers=n_workers)
+
+    assert cascade_resolutions == resolutions == [64, 128, 256, 512, 1024]
+    for res in resolutions:
+        assert cascade[res].shape == direct[res].shape
+        assert cascade[res].dtype == direct[res].dtype
+    # full resolution is copied and the first downsample reads the same pixels, past that nearest neighbour picks may differ
+    for res in resolutions[:2]:
+        np.testing.assert_array_equal(cascade[res], direct[res])
+
+def test_cascade_matches_direct_on_tile_constant_image(tmp_path):
+    # with every source tile a single value, any nearest neighbour pick inside a tile agrees
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 1 << 16, (15, 14, 1, 2, 1), dtype=np.uint16)
+    image = blocks.repeat(TILE_SIZE, axis=0).repeat(TILE_SIZE, axis=1)
+
+    _, direct = write_levels(image, tmp_path / 'direct.zarr.zip', pyramid='direct')
+    _, cascade = write_levels(image, tmp_path / 'cascade.zarr.zip', pyramid='cascade')
+
+    for res in direct:
+        np.testing.assert_array_equal(cascade[res], direct[res])
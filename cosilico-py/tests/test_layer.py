@@ -0,0 +1,273 @@
+import numcodecs
+import numpy as np
+import pandas as pd
+import pytest
+import zarr
+from scipy import sparse
+
+from cosilico_py.client.experiment import extract_grouped_layer, extract_ungrouped_layer, get_layer_ids
+from cosilico_py.ports.anndata import AnnData
+from cosilico_py.preprocessing.core.layer import (
+    combine_barcoded_data,
+    dequantize_tile_coordinates,
+    get_zoom_to_subs,
+    get_zoom_to_sparse_dfs,
+    write_grouped_layer_zarr_from_df,
+    write_sparse_continuous_ungrouped_layer_metadata,
+    write_ungrouped_layer_zarr_from_df,
+)
+from cosilico_py.preprocessing.core.tiling import generate_tiled_data_grouped, get_tile_offsets
+from cosilico_py.preprocessing.core.zarr import open_zarr_zip, ParallelArrayWriter
+
+
+def make_transcripts(n_features=20, n_per_feature=200, extent=4096, seed=0):
+    """
+    Transcripts where feature f only occurs in the vertical strip f % 4 of the slide, and has 10 * f more rows than feature 0.
+    With round robin grouping into 4 groups every strip only holds a single group.
+    """
+    rng = np.random.default_rng(seed)
+    strip = extent / 4
+    dfs = []
+    for f in range(n_features):
+        n = n_per_feature + 10 * f
+        dfs.append(pd.DataFrame({
+            'feature_name': f'gene{f:02d}',
+            'x_location': rng.uniform((f % 4) * strip, (f % 4 + 1) * strip, n).astype(np.float32),
+            'y_location': rng.uniform(0, extent, n).astype(np.float32),
+        }))
+    df = pd.concat(dfs, ignore_index=True)
+    df['feature_name'] = df['feature_name'].astype('category')
+    df['feature_index'] = pd.Categorical(df['feature_name'].cat.codes)
+    df['transcript_id'] = np.arange(len(df), dtype=np.uint64) + 1000
+    return df
+
+def write_layer(df, directory, **kwargs):
+    return write_grouped_layer_zarr_from_df(
+        'experiment', df, 'transcript_id', [1024, 4096], {4096: 128}, [5, 5], directory, (4096, 4096),
+        use_disk=False, **kwargs
+    )
+
+def read_layer(path):
+    store, root = open_zarr_zip(path)
+    try:
+        return extract_grouped_layer(None, root, {}, include_all=False)
+    finally:
+        store.close()
+
+def assert_matches_source(result, df, atol=1e-3):
+    expected = df.assign(id=df['transcript_id'].astype(str)).set_index('id').sort_index()
+    result = result.sort_index()
+    assert result.index.astype(str).tolist() == expected.index.tolist()
+    np.testing.assert_allclose(result['x_location'], expected['x_location'], atol=atol)
+    np.testing.assert_allclose(result['y_location'], expected['y_location'], atol=atol)
+    assert result['feature_name'].astype(str).tolist() == expected['feature_name'].astype(str).tolist()
+
+
+def test_get_tile_offsets_skips_empty_tiles():
+    df = make_transcripts()
+    tiled = generate_tiled_data_grouped(df, n_per_group=5, grid_size=1024)
+    offsets = get_tile_offsets(tiled)
+
+    assert (offsets['stop'] > offsets['start']).all()
+    observed = tiled.groupby(['grid', 'group'], observed=True).size()
+    assert len(offsets['grid']) == len(observed)
+    # every strip holds one of the four groups, so most (grid, group) combinations are empty
+    assert len(observed) < len(tiled.index.levels[0]) * len(tiled.index.levels[1])
+    for grid, group, start, stop in zip(offsets['grid'], offsets['group'], offsets['start'], offsets['stop']):
+        assert stop - start == observed[(grid, group)]
+        assert (tiled.index[start:stop] == (grid, group)).all()
+
+@pytest.mark.parametrize('layout', ['columns', 'packed'])
+def test_grouped_layer_with_missing_groups(tmp_path, layout):
+    df = make_transcripts()
+    layer = write_layer(df, tmp_path, layout=layout)
+    assert_matches_source(read_layer(layer.local_path), df)
+
+@pytest.mark.parametrize('kwargs', [
+    {'layout': 'packed'},
+    {'layout': 'packed', 'n_workers': 2},
+    {'id_encoding': 'integer'},
+    {'id_encoding': 'dictionary'},
+    {'layout': 'packed', 'id_encoding': 'integer'},
+    {'layout': 'packed', 'id_encoding': 'dictionary'},
+    {'codecs': 'zstd'},
+    {'codecs': 'zstd_delta'},
+    {'layout': 'packed', 'codecs': 'zstd_delta'},
+    {'coordinate_encoding': 'uint16'},
+    {'layout': 'packed', 'coordinate_encoding': 'uint16'},
+    {'layout': 'packed', 'id_encoding': 'dictionary', 'coordinate_encoding': 'uint16', 'codecs': 'zstd_delta', 'n_workers': 2},
+])
+def test_grouped_layer_encodings_round_trip(tmp_path, kwargs):
+    df = make_transcripts()
+    layer = write_layer(df, tmp_path, **kwargs)
+    # uint16 offsets over a 4096 grid plus margins are rounded to 1 / 64
+    atol = 1 / 128 if kwargs.get('coordinate_encoding') == 'uint16' else 1e-3
+    assert_matches_source(read_layer(layer.local_path), df, atol=atol)
+
+def test_get_layer_ids_at_coarse_zoom(tmp_path):
+    df = make_transcripts()
+    dictionary_layer = write_layer(df, tmp_path, id_encoding='dictionary')
+    integer_layer = write_layer(df, tmp_path, id_encoding='integer')
+
+    store, root = open_zarr_zip(dictionary_layer.local_path)
+    integer_store, integer_root = open_zarr_zip(integer_layer.local_path)
+    try:
+        assert root.attrs['id_encodings'] == {'1024': 'dictionary', '4096': 'bin'}
+        fine_ids = get_layer_ids(root, 1024)
+        assert sorted(fine_ids.astype(str)) == sorted(df['transcript_id'].astype(str))
+        # coarse zooms hold packed bin IDs, which are not codes into id_table
+        coarse_ids = get_layer_ids(root, 4096)
+        assert coarse_ids.dtype == np.uint64
+        np.testing.assert_array_equal(coarse_ids, get_layer_ids(integer_root, 4096))
+    finally:
+        store.close()
+        integer_store.close()
+
+def test_balanced_grouped_layer_round_trip(tmp_path):
+    df = make_transcripts()
+    layer = write_layer(df, tmp_path, grouping='balanced', target_chunk_bytes=20_000)
+    assert_matches_source(read_layer(layer.local_path), df)
+
+def test_failed_parallel_write_cleans_up(tmp_path, monkeypatch):
+    calls = {'n': 0}
+    write = ParallelArrayWriter.write
+    def failing_write(self, dataset, values):
+        calls['n'] += 1
+        if calls['n'] == 5:
+            raise RuntimeError('write failed')
+        return write(self, dataset, values)
+    writers = []
+    init = ParallelArrayWriter.__init__
+    def tracking_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        writers.append(self)
+    monkeypatch.setattr(ParallelArrayWriter, 'write', failing_write)
+    monkeypatch.setattr(ParallelArrayWriter, '__init__', tracking_init)
+
+    with pytest.raises(RuntimeError, match='write failed'):
+        write_layer(make_transcripts(), tmp_path, n_workers=2)
+
+    assert list(tmp_path.iterdir()) == []
+    assert writers and all(writer.executor is None for writer in writers)
+
+def test_simplify_tolerance_scales_with_tile_size():
+    theta = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+    df = pd.DataFrame({
+        'cell_id': np.repeat(['a', 'b'], len(theta)),
+        'vertex_x': np.concatenate([100 + 10 * np.cos(theta), 300 + 10 * np.cos(theta)]),
+        'vertex_y': np.concatenate([100 + 10 * np.sin(theta), 300 + 10 * np.sin(theta)]),
+    })
+    def n_verts(tile_size):
+        subs = get_zoom_to_subs(df, 'cell_id', [4096], {4096: None}, {4096: -1}, simplify_map={4096: 0.5}, tile_size=tile_size)
+        return max(info['n_verts'] for info in subs[4096].values())
+
+    assert n_verts(512) < n_verts(4096) <= len(theta)
+
+def make_cells(n_cells=80, n_genes=6, extent=4096, seed=0):
+    """
+    Octagonal cells with random centers, some straddling tile edges, and a sparse count matrix for them.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(20, extent - 20, (n_cells, 2))
+    theta = np.linspace(0, 2 * np.pi, 8, endpoint=False)
+    ids = np.asarray([f'cell{i:03d}' for i in range(n_cells)], dtype=object)
+    df = pd.DataFrame({
+        'cell_id': np.repeat(ids, len(theta)),
+        'vertex_x': (centers[:, [0]] + 10 * np.cos(theta)).ravel(),
+        'vertex_y': (centers[:, [1]] + 10 * np.sin(theta)).ravel(),
+    })
+    counts = sparse.random(n_cells, n_genes, density=0.5, format='csr', random_state=seed, data_rvs=lambda k: rng.integers(1, 20, k))
+    adata = AnnData(counts.astype(np.float32), pd.DataFrame(index=ids), pd.DataFrame(index=[f'gene{i}' for i in range(n_genes)]))
+    return df, centers, adata
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'polygon_layout': 'ragged'},
+    {'coordinate_encoding': 'uint16'},
+    {'polygon_layout': 'ragged', 'coordinate_encoding': 'uint16', 'codecs': 'zstd_delta', 'n_workers': 2},
+])
+def test_ungrouped_layer_round_trip(tmp_path, kwargs):
+    df, centers, adata = make_cells()
+    zooms = [1024, 4096]
+    layer = write_ungrouped_layer_zarr_from_df(
+        'experiment', 'Cells', df, 'cell_id', zooms, tmp_path,
+        {z: 32 for z in zooms}, {z: -1 for z in zooms}, {z: 'polygon' for z in zooms}, **kwargs
+    )
+    source = combine_barcoded_data(None, adata).sort_index()
+    fnames = np.asarray(source['feature_name'].cat.categories.to_list(), dtype=object)
+    meta = write_sparse_continuous_ungrouped_layer_metadata(layer.id, fnames, 'Transcript Counts', source, 'count', layer.local_path, tmp_path)
+
+    store, root = open_zarr_zip(layer.local_path)
+    meta_store, meta_root = open_zarr_zip(meta.local_path)
+    try:
+        result = extract_ungrouped_layer(layer, root, meta, {meta.name: meta_root}, {meta.name: meta}, include_all=False)
+    finally:
+        store.close()
+        meta_store.close()
+
+    # rows come back in the layer's metadata/ids order, which lists cells straddling a tile edge once per tile
+    result = result[~result.obs.index.duplicated()]
+    ids = result.obs.index.to_numpy()
+    assert sorted(ids) == sorted(adata.obs.index)
+    order = adata.obs.index.get_indexer(ids)
+    atol = 1 / 64 if kwargs.get('coordinate_encoding') == 'uint16' else 1e-3
+    np.testing.assert_allclose(result.obsm['spatial'], centers[order], atol=atol)
+    assert result.var.index.tolist() == fnames.tolist()
+    expected = pd.DataFrame(adata.X.toarray(), index=adata.obs.index, columns=adata.var.index).loc[ids, fnames]
+    np.testing.assert_array_equal(np.asarray(result.X.todense()), expected.to_numpy())
+
+def test_uint16_padded_polygons_with_mixed_vertex_counts(tmp_path):
+    rng = np.random.default_rng(1)
+    n_cells = 50
+    centers = rng.uniform(20, 4076, (n_cells, 2))
+    n_verts = rng.integers(5, 12, n_cells)
+    theta = np.concatenate([np.linspace(0, 2 * np.pi, n, endpoint=False) for n in n_verts])
+    df = pd.DataFrame({
+        'cell_id': np.repeat([f'cell{i:03d}' for i in range(n_cells)], n_verts),
+        'vertex_x': np.repeat(centers[:, 0], n_verts) + 10 * np.cos(theta),
+        'vertex_y': np.repeat(centers[:, 1], n_verts) + 10 * np.sin(theta),
+    })
+    zooms = [1024, 4096]
+    def write(directory, **kwargs):
+        directory.mkdir()
+        return write_ungrouped_layer_zarr_from_df(
+            'experiment', 'Cells', df, 'cell_id', zooms, directory,
+            {z: 32 for z in zooms}, {z: -1 for z in zooms}, {z: 'polygon' for z in zooms}, **kwargs
+        )
+    expected_layer = write(tmp_path / 'float32')
+    layer = write(tmp_path / 'uint16', coordinate_encoding='uint16')
+
+    expected_store, expected_root = open_zarr_zip(expected_layer.local_path)
+    store, root = open_zarr_zip(layer.local_path)
+    try:
+        attrs = root.attrs.asdict()
+        checked = []
+        for zoom in zooms:
+            grids = sorted(expected_root[f'zooms/{zoom}'].group_keys())
+            assert sorted(root[f'zooms/{zoom}'].group_keys()) == grids
+            step = attrs['coordinates']['steps'][str(zoom)]
+            for grid in grids:
+                expected = expected_root[f'zooms/{zoom}/{grid}/vertices'][:]
+                result = dequantize_tile_coordinates(root[f'zooms/{zoom}/{grid}/vertices'][:], attrs, zoom, grid)
+                # padding comes back as -1 exactly, vertices within half a step
+                np.testing.assert_array_equal(result == -1, expected == -1)
+                np.testing.assert_allclose(result, expected, atol=step / 2 + 1e-3)
+                checked.append(grid)
+        assert any(grid != '0_0' for grid in checked)
+    finally:
+        expected_store.close()
+        store.close()
+
+def test_get_zoom_to_sparse_dfs_skips_missing_index_values():
+    rng = np.random.default_rng(0)
+    index = rng.choice(np.array([f'cell{i}' for i in range(30)] + [None] * 5, dtype=object), 400)
+    source = pd.DataFrame({'count': np.arange(len(index))}, index=pd.Index(index, name='barcode'))
+    root = zarr.group()
+    grid_ids = {'0_0': [f'cell{i}' for i in range(0, 20)], '0_1': [f'cell{i}' for i in range(15, 30)] + ['missing']}
+    for grid, ids in grid_ids.items():
+        root.create_group(f'zooms/1024/{grid}').array('id', np.asarray(ids, dtype=object), dtype=object, object_codec=numcodecs.VLenUTF8())
+
+    zoom_to_dfs = get_zoom_to_sparse_dfs(source, root)
+
+    for grid, ids in grid_ids.items():
+        pd.testing.assert_frame_equal(zoom_to_dfs['1024'][grid], source[source.index.isin(ids)])
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cosilico_py.preprocessing.core.tiling import compute_grid_centroids_multi, pack_keys, unpack_keys
+
+
+def make_points(n=20_000, n_features=12, extent=2000, feature_dtype=np.int64, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'feature_index': rng.integers(0, n_features, n).astype(feature_dtype),
+        'x_location': rng.uniform(0, extent, n).astype(np.float32),
+        'y_location': rng.uniform(0, extent, n).astype(np.float32),
+        'qv': rng.uniform(10, 40, n).astype(np.float32),
+    })
+
+def sort_centroids(df):
+    keys = [col for col in ['feature_index', 'bin_x', 'bin_y'] if col in df.columns]
+    return df.sort_values(keys).reset_index(drop=True)
+
+def assert_centroids_close(result, expected):
+    assert list(result) == list(expected)
+    for bin_size in expected:
+        a, b = sort_centroids(result[bin_size]), sort_centroids(expected[bin_size])
+        assert list(a.columns) == list(b.columns)
+        assert len(a) == len(b)
+        for col in b.columns:
+            np.testing.assert_allclose(a[col].to_numpy(dtype=np.float64), b[col].to_numpy(dtype=np.float64), rtol=1e-5, atol=1e-3)
+
+
+BIN_SIZES = [32, 64, 128, 256]
+
+@pytest.mark.parametrize('feature_dtype', [np.int64, np.uint64, np.uint16])
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'pyramid': True},
+    {'n_workers': 2},
+    {'n_workers': 2, 'pyramid': True},
+    {'use_disk': True, 'memory_budget': 10_000},
+    {'use_disk': True, 'memory_budget': 10_000, 'n_workers': 2, 'pyramid': True},
+])
+def test_bincount_engine_matches_unique(feature_dtype, kwargs):
+    df = make_points(feature_dtype=feature_dtype)
+    # a single chunk, the unique engine averages per chunk means otherwise
+    expected = compute_grid_centroids_multi(df, BIN_SIZES, chunk_size=len(df), use_disk=False, target_columns=['qv'], engine='unique')
+    result = compute_grid_centroids_multi(
+        df, BIN_SIZES, chunk_size=3_000, target_columns=['qv'], engine='bincount', **{'use_disk': False, **kwargs}
+    )
+    assert_centroids_close(result, expected)
+
+def test_bincount_engine_without_grouping():
+    df = make_points()
+    expected = compute_grid_centroids_multi(df, BIN_SIZES, chunk_size=len(df), use_disk=False, group_by_index=False, engine='unique')
+    result = compute_grid_centroids_multi(df, BIN_SIZES, chunk_size=3_000, use_disk=False, group_by_index=False, pyramid=True)
+    assert_centroids_close(result, expected)
+
+def test_pack_keys_round_trip():
+    rng = np.random.default_rng(0)
+    columns = [rng.integers(5, 50, 1000).astype(np.uint64), rng.integers(-20, 20, 1000), rng.integers(0, 3, 1000).astype(np.uint8)]
+    keys, mins, extents = pack_keys(columns)
+    assert keys.dtype == np.int64
+    for col, unpacked in zip(columns, unpack_keys(keys, mins, extents)):
+        np.testing.assert_array_equal(unpacked, col.astype(np.int64))
+    # packed keys sort like the columns sorted lexicographically
+    np.testing.assert_array_equal(np.argsort(keys, kind='stable'), np.lexsort(columns[::-1]))
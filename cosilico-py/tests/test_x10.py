@@ -0,0 +1,93 @@
+import h5py
+import numpy as np
+import pytest
+from scipy import sparse
+
+from cosilico_py.preprocessing.core.layer import combine_barcoded_data
+from cosilico_py.preprocessing.platform_helpers.x10 import X10H5Matrix, read_10x_h5
+
+
+FEATURE_TYPES = ['Gene Expression', 'Negative Control Probe', 'Gene Expression', 'Gene Expression', 'Negative Control Codeword', 'Gene Expression']
+
+def make_counts(n_cells=37, seed=0):
+    """
+    Dense (n_cells, n_features) counts with some empty cells, control features interleaved with genes.
+    """
+    rng = np.random.default_rng(seed)
+    dense = rng.integers(1, 9, (n_cells, len(FEATURE_TYPES))) * (rng.random((n_cells, len(FEATURE_TYPES))) < 0.4)
+    dense[[0, 5, -1]] = 0
+    return dense.astype(np.int32)
+
+def write_10x_h5(path, dense):
+    """
+    10x formatted h5 count matrix, stored as CSC with one column per cell.
+    """
+    n_cells, n_features = dense.shape
+    X = sparse.csc_matrix(dense.T)
+    names = [f'feature{i}' for i in range(n_features)]
+    with h5py.File(path, 'w') as f:
+        grp = f.create_group('matrix')
+        grp.create_dataset('barcodes', data=np.asarray([f'cell{i:03d}' for i in range(n_cells)], dtype='S'))
+        grp.create_dataset('shape', data=np.asarray([n_features, n_cells], dtype=np.int32))
+        grp.create_dataset('data', data=X.data)
+        grp.create_dataset('indices', data=X.indices.astype(np.int64))
+        grp.create_dataset('indptr', data=X.indptr.astype(np.int64))
+        features = grp.create_group('features')
+        features.create_dataset('id', data=np.asarray([f'ID{i}' for i in range(n_features)], dtype='S'))
+        features.create_dataset('name', data=np.asarray(names, dtype='S'))
+        features.create_dataset('feature_type', data=np.asarray(FEATURE_TYPES, dtype='S'))
+        features.create_dataset('genome', data=np.asarray(['synthetic'] * n_features, dtype='S'))
+
+@pytest.fixture
+def counts(tmp_path):
+    dense = make_counts()
+    path = tmp_path / 'cell_feature_matrix.h5'
+    write_10x_h5(path, dense)
+    return path, dense
+
+
+@pytest.mark.parametrize('gex_only', [True, False])
+def test_read_10x_h5_matches_dense(counts, gex_only):
+    path, dense = counts
+    keep = [i for i, t in enumerate(FEATURE_TYPES) if t == 'Gene Expression' or not gex_only]
+    expected = dense[:, keep]
+
+    adata = read_10x_h5(path, gex_only=gex_only)
+    assert isinstance(adata.X, X10H5Matrix)
+    assert adata.X.shape == expected.shape
+    assert adata.obs.index.tolist() == [f'cell{i:03d}' for i in range(dense.shape[0])]
+    assert adata.var.index.tolist() == [f'feature{i}' for i in keep]
+    assert adata.var['gene_ids'].tolist() == [f'ID{i}' for i in keep]
+    assert adata.var['feature_types'].tolist() == [FEATURE_TYPES[i] for i in keep]
+
+    np.testing.assert_array_equal(adata.X.tocsr().toarray(), expected)
+    np.testing.assert_array_equal(adata.X[5:20].toarray(), expected[5:20])
+    np.testing.assert_array_equal(adata.X[30:100].toarray(), expected[30:])
+
+    blocks = list(adata.X.iter_row_blocks(8))
+    assert [start for start, _ in blocks] == list(range(0, dense.shape[0], 8))
+    np.testing.assert_array_equal(sparse.vstack([block for _, block in blocks]).toarray(), expected)
+
+    eager = read_10x_h5(path, gex_only=gex_only, lazy=False)
+    assert sparse.isspmatrix_csr(eager.X)
+    np.testing.assert_array_equal(eager.X.toarray(), expected)
+
+def test_read_10x_h5_matches_scanpy(counts):
+    sc = pytest.importorskip('scanpy')
+    path, _ = counts
+    expected = sc.read_10x_h5(path)
+    adata = read_10x_h5(path, lazy=False)
+
+    assert adata.obs.index.tolist() == expected.obs.index.tolist()
+    assert adata.var.index.tolist() == expected.var.index.tolist()
+    np.testing.assert_array_equal(adata.X.toarray(), expected.X.toarray())
+
+def test_combine_barcoded_data_from_lazy_matrix(counts):
+    path, dense = counts
+    adata = read_10x_h5(path)
+    source = combine_barcoded_data(None, adata, chunk_size=8)
+
+    expected = dense[:, adata.X.feature_idxs]
+    rows, cols = np.nonzero(expected)
+    result = sorted(zip(source.index.astype(str), source['feature_name'].astype(str), source['count']))
+    assert result == sorted(zip(adata.obs.index[rows], adata.var.index[cols], expected[rows, cols]))